@@ -0,0 +1,126 @@
+"""Benchmarks for the hot paths of ``HDFSContentsManager``.
+
+Run with::
+
+    py.test benchmarks
+
+Operations are run against an in-memory filesystem with simulated namenode
+latency. For each operation we record wall time, the number of namenode
+calls, bytes read/written, and peak memory. Tests fail if an operation makes
+more namenode calls than expected.
+
+Environment variables:
+
+- ``HDFSCM_BENCH_LATENCY``: simulated latency per namenode call in seconds
+  (default 0.001).
+- ``HDFSCM_BENCH_FULL``: if set, run with the full range of notebook sizes
+  (up to 500 MB) and directory sizes (up to 100k entries).
+- ``HDFSCM_BENCH_OUTPUT``: if set, write all results as JSON to this path.
+"""
+import json
+import os
+import time
+import tracemalloc
+
+import pytest
+
+from hdfscm import HDFSContentsManager
+from hdfscm.fakefs import MemoryFileSystem
+
+
+LATENCY = float(os.environ.get('HDFSCM_BENCH_LATENCY', 0.001))
+FULL = bool(os.environ.get('HDFSCM_BENCH_FULL'))
+
+RESULTS = []
+
+
+class Measurement(object):
+    def __init__(self, name, wall_time, calls, bytes_read, bytes_written,
+                 peak_memory):
+        self.name = name
+        self.wall_time = wall_time
+        self.calls = calls
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+        self.peak_memory = peak_memory
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def to_dict(self):
+        return {'name': self.name,
+                'wall_time': self.wall_time,
+                'calls': dict(self.calls),
+                'total_calls': self.total_calls,
+                'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written,
+                'peak_memory': self.peak_memory}
+
+
+class Bench(object):
+    """Measure operations against a contents manager"""
+    def __init__(self, cm):
+        self.cm = cm
+        self.fs = cm.fs
+
+    def measure(self, name, op, setup=None, repeat=3):
+        """Run ``op``, recording stats.
+
+        Wall time is the best of ``repeat`` runs. Namenode calls and bytes
+        are from a single run, and peak memory is measured on an extra run
+        with ``tracemalloc`` enabled. If provided, ``setup`` is called before
+        each run, and isn't included in the measurements."""
+        times = []
+        for i in range(repeat):
+            if setup is not None:
+                setup()
+            self.fs.reset_counters()
+            start = time.perf_counter()
+            op()
+            times.append(time.perf_counter() - start)
+            if i == 0:
+                calls = self.fs.calls.copy()
+                bytes_read = self.fs.bytes_read
+                bytes_written = self.fs.bytes_written
+
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        try:
+            op()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        m = Measurement(name, min(times), calls, bytes_read, bytes_written,
+                        peak)
+        RESULTS.append(m)
+        return m
+
+
+@pytest.fixture
+def bench():
+    fs = MemoryFileSystem(latency=LATENCY)
+    cm = HDFSContentsManager(root_dir='/user/bench/notebooks', fs=fs)
+    yield Bench(cm)
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not RESULTS:
+        return
+    tr = terminalreporter
+    tr.section('hdfscm benchmarks (latency %g s per call)' % LATENCY)
+    header = '%-45s %10s %6s %12s %12s %12s' % (
+        'operation', 'time (ms)', 'calls', 'read', 'written', 'peak mem'
+    )
+    tr.write_line(header)
+    for m in RESULTS:
+        tr.write_line('%-45s %10.2f %6d %12d %12d %12d' % (
+            m.name, m.wall_time * 1000, m.total_calls, m.bytes_read,
+            m.bytes_written, m.peak_memory
+        ))
+    output = os.environ.get('HDFSCM_BENCH_OUTPUT')
+    if output:
+        with open(output, 'w') as f:
+            json.dump([m.to_dict() for m in RESULTS], f, indent=2)
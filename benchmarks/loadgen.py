@@ -0,0 +1,369 @@
+"""Load generator emulating JupyterLab traffic against the contents API.
+
+Simulates many users, each with their own directory of notebooks, doing what
+JupyterLab does: polling the file browser directory listing, opening
+notebooks, autosaving, creating checkpoints, uploading files, and renaming.
+Reports latency percentiles per operation, and namenode operations per second
+where the filesystem is observable.
+
+Run from the repository root, e.g.::
+
+    # In process, against an in-memory filesystem with 2 ms namenode latency
+    python -m benchmarks.loadgen --users 50 --duration 60 --latency 0.002
+
+    # In process, against a real HDFS cluster
+    python -m benchmarks.loadgen --filesystem hdfs --root-dir /user/me/load
+
+    # Against a running notebook server's REST API
+    python -m benchmarks.loadgen --url http://localhost:8888 --token abc123
+
+Intervals are in seconds, and may be scaled down together with ``--speedup``
+to compress a realistic session into a shorter run.
+"""
+import argparse
+import base64
+import heapq
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+import nbformat
+from nbformat import v4
+
+
+def make_notebook(size):
+    nb = v4.new_notebook()
+    for i in range(max(1, size // 1024)):
+        cell = v4.new_code_cell(source='x = %d' % i)
+        cell.outputs.append(v4.new_output('stream', name='stdout',
+                                          text='x' * 1000))
+        nb.cells.append(cell)
+    return nb
+
+
+class DirectClient(object):
+    """Drive a contents manager in process, as the REST handlers do.
+
+    The REST handlers call the contents manager from the server's IOLoop
+    thread, one call at a time, so calls from all users are run on a single
+    thread here too. The contents manager isn't safe to use from several
+    threads (e.g. the notary's sqlite connection is bound to one)."""
+    def __init__(self, cm):
+        self.cm = cm
+        self._executor = ThreadPoolExecutor(1)
+
+    def _call(self, method, *args, **kwargs):
+        func = getattr(self.cm, method)
+        return self._executor.submit(func, *args, **kwargs).result()
+
+    def list_dir(self, path):
+        self._call('get', path, content=True, type='directory')
+
+    def get_notebook(self, path):
+        return self._call('get', path, content=True,
+                          type='notebook')['content']
+
+    def save_notebook(self, path, nb):
+        self._call('save', {'type': 'notebook', 'format': 'json',
+                            'content': nb}, path)
+
+    def create_checkpoint(self, path):
+        self._call('create_checkpoint', path)
+
+    def upload(self, path, data):
+        self._call('save', {'type': 'file', 'format': 'base64',
+                            'content': base64.b64encode(data).decode('ascii')},
+                   path)
+
+    def rename(self, old_path, new_path):
+        self._call('rename', old_path, new_path)
+
+    def mkdir(self, path):
+        self._call('save', {'type': 'directory'}, path)
+
+
+class HTTPClient(object):
+    """Drive a running notebook server through the contents REST API"""
+    def __init__(self, url, token=None):
+        self.url = url.rstrip('/') + '/api/contents/'
+        self.token = token
+
+    def _request(self, method, path, body=None, query=''):
+        data = None if body is None else json.dumps(body).encode('utf8')
+        req = Request(self.url + quote(path) + query, data=data,
+                      method=method)
+        req.add_header('Content-Type', 'application/json')
+        if self.token:
+            req.add_header('Authorization', 'token %s' % self.token)
+        with urlopen(req) as resp:
+            content = resp.read()
+        return json.loads(content.decode('utf8')) if content else None
+
+    def list_dir(self, path):
+        self._request('GET', path, query='?type=directory')
+
+    def get_notebook(self, path):
+        model = self._request('GET', path, query='?type=notebook')
+        return nbformat.from_dict(model['content'])
+
+    def save_notebook(self, path, nb):
+        self._request('PUT', path, {'type': 'notebook', 'format': 'json',
+                                    'content': nb})
+
+    def create_checkpoint(self, path):
+        self._request('POST', path + '/checkpoints')
+
+    def upload(self, path, data):
+        self._request('PUT', path,
+                      {'type': 'file', 'format': 'base64',
+                       'content': base64.b64encode(data).decode('ascii')})
+
+    def rename(self, old_path, new_path):
+        self._request('PATCH', old_path, {'path': new_path})
+
+    def mkdir(self, path):
+        self._request('PUT', path, {'type': 'directory'})
+
+
+class Stats(object):
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, op, duration, error=None):
+        """Record a call of ``op``, or the exception ``error`` it failed
+        with. The first failure of each operation is printed."""
+        with self._lock:
+            if error is None:
+                self.latencies[op].append(duration)
+                return
+            self.errors[op] += 1
+            first = self.errors[op] == 1
+        if first:
+            print("First %s error:" % op, file=sys.stderr)
+            traceback.print_exception(type(error), error,
+                                      error.__traceback__)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float('nan')
+    i = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+class User(object):
+    """A single simulated user"""
+    def __init__(self, client, index, args, stats, stop):
+        self.client = client
+        self.dir = 'loadgen-user%d' % index
+        self.args = args
+        self.stats = stats
+        self.stop = stop
+        self.random = random.Random(index)
+        self.notebooks = ['%s/notebook%d.ipynb' % (self.dir, i)
+                          for i in range(args.notebooks_per_user)]
+        self.open_path = None
+        self.open_nb = None
+        self.n_uploads = 0
+        self.n_renames = 0
+
+    def setup(self):
+        self.client.mkdir(self.dir)
+        nb = make_notebook(self.args.notebook_size)
+        for path in self.notebooks:
+            self.client.save_notebook(path, nb)
+
+    def _timed(self, op, func, *args):
+        """Run and time ``func``, returning (succeeded, result)"""
+        start = time.perf_counter()
+        try:
+            out = func(*args)
+        except Exception as exc:
+            self.stats.record(op, 0, error=exc)
+            return False, None
+        self.stats.record(op, time.perf_counter() - start)
+        return True, out
+
+    def poll(self):
+        self._timed('list_directory', self.client.list_dir, self.dir)
+
+    def open(self):
+        path = self.random.choice(self.notebooks)
+        ok, nb = self._timed('open_notebook', self.client.get_notebook, path)
+        if ok:
+            self.open_path, self.open_nb = path, nb
+
+    def autosave(self):
+        if self.open_nb is None:
+            return
+        self.open_nb.cells.append(v4.new_code_cell(source='y = 1'))
+        self._timed('autosave', self.client.save_notebook, self.open_path,
+                    self.open_nb)
+
+    def checkpoint(self):
+        if self.open_path is None:
+            return
+        self._timed('save_and_checkpoint', self._save_and_checkpoint)
+
+    def _save_and_checkpoint(self):
+        self.client.save_notebook(self.open_path, self.open_nb)
+        self.client.create_checkpoint(self.open_path)
+
+    def upload(self):
+        self.n_uploads += 1
+        path = '%s/upload%d.csv' % (self.dir, self.n_uploads)
+        data = b'a,b,c\n' * (self.args.upload_size // 6)
+        self._timed('upload', self.client.upload, path, data)
+
+    def rename(self):
+        i = self.random.randrange(len(self.notebooks))
+        old = self.notebooks[i]
+        self.n_renames += 1
+        new = '%s/renamed%d.ipynb' % (self.dir, self.n_renames)
+        ok, _ = self._timed('rename', self.client.rename, old, new)
+        if not ok:
+            return
+        self.notebooks[i] = new
+        if self.open_path == old:
+            self.open_path = new
+
+    def run(self):
+        speedup = self.args.speedup
+        actions = [(self.poll, self.args.poll_interval),
+                   (self.open, self.args.open_interval),
+                   (self.autosave, self.args.autosave_interval),
+                   (self.checkpoint, self.args.checkpoint_interval),
+                   (self.upload, self.args.upload_interval),
+                   (self.rename, self.args.rename_interval)]
+        now = time.time()
+        # Start with an open notebook, and stagger everything else
+        self.open()
+        queue = []
+        for i, (action, interval) in enumerate(actions):
+            if interval > 0:
+                start = now + self.random.uniform(0, interval / speedup)
+                queue.append((start, i))
+        heapq.heapify(queue)
+        while queue and not self.stop.is_set():
+            when, i = heapq.heappop(queue)
+            delay = when - time.time()
+            if delay > 0 and self.stop.wait(delay):
+                break
+            action, interval = actions[i]
+            action()
+            heapq.heappush(queue, (when + interval / speedup, i))
+
+
+def make_client(args):
+    """Returns (client, fs), where fs is None if not observable"""
+    if args.url:
+        return HTTPClient(args.url, args.token), None
+
+    from hdfscm import HDFSContentsManager
+    from hdfscm.fakefs import MemoryFileSystem, LocalFileSystem
+
+    kwargs = {'root_dir': args.root_dir}
+    if args.filesystem == 'memory':
+        kwargs['fs'] = MemoryFileSystem(latency=args.latency)
+    elif args.filesystem == 'local':
+        kwargs['fs'] = LocalFileSystem(tempfile.mkdtemp(prefix='loadgen-'),
+                                       latency=args.latency)
+    cm = HDFSContentsManager(**kwargs)
+    fs = cm.fs if hasattr(cm.fs, 'calls') else None
+    return DirectClient(cm), fs
+
+
+def report(stats, elapsed, fs, out=sys.stdout):
+    print("Ran for %.1f s" % elapsed, file=out)
+    print("%-22s %8s %8s %9s %9s %9s %9s"
+          % ('operation', 'count', 'errors', 'p50 (ms)', 'p90 (ms)',
+             'p99 (ms)', 'max (ms)'), file=out)
+    ops = sorted(set(stats.latencies) | set(stats.errors))
+    total = 0
+    for op in ops:
+        lat = sorted(stats.latencies[op])
+        total += len(lat)
+        print("%-22s %8d %8d %9.1f %9.1f %9.1f %9.1f"
+              % (op, len(lat), stats.errors[op],
+                 percentile(lat, 0.5) * 1000, percentile(lat, 0.9) * 1000,
+                 percentile(lat, 0.99) * 1000,
+                 (lat[-1] if lat else float('nan')) * 1000), file=out)
+    print("Throughput: %.1f requests/s" % (total / elapsed), file=out)
+    if fs is not None:
+        calls = sum(fs.calls.values())
+        print("Namenode: %.1f ops/s (%s)"
+              % (calls / elapsed,
+                 ', '.join('%s=%d' % kv for kv in sorted(fs.calls.items()))),
+              file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.loadgen',
+        description="Generate JupyterLab-like load against HDFSContentsManager"
+    )
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=60,
+                        help="How long to run for, in seconds")
+    parser.add_argument('--speedup', type=float, default=1,
+                        help="Divide all intervals by this factor")
+    parser.add_argument('--notebooks-per-user', type=int, default=10)
+    parser.add_argument('--notebook-size', type=int, default=100 * 1024,
+                        help="Approximate notebook size in bytes")
+    parser.add_argument('--upload-size', type=int, default=1024 * 1024)
+    parser.add_argument('--poll-interval', type=float, default=10,
+                        help="Seconds between directory listing polls")
+    parser.add_argument('--open-interval', type=float, default=300)
+    parser.add_argument('--autosave-interval', type=float, default=120)
+    parser.add_argument('--checkpoint-interval', type=float, default=600)
+    parser.add_argument('--upload-interval', type=float, default=1800)
+    parser.add_argument('--rename-interval', type=float, default=3600)
+    parser.add_argument('--filesystem', choices=['memory', 'local', 'hdfs'],
+                        default='memory',
+                        help="The filesystem to use when running in process")
+    parser.add_argument('--latency', type=float, default=0.001,
+                        help="Simulated namenode latency for fake filesystems")
+    parser.add_argument('--root-dir', default='/user/loadgen/notebooks')
+    parser.add_argument('--url', default=None,
+                        help="Run against the notebook server at this URL")
+    parser.add_argument('--token', default=None,
+                        help="The notebook server token, if using --url")
+    args = parser.parse_args(argv)
+
+    client, fs = make_client(args)
+    stats = Stats()
+    stop = threading.Event()
+    users = [User(client, i, args, stats, stop) for i in range(args.users)]
+
+    print("Setting up %d users..." % len(users))
+    for user in users:
+        user.setup()
+    if fs is not None:
+        fs.reset_counters()
+
+    threads = [threading.Thread(target=u.run, daemon=True) for u in users]
+    start = time.time()
+    for t in threads:
+        t.start()
+    try:
+        stop.wait(args.duration)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for t in threads:
+        t.join()
+    report(stats, time.time() - start, fs)
+
+
+if __name__ == '__main__':
+    main()
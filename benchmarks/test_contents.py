@@ -0,0 +1,157 @@
+import posixpath
+
+import nbformat
+import pytest
+from nbformat import v4
+
+from .conftest import FULL
+
+
+KB = 2 ** 10
+MB = 2 ** 20
+
+NOTEBOOK_SIZES = [KB, MB, 50 * MB, 500 * MB] if FULL else [KB, MB]
+DIRECTORY_SIZES = [10, 1000, 100000] if FULL else [10, 1000]
+
+# The maximum number of namenode calls allowed per operation. Lower these as
+# operations are optimized, a regression in any of these fails the run.
+EXPECTED_CALLS = {
+    'get_notebook': 3,
+    'get_notebook_no_content': 2,
+    'get_directory': 4,
+    'save_notebook': 3,
+    'rename_file': 2,
+    'rename_directory': 3,
+    'delete_file': 4,
+    'create_checkpoint': 4,
+    'list_checkpoints': 2,
+    'restore_checkpoint': 2,
+}
+
+
+def size_id(n):
+    if n >= MB:
+        return '%dMB' % (n // MB)
+    return '%dKB' % (n // KB)
+
+
+def make_notebook(size):
+    """Make a notebook whose serialized form is roughly ``size`` bytes"""
+    nb = v4.new_notebook()
+    cell = v4.new_code_cell(source='print("x" * %d)' % size)
+    cell.outputs.append(v4.new_output('stream', name='stdout',
+                                      text='x' * size))
+    nb.cells.append(cell)
+    return nb
+
+
+def write_notebook(bench, path, size):
+    hdfs_path = posixpath.join(bench.cm.root_dir, path)
+    content = nbformat.writes(make_notebook(size), version=4).encode('utf8')
+    with bench.fs.open(hdfs_path, 'wb') as f:
+        f.write(content)
+
+
+def check_calls(m, op):
+    assert m.total_calls <= EXPECTED_CALLS[op], (
+        "%s made %d namenode calls, expected at most %d: %s"
+        % (m.name, m.total_calls, EXPECTED_CALLS[op], dict(m.calls))
+    )
+
+
+@pytest.mark.parametrize('size', NOTEBOOK_SIZES, ids=size_id)
+def test_get_notebook(bench, size):
+    write_notebook(bench, 'nb.ipynb', size)
+    m = bench.measure('get_notebook[%s]' % size_id(size),
+                      lambda: bench.cm.get('nb.ipynb'))
+    check_calls(m, 'get_notebook')
+    assert m.bytes_read >= size
+
+
+def test_get_notebook_no_content(bench):
+    write_notebook(bench, 'nb.ipynb', KB)
+    m = bench.measure('get_notebook_no_content',
+                      lambda: bench.cm.get('nb.ipynb', content=False))
+    check_calls(m, 'get_notebook_no_content')
+
+
+@pytest.mark.parametrize('size', NOTEBOOK_SIZES, ids=size_id)
+def test_save_notebook(bench, size):
+    model = {'type': 'notebook', 'content': make_notebook(size)}
+    m = bench.measure('save_notebook[%s]' % size_id(size),
+                      lambda: bench.cm.save(model, 'nb.ipynb'))
+    check_calls(m, 'save_notebook')
+    assert m.bytes_written >= size
+
+
+@pytest.mark.parametrize('n', DIRECTORY_SIZES)
+def test_get_directory(bench, n):
+    directory = posixpath.join(bench.cm.root_dir, 'dir')
+    bench.fs.mkdir(directory)
+    for i in range(n):
+        with bench.fs.open(posixpath.join(directory, 'f%d.txt' % i),
+                           'wb') as f:
+            f.write(b'x')
+    m = bench.measure('get_directory[%d]' % n,
+                      lambda: bench.cm.get('dir'))
+    check_calls(m, 'get_directory')
+
+
+def test_rename_file(bench):
+    write_notebook(bench, 'a.ipynb', KB)
+    state = {'path': 'a.ipynb', 'n': 0}
+
+    def op():
+        state['n'] += 1
+        new = 'a%d.ipynb' % state['n']
+        bench.cm.rename_file(state['path'], new)
+        state['path'] = new
+
+    m = bench.measure('rename_file', op)
+    check_calls(m, 'rename_file')
+
+
+@pytest.mark.parametrize('n', DIRECTORY_SIZES)
+def test_rename_directory(bench, n):
+    for i in range(n):
+        path = 'dir/nb%d.ipynb' % i
+        write_notebook(bench, path, KB)
+        bench.cm.create_checkpoint(path)
+    state = {'path': 'dir', 'n': 0}
+
+    def op():
+        state['n'] += 1
+        new = 'dir%d' % state['n']
+        bench.cm.rename(state['path'], new)
+        state['path'] = new
+
+    m = bench.measure('rename_directory[%d]' % n, op)
+    check_calls(m, 'rename_directory')
+
+
+def test_delete_file(bench):
+    def setup():
+        write_notebook(bench, 'nb.ipynb', KB)
+
+    m = bench.measure('delete_file', lambda: bench.cm.delete('nb.ipynb'),
+                      setup=setup)
+    check_calls(m, 'delete_file')
+
+
+@pytest.mark.parametrize('size', NOTEBOOK_SIZES, ids=size_id)
+def test_checkpoints(bench, size):
+    write_notebook(bench, 'nb.ipynb', size)
+    cm = bench.cm
+
+    m = bench.measure('create_checkpoint[%s]' % size_id(size),
+                      lambda: cm.create_checkpoint('nb.ipynb'))
+    check_calls(m, 'create_checkpoint')
+
+    m = bench.measure('list_checkpoints[%s]' % size_id(size),
+                      lambda: cm.list_checkpoints('nb.ipynb'))
+    check_calls(m, 'list_checkpoints')
+
+    cp = cm.list_checkpoints('nb.ipynb')[0]
+    m = bench.measure('restore_checkpoint[%s]' % size_id(size),
+                      lambda: cm.restore_checkpoint(cp['id'], 'nb.ipynb'))
+    check_calls(m, 'restore_checkpoint')
@@ -2,5 +2,7 @@
 set -xe
 
 cd hdfscm
-py.test hdfscm --verbose
+HDFSCM_TESTS_FILESYSTEM=hdfs py.test hdfscm --verbose
+HDFSCM_TESTS_FILESYSTEM=memory py.test hdfscm --verbose
+py.test benchmarks
 flake8 hdfscm
@@ -1,5 +1,5 @@
 from .hdfsmanager import HDFSContentsManager
-from .checkpoints import HDFSCheckpoints, NoOpCheckpoints
+from .checkpoints import HDFSCheckpoints, NoOpCheckpoints, SnapshotCheckpoints
 
 from ._version import get_versions
 __version__ = get_versions()['version']
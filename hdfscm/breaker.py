@@ -0,0 +1,222 @@
+"""Load shedding for a degraded namenode.
+
+``CircuitBreakerFileSystem`` stops sending calls to the namenode after
+repeated transient failures or slow calls, failing fast instead (serving
+stale metadata where it has it) until a probe call succeeds. It also bounds
+the number of outstanding calls per process, adapting the bound to how the
+namenode is responding.
+"""
+import posixpath
+import threading
+import time
+from collections import OrderedDict
+
+from .utils import _is_subpath, is_transient
+
+
+__all__ = ('CircuitBreakerFileSystem', 'CircuitOpenError')
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Metadata reads, whose last results may be served while the circuit is open
+STALE_CALLS = frozenset(['info', 'ls', 'exists', 'isdir', 'isfile'])
+
+
+class CircuitOpenError(ConnectionError):
+    """A filesystem call rejected without being made, as the namenode is
+    unavailable or overloaded"""
+
+
+class CircuitBreakerFileSystem(object):
+    """Wraps a filesystem with a circuit breaker and an adaptive limit on
+    outstanding calls.
+
+    After ``failure_threshold`` consecutive calls fail with a transient error
+    or take longer than ``slow_call`` seconds, the circuit opens and all calls
+    fail with ``CircuitOpenError`` for ``reset_timeout`` seconds. Metadata
+    reads with a cached result from an earlier successful call return that
+    result instead. After the timeout, up to ``half_open_calls`` concurrent
+    calls are let through to probe for recovery: the circuit closes if one
+    succeeds, and reopens if one fails.
+
+    Outstanding calls are limited to between 1 and ``max_concurrency``. The
+    limit halves on every failed or slow call, and grows back by one for
+    every ``limit`` successful calls. Calls wait up to ``acquire_timeout``
+    seconds for a slot, then fail with ``CircuitOpenError``.
+
+    Cached metadata is bounded to ``stale_cache_size`` entries in total,
+    counting each result as one entry plus one per item of a listing, and
+    is evicted least recently used first. Results of modified paths and any
+    paths beneath them are dropped.
+
+    Set ``failure_threshold`` or ``max_concurrency`` to 0 to disable the
+    circuit breaker or the concurrency limit respectively, and
+    ``stale_cache_size`` to 0 to not serve stale metadata. Attributes other
+    than namenode calls are forwarded to the wrapped filesystem."""
+    def __init__(self, fs, failure_threshold=5, reset_timeout=10,
+                 slow_call=10, half_open_calls=1, max_concurrency=64,
+                 acquire_timeout=1, stale_cache_size=10000, log=None):
+        self.fs = fs
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call = slow_call
+        self.half_open_calls = half_open_calls
+        self.max_concurrency = max_concurrency
+        self.acquire_timeout = acquire_timeout
+        self.stale_cache_size = stale_cache_size
+        self.log = log
+
+        self.state = CLOSED
+        self.limit = float(max_concurrency)
+        self._failures = 0
+        self._opened_at = None
+        self._probes = 0
+        self._outstanding = 0
+        self._cond = threading.Condition()
+        # path -> {(call, args, kwargs): (result, size)}, least recently
+        # used first
+        self._stale = OrderedDict()
+        # Total size of the cached results
+        self._stale_size = 0
+
+    def _set_state(self, state):
+        if self.log is not None and state != self.state:
+            log = self.log.warning if state == OPEN else self.log.info
+            log("Filesystem circuit breaker %s -> %s", self.state, state)
+        self.state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+
+    def _acquire(self):
+        """Reserve a slot for a call, returning whether it's a probe"""
+        with self._cond:
+            probe = False
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError("Filesystem circuit breaker is "
+                                           "open")
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    raise CircuitOpenError("Filesystem circuit breaker is "
+                                           "half-open, awaiting recovery")
+                self._probes += 1
+                probe = True
+            if self.max_concurrency:
+                deadline = time.monotonic() + self.acquire_timeout
+                while self._outstanding >= int(self.limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        if probe:
+                            self._probes -= 1
+                        raise CircuitOpenError(
+                            "Too many outstanding filesystem calls "
+                            "(limit %d)" % int(self.limit)
+                        )
+                    self._cond.wait(remaining)
+            self._outstanding += 1
+            return probe
+
+    def _release(self, probe, duration, failed):
+        with self._cond:
+            self._outstanding -= 1
+            if probe:
+                self._probes -= 1
+            if failed or (self.slow_call and duration >= self.slow_call):
+                self._failures += 1
+                self.limit = max(1.0, self.limit / 2)
+                if self.failure_threshold and (
+                        probe or (self.state == CLOSED and
+                                  self._failures >= self.failure_threshold)):
+                    self._set_state(OPEN)
+            else:
+                self._failures = 0
+                if self.max_concurrency:
+                    self.limit = min(float(self.max_concurrency),
+                                     self.limit + 1 / self.limit)
+                if probe:
+                    self._set_state(CLOSED)
+            self._cond.notify_all()
+
+    def _get_stale(self, path, key):
+        with self._cond:
+            results = self._stale.get(path)
+            if results is None or key not in results:
+                raise KeyError(key)
+            self._stale.move_to_end(path)
+            return results[key][0]
+
+    def _drop_stale(self, path):
+        results = self._stale.pop(path, None)
+        if results is not None:
+            self._stale_size -= sum(size for _, size in results.values())
+
+    def _set_stale(self, path, key, result):
+        size = 1 + len(result) if isinstance(result, list) else 1
+        with self._cond:
+            results = self._stale.setdefault(path, {})
+            old = results.pop(key, None)
+            if old is not None:
+                self._stale_size -= old[1]
+            if size <= self.stale_cache_size:
+                results[key] = (result, size)
+                self._stale_size += size
+            self._stale.move_to_end(path)
+            while self._stale_size > self.stale_cache_size:
+                self._drop_stale(next(iter(self._stale)))
+            if not results:
+                self._stale.pop(path, None)
+
+    def _forget(self, *paths):
+        """Drop cached results for paths modified by a call, any paths
+        beneath them, and their parent directories"""
+        with self._cond:
+            for path in paths:
+                for key in [k for k in self._stale if _is_subpath(k, path)]:
+                    self._drop_stale(key)
+                self._drop_stale(posixpath.dirname(path))
+
+    def _call(self, call, path, *args, **kwargs):
+        key = (call, args, tuple(sorted(kwargs.items())))
+        try:
+            probe = self._acquire()
+        except CircuitOpenError:
+            if call in STALE_CALLS:
+                try:
+                    result = self._get_stale(path, key)
+                except KeyError:
+                    pass
+                else:
+                    if self.log is not None:
+                        self.log.debug("Serving stale %s of %s", call, path)
+                    return result
+            raise
+        start = time.monotonic()
+        failed = False
+        try:
+            result = getattr(self.fs, call)(path, *args, **kwargs)
+        except Exception as exc:
+            failed = is_transient(exc)
+            raise
+        finally:
+            self._release(probe, time.monotonic() - start, failed)
+        if call in STALE_CALLS:
+            if self.stale_cache_size:
+                self._set_stale(path, key, result)
+        elif call == 'rename':
+            self._forget(path, args[0])
+        elif call != 'open' or args[:1] != ('rb',):
+            self._forget(path)
+        return result
+
+    def open(self, path, mode='rb', *args, **kwargs):
+        return self._call('open', path, mode, *args, **kwargs)
+
+    def __getattr__(self, attr):
+        if attr in STALE_CALLS or attr in ('rename', 'mkdir', 'delete'):
+            return lambda path, *args, **kwargs: self._call(attr, path, *args,
+                                                            **kwargs)
+        return getattr(self.fs, attr)
@@ -1,19 +1,38 @@
+import abc
+import atexit
 import posixpath
+from datetime import datetime
 from notebook.services.contents.checkpoints import Checkpoints
 from tornado.web import HTTPError
-from traitlets import Unicode, Instance, default
-from pyarrow import hdfs
+from traitlets import (Any, Unicode, Bool, Integer, Instance, Type, default,
+                       MetaHasTraits)
+from traitlets.config import LoggingConfigurable
+from pyarrow import ArrowIOError
 
-from .utils import to_fs_path, perm_to_403, utcfromtimestamp, utcnow
+from .metrics import instrumented
+from .utils import (to_fs_path, to_api_path, hdfs_errors, http_error,
+                    utcfromtimestamp, utcnow, with_hdfs_errors,
+                    CoalescingQueue, run_hdfs_command, _is_subpath, _UTC)
 
 
-__all__ = ('HDFSCheckpoints', 'NoOpCheckpoints')
+__all__ = ('HDFSCheckpoints', 'NoOpCheckpoints', 'SnapshotCheckpoints',
+           'HDFSSnapshotter', 'CopySnapshotter')
 
 
 # Currently only one checkpoint is supported
 CHECKPOINT_ID = "checkpoint"
 
 
+def _copy_file(fs, src_path, dest_path, **kwargs):
+    # TODO: pyarrow.hdfs currently doesn't implement copy, so this is
+    # less efficient than it should be.
+    with hdfs_errors(src_path):
+        with fs.open(src_path, 'rb') as source:
+            with hdfs_errors(dest_path):
+                with fs.open(dest_path, 'wb', **kwargs) as dest:
+                    dest.upload(source)
+
+
 class NoOpCheckpoints(Checkpoints):
     """A Checkpoints implementation that does nothing.
 
@@ -45,45 +64,248 @@ class HDFSCheckpoints(Checkpoints):
 
         This is a path relative to the file's own directory.
 
+        If an absolute path is provided instead, checkpoints for all files are
+        kept in a single directory tree under this path, mirroring the layout
+        of ``root_dir``.
+
         By default, it is .ipynb_checkpoints
         """
     )
 
+    checkpoint_replication = Integer(
+        0,
+        config=True,
+        help="""
+        The replication factor to use when writing checkpoint files.
+
+        Checkpoints are only a safety net, using a lower replication factor
+        (e.g. 1 or 2) reduces the cost of writing them. By default (0) the
+        cluster default replication is used.
+        """
+    )
+
+    checkpoint_block_size = Integer(
+        0,
+        config=True,
+        help="""
+        The block size (in bytes) to use when writing checkpoint files.
+
+        By default (0) the cluster default block size is used.
+        """
+    )
+
+    checkpoint_storage_policy = Unicode(
+        '',
+        config=True,
+        help="""
+        The HDFS storage policy (e.g. ``WARM`` or ``COLD``) to set on
+        checkpoint directories.
+
+        The policy is set using the ``hdfs storagepolicies`` command the first
+        time a checkpoint directory is used by this server. The command runs
+        on a background thread, so checkpoints written before it completes
+        keep the previous policy until moved (e.g. by ``hdfs mover``). If it
+        fails, it's retried the next time the directory is used. By default
+        no policy is set, and the policy is inherited from the parent
+        directory.
+        """
+    )
+
+    hdfs_command = Unicode(
+        'hdfs',
+        config=True,
+        help="""
+        The ``hdfs`` command line tool, used for operations not supported by
+        the filesystem client (e.g. setting storage policies).
+        """
+    )
+
     root_dir = Unicode()
 
     @default('root_dir')
     def _default_root_dir(self):
         return self.parent.root_dir
 
-    fs = Instance(hdfs.HadoopFileSystem)
+    fs = Any()
 
     @default('fs')
     def _default_fs(self):
         return self.parent.fs
 
+    @property
+    def _observers(self):
+        return getattr(self.parent, '_observers', ())
+
+    background_checkpoints = Bool(
+        False,
+        config=True,
+        help="""
+        Whether to create checkpoints on a background thread.
+
+        If enabled, ``create_checkpoint`` returns immediately with an
+        optimistic checkpoint model, and the copy happens in the background.
+        Only the latest pending request per file is executed, so a checkpoint
+        may capture a later save of the same file. Saving a file, and
+        restoring, renaming, listing, or deleting its checkpoints, first
+        waits for any pending checkpoint of that file to complete, so a
+        checkpoint never captures a partially written save.
+
+        If a background checkpoint fails, the next request to create, list,
+        or restore checkpoints of that file fails with the error.
+        """
+    )
+
+    _queue = Instance(CoalescingQueue, allow_none=True)
+
+    @default('_queue')
+    def _default_queue(self):
+        if not self.background_checkpoints:
+            return None
+        queue = CoalescingQueue(self.log, name='hdfscm-checkpoints')
+        # Don't lose queued checkpoints on shutdown
+        atexit.register(queue.flush)
+        return queue
+
+    # Checkpoint directories that already have the storage policy set
+    _policy_dirs = Instance(set, args=())
+
+    _policy_queue = Instance(CoalescingQueue, allow_none=True)
+
+    @default('_policy_queue')
+    def _default_policy_queue(self):
+        if not self.checkpoint_storage_policy:
+            return None
+        return CoalescingQueue(self.log, name='hdfscm-storage-policies')
+
+    # api path -> the error the last background checkpoint failed with
+    _failures = Instance(dict, args=())
+
+    def flush(self, path=None):
+        """Wait for any pending background checkpoints to complete.
+
+        If ``path`` is provided, only waits on checkpoints for that path (or
+        paths below it, if it's a directory)."""
+        if self._queue is not None:
+            self._queue.flush(None if path is None else path.strip('/'))
+
+    def _raise_failure(self, path):
+        """Raise the error the last background checkpoint of ``path``
+        failed with, if any. Each failure is only raised once."""
+        exc = self._failures.pop(path, None)
+        if exc is not None:
+            raise HTTPError(500, "Failed to create checkpoint of %s: %s"
+                            % (path, exc))
+
+    def _forget_failures(self, path):
+        """Drop failures of ``path`` and any paths below it"""
+        for key in list(self._failures):
+            if _is_subpath(key, path):
+                self._failures.pop(key, None)
+
+    @instrumented('create_checkpoint', path_arg=1)
+    @with_hdfs_errors(path_arg=1)
     def create_checkpoint(self, contents_mgr, path):
         orig_path = to_fs_path(path, contents_mgr.root_dir)
-        cp_path = self._checkpoint_path(CHECKPOINT_ID, path)
-        self.log.debug("Creating checkpoint %s", cp_path)
-        self._copy(orig_path, cp_path)
+        if self._queue is not None:
+            path = path.strip('/')
+            self.log.debug("Queueing checkpoint of %s", orig_path)
+            self._queue.submit(
+                path, lambda: self._create_checkpoint_background(orig_path,
+                                                                 path)
+            )
+            # The new checkpoint is still queued, but the client is told
+            # the previous one failed
+            self._raise_failure(path)
+            return {'id': CHECKPOINT_ID,
+                    'last_modified': utcnow()}
+        cp_path = self._create_checkpoint(orig_path, path)
         return self._checkpoint_model(CHECKPOINT_ID, cp_path)
 
+    def _create_checkpoint_background(self, orig_path, path):
+        try:
+            self._create_checkpoint(orig_path, path)
+        except Exception as exc:
+            self._failures[path] = exc
+            raise
+        self._failures.pop(path, None)
+
+    def _create_checkpoint(self, orig_path, path):
+        cp_path = self._checkpoint_path(CHECKPOINT_ID, path, create=True)
+        self.log.debug("Creating checkpoint %s", cp_path)
+        self._copy(orig_path, cp_path, **self._checkpoint_open_kwargs())
+        return cp_path
+
+    def _checkpoint_open_kwargs(self):
+        kwargs = {}
+        if self.checkpoint_replication:
+            kwargs['replication'] = self.checkpoint_replication
+        if self.checkpoint_block_size:
+            kwargs['default_block_size'] = self.checkpoint_block_size
+        return kwargs
+
+    @instrumented('restore_checkpoint', path_arg=2)
+    @with_hdfs_errors(path_arg=2)
     def restore_checkpoint(self, contents_mgr, checkpoint_id, path):
+        self.flush(path)
+        self._raise_failure(path.strip('/'))
         cp_path = self._checkpoint_path(checkpoint_id, path)
         orig_path = to_fs_path(path, contents_mgr.root_dir)
         self.log.debug("Restoring checkpoint %s", cp_path)
         self._copy(cp_path, orig_path)
 
     def rename_checkpoint(self, checkpoint_id, old_path, new_path):
+        self.flush(old_path)
+        self._forget_failures(old_path.strip('/'))
         old_cp_path = self._checkpoint_path(checkpoint_id, old_path)
-        new_cp_path = self._checkpoint_path(checkpoint_id, new_path)
         if self.fs.isfile(old_cp_path):
+            new_cp_path = self._checkpoint_path(checkpoint_id, new_path,
+                                                create=True)
             self.log.debug("Renaming checkpoint %s -> %s",
                            old_cp_path, new_cp_path)
             self._rename(old_cp_path, new_cp_path)
 
+    def rename_all_checkpoints(self, old_path, new_path):
+        old_path = old_path.strip('/')
+        new_path = new_path.strip('/')
+        self.flush(old_path)
+        self._forget_failures(old_path)
+        old_tree = self._checkpoint_tree(old_path)
+        if old_tree is not None and self.fs.isdir(old_tree):
+            # A directory in a centralized layout, move the whole subtree
+            new_tree = self._checkpoint_tree(new_path)
+            if self.fs.exists(new_tree):
+                # Orphaned checkpoints from a previous file at this path
+                with hdfs_errors(new_tree):
+                    self.fs.delete(new_tree, recursive=True)
+            parent = posixpath.dirname(new_tree)
+            with hdfs_errors(parent):
+                self.fs.mkdir(parent)
+            self.log.debug("Renaming checkpoints %s -> %s", old_tree, new_tree)
+            self._rename(old_tree, new_tree)
+        else:
+            # Either a file, or a directory in a relative layout, where the
+            # checkpoints were already moved along with the directory
+            super().rename_all_checkpoints(old_path, new_path)
+
+    def delete_all_checkpoints(self, path):
+        path = path.strip('/')
+        self.flush(path)
+        self._forget_failures(path)
+        tree = self._checkpoint_tree(path)
+        if tree is not None and self.fs.isdir(tree):
+            # A directory in a centralized layout, delete the whole subtree
+            self.log.debug("Deleting checkpoints %s", tree)
+            with hdfs_errors(tree):
+                self.fs.delete(tree, recursive=True)
+        else:
+            super().delete_all_checkpoints(path)
+
+    @instrumented('delete_checkpoint', path_arg=1)
+    @with_hdfs_errors(path_arg=1)
     def delete_checkpoint(self, checkpoint_id, path):
         path = path.strip('/')
+        self.flush(path)
+        self._forget_failures(path)
         cp_path = self._checkpoint_path(checkpoint_id, path)
         if not self.fs.isfile(cp_path):
             raise HTTPError(
@@ -92,8 +314,12 @@ class HDFSCheckpoints(Checkpoints):
         self.log.debug("Deleting checkpoint %s", cp_path)
         self._delete(cp_path)
 
+    @instrumented('list_checkpoints')
+    @with_hdfs_errors()
     def list_checkpoints(self, path):
         path = path.strip('/')
+        self.flush(path)
+        self._raise_failure(path)
         cp_path = self._checkpoint_path(CHECKPOINT_ID, path)
         if not self.fs.isfile(cp_path):
             return []
@@ -101,13 +327,24 @@ class HDFSCheckpoints(Checkpoints):
             return [self._checkpoint_model(CHECKPOINT_ID, cp_path)]
 
     def _checkpoint_model(self, checkpoint_id, hdfs_path):
-        with perm_to_403(hdfs_path):
+        with hdfs_errors(hdfs_path):
             info = self.fs.info(hdfs_path)
         last_modified = utcfromtimestamp(info['last_modified'])
         return {'id': checkpoint_id,
                 'last_modified': last_modified}
 
-    def _checkpoint_path(self, checkpoint_id, path):
+    @property
+    def _is_centralized(self):
+        return posixpath.isabs(self.checkpoint_dir)
+
+    def _checkpoint_tree(self, path):
+        """The directory holding all checkpoints below ``path``, or None if
+        checkpoints are stored relative to each file"""
+        if not self._is_centralized:
+            return None
+        return to_fs_path(path, self.checkpoint_dir.rstrip('/'))
+
+    def _checkpoint_path(self, checkpoint_id, path, create=False):
         path = path.strip('/')
         hdfs_path = to_fs_path(path, self.root_dir)
         directory, filename = posixpath.split(hdfs_path)
@@ -117,25 +354,291 @@ class HDFSCheckpoints(Checkpoints):
             checkpoint_id=checkpoint_id,
             ext=ext,
         )
-        cp_dir = posixpath.join(directory, self.checkpoint_dir)
-        with perm_to_403(cp_dir):
-            self.fs.mkdir(cp_dir)
+        if self._is_centralized:
+            cp_dir = self._checkpoint_tree(posixpath.dirname(path))
+            policy_dir = self.checkpoint_dir
+        else:
+            cp_dir = policy_dir = posixpath.join(directory, self.checkpoint_dir)
+        # Only create the directory when writing, reads and deletes of
+        # checkpoints that don't exist shouldn't leave directories behind.
+        if create:
+            with hdfs_errors(cp_dir):
+                self.fs.mkdir(cp_dir)
+            self._ensure_storage_policy(policy_dir)
         cp_path = posixpath.join(cp_dir, cp_filename)
         return cp_path
 
-    def _copy(self, src_path, dest_path):
-        # TODO: pyarrow.hdfs currently doesn't implement copy, so this is
-        # less efficient than it should be.
-        with perm_to_403(src_path):
-            with self.fs.open(src_path, 'rb') as source:
-                with perm_to_403(dest_path):
-                    with self.fs.open(dest_path, 'wb') as dest:
-                        dest.upload(source)
+    def _ensure_storage_policy(self, cp_dir):
+        if not self.checkpoint_storage_policy or cp_dir in self._policy_dirs:
+            return
+        # Running the command starts a JVM, keep it off the request path
+        if not self._policy_queue.is_pending(cp_dir):
+            self._policy_queue.submit(
+                cp_dir, lambda: self._set_storage_policy(cp_dir)
+            )
+
+    def _set_storage_policy(self, cp_dir):
+        self.log.debug("Setting storage policy %s on %s",
+                       self.checkpoint_storage_policy, cp_dir)
+        try:
+            run_hdfs_command(self.hdfs_command, 'storagepolicies',
+                             '-setStoragePolicy', '-path', cp_dir,
+                             '-policy', self.checkpoint_storage_policy)
+        except Exception as exc:
+            # Storage policies are an optimization, don't fail checkpoints.
+            # Not recorded, so it's retried the next time the directory is
+            # used.
+            self.log.warning("Failed to set storage policy on %s: %s",
+                             cp_dir, exc)
+            return
+        self._policy_dirs.add(cp_dir)
+
+    def _copy(self, src_path, dest_path, **kwargs):
+        _copy_file(self.fs, src_path, dest_path, **kwargs)
 
     def _rename(self, old, new):
-        with perm_to_403(old):
+        with hdfs_errors(old):
             self.fs.rename(old, new)
 
     def _delete(self, cp_path):
-        with perm_to_403(cp_path):
+        with hdfs_errors(cp_path):
             self.fs.delete(cp_path)
+
+
+SNAPSHOT_PREFIX = "hdfscm-"
+SNAPSHOT_TIME_FORMAT = "%Y%m%dT%H%M%S.%f"
+
+
+class _ABCMetaHasTraits(abc.ABCMeta, MetaHasTraits):
+    pass
+
+
+class Snapshotter(LoggingConfigurable, metaclass=_ABCMetaHasTraits):
+    """Base class for creating and deleting directory snapshots"""
+    @abc.abstractmethod
+    def create_snapshot(self, directory, name):
+        """Create a snapshot of ``directory`` named ``name``"""
+
+    @abc.abstractmethod
+    def delete_snapshot(self, directory, name):
+        """Delete the snapshot of ``directory`` named ``name``"""
+
+
+class HDFSSnapshotter(Snapshotter):
+    """Manage snapshots using the ``hdfs`` command line tool.
+
+    The directory must be snapshottable (see ``hdfs dfsadmin
+    -allowSnapshot``). Each command starts a JVM, and runs within the
+    request creating the checkpoint, so creating a checkpoint this way
+    takes a second or more."""
+
+    hdfs_command = Unicode(
+        'hdfs',
+        config=True,
+        help="The ``hdfs`` command line tool, used to manage snapshots."
+    )
+
+    def create_snapshot(self, directory, name):
+        run_hdfs_command(self.hdfs_command, 'dfs', '-createSnapshot',
+                         directory, name)
+
+    def delete_snapshot(self, directory, name):
+        run_hdfs_command(self.hdfs_command, 'dfs', '-deleteSnapshot',
+                         directory, name)
+
+
+class CopySnapshotter(Snapshotter):
+    """Emulate snapshots by copying the directory tree into ``.snapshot``.
+
+    This is a stand-in for filesystems without snapshot support (e.g. a local
+    filesystem), mostly useful for testing. Snapshots made this way are full
+    copies, and cost as much as the data they contain."""
+
+    fs = Any()
+
+    @default('fs')
+    def _default_fs(self):
+        return self.parent.fs
+
+    def _copy_tree(self, src, dest):
+        self.fs.mkdir(dest)
+        for path in self.fs.ls(src):
+            name = posixpath.basename(path)
+            if name == '.snapshot':
+                continue
+            if self.fs.isdir(path):
+                self._copy_tree(path, posixpath.join(dest, name))
+            else:
+                _copy_file(self.fs, path, posixpath.join(dest, name))
+
+    def create_snapshot(self, directory, name):
+        snapshot = posixpath.join(directory, '.snapshot', name)
+        if self.fs.exists(snapshot):
+            raise RuntimeError("Snapshot %s already exists" % snapshot)
+        self._copy_tree(directory, snapshot)
+
+    def delete_snapshot(self, directory, name):
+        self.fs.delete(posixpath.join(directory, '.snapshot', name),
+                       recursive=True)
+
+
+class SnapshotCheckpoints(Checkpoints):
+    """A Checkpoints implementation using HDFS directory snapshots.
+
+    Creating a checkpoint creates a snapshot of ``snapshot_dir``, which
+    doesn't copy any data. Since snapshots are shared between all files in
+    the directory, old checkpoints are removed by only keeping the most
+    recent ``max_snapshots`` snapshots, rather than by deleting or renaming
+    the checkpoints of individual files."""
+
+    snapshot_dir = Unicode(
+        config=True,
+        help="""
+        The snapshottable directory to take snapshots of.
+
+        Must contain ``root_dir``. By default this is ``root_dir`` itself.
+        """
+    )
+
+    @default('snapshot_dir')
+    def _default_snapshot_dir(self):
+        return self.root_dir
+
+    max_snapshots = Integer(
+        10,
+        config=True,
+        help="""
+        The maximum number of snapshots to keep.
+
+        When a new checkpoint is created, the oldest snapshots created by
+        this class are deleted to stay within this limit.
+        """
+    )
+
+    snapshotter_class = Type(
+        default_value=HDFSSnapshotter,
+        klass=Snapshotter,
+        config=True,
+        help="""
+        The class to use for creating and deleting snapshots.
+
+        The default runs ``hdfs dfs -createSnapshot`` synchronously within
+        the checkpoint request, which starts a JVM and typically takes a
+        second or more. Snapshots aren't taken in the background, so a
+        checkpoint always captures the save it follows.
+
+        Use ``hdfscm.checkpoints.CopySnapshotter`` to emulate snapshots on
+        filesystems without snapshot support.
+        """
+    )
+
+    snapshotter = Instance(Snapshotter)
+
+    @default('snapshotter')
+    def _default_snapshotter(self):
+        return self.snapshotter_class(parent=self, log=self.log)
+
+    root_dir = Unicode()
+
+    @default('root_dir')
+    def _default_root_dir(self):
+        return self.parent.root_dir
+
+    fs = Any()
+
+    @default('fs')
+    def _default_fs(self):
+        return self.parent.fs
+
+    @property
+    def _observers(self):
+        return getattr(self.parent, '_observers', ())
+
+    @property
+    def _snapshots_root(self):
+        return posixpath.join(self.snapshot_dir, '.snapshot')
+
+    def _snapshot_path(self, checkpoint_id, path):
+        hdfs_path = to_fs_path(path, self.root_dir)
+        rel_path = to_api_path(hdfs_path, self.snapshot_dir)
+        return posixpath.join(self._snapshots_root, checkpoint_id, rel_path)
+
+    def _checkpoint_model(self, checkpoint_id):
+        timestamp = datetime.strptime(checkpoint_id[len(SNAPSHOT_PREFIX):],
+                                      SNAPSHOT_TIME_FORMAT)
+        return {'id': checkpoint_id,
+                'last_modified': timestamp.replace(tzinfo=_UTC)}
+
+    def _list_snapshots(self):
+        """The ids of all snapshots created by this class, oldest first"""
+        try:
+            paths = self.fs.ls(self._snapshots_root)
+        except ArrowIOError as exc:
+            error = http_error(exc, self._snapshots_root)
+            if error is not None and error.status_code != 404:
+                raise error
+            # No snapshots have been taken yet
+            return []
+        names = (posixpath.basename(p) for p in paths)
+        # The timestamp format sorts lexicographically
+        return sorted(n for n in names if n.startswith(SNAPSHOT_PREFIX))
+
+    @instrumented('create_checkpoint', path_arg=1)
+    @with_hdfs_errors(path_arg=1)
+    def create_checkpoint(self, contents_mgr, path):
+        checkpoint_id = SNAPSHOT_PREFIX + datetime.utcnow().strftime(
+            SNAPSHOT_TIME_FORMAT
+        )
+        self.log.debug("Creating snapshot %s of %s",
+                       checkpoint_id, self.snapshot_dir)
+        try:
+            self.snapshotter.create_snapshot(self.snapshot_dir, checkpoint_id)
+        except Exception as exc:
+            raise HTTPError(500, "Failed to create checkpoint of %s: %s"
+                            % (path, exc))
+        self._prune_snapshots()
+        return self._checkpoint_model(checkpoint_id)
+
+    def _prune_snapshots(self):
+        snapshots = self._list_snapshots()
+        for checkpoint_id in snapshots[:-self.max_snapshots]:
+            self.log.debug("Deleting snapshot %s of %s",
+                           checkpoint_id, self.snapshot_dir)
+            try:
+                self.snapshotter.delete_snapshot(self.snapshot_dir,
+                                                 checkpoint_id)
+            except Exception as exc:
+                self.log.warning("Failed to delete snapshot %s: %s",
+                                 checkpoint_id, exc)
+
+    @instrumented('restore_checkpoint', path_arg=2)
+    @with_hdfs_errors(path_arg=2)
+    def restore_checkpoint(self, contents_mgr, checkpoint_id, path):
+        snapshot_path = self._snapshot_path(checkpoint_id, path)
+        orig_path = to_fs_path(path, contents_mgr.root_dir)
+        if not self.fs.isfile(snapshot_path):
+            raise HTTPError(
+                404, 'Checkpoint does not exist: %s@%s' % (path, checkpoint_id)
+            )
+        self.log.debug("Restoring checkpoint %s", snapshot_path)
+        _copy_file(self.fs, snapshot_path, orig_path)
+
+    def rename_checkpoint(self, checkpoint_id, old_path, new_path):
+        # Snapshots are read-only, checkpoints stay with the old path
+        pass
+
+    @instrumented('delete_checkpoint', path_arg=1)
+    def delete_checkpoint(self, checkpoint_id, path):
+        # Snapshots are shared by all files, and are removed by
+        # `_prune_snapshots` instead.
+        pass
+
+    @instrumented('list_checkpoints')
+    @with_hdfs_errors()
+    def list_checkpoints(self, path):
+        path = path.strip('/')
+        checkpoints = []
+        for checkpoint_id in self._list_snapshots():
+            if self.fs.isfile(self._snapshot_path(checkpoint_id, path)):
+                checkpoints.append(self._checkpoint_model(checkpoint_id))
+        return checkpoints
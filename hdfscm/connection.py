@@ -0,0 +1,250 @@
+"""Management of the connections to HDFS.
+
+A connection can break without the client noticing, e.g. when a Kerberos
+ticket expires or the namenode restarts. ``ReconnectingFileSystem``
+replaces a broken connection transparently, failing over between namenodes
+where more than one is configured.
+
+``ReadRoutingFileSystem`` sends metadata reads over a second connection to
+a read-only namenode, taking load off the active namenode.
+"""
+import posixpath
+import threading
+import time
+
+from .metrics import FS_CALLS
+from .utils import is_transient, _is_subpath
+
+
+__all__ = ('ReconnectingFileSystem', 'ReadRoutingFileSystem', 'parse_host')
+
+
+# Filesystem methods that may be served by a read-only namenode
+READ_CALLS = frozenset(['info', 'ls', 'exists', 'isdir', 'isfile'])
+
+
+def parse_host(host, default_port=0):
+    """Parse a ``host[:port]`` string into a ``(host, port)`` tuple"""
+    name, sep, port = host.rpartition(':')
+    if sep and port.isdigit():
+        return name, int(port)
+    return host, default_port
+
+
+class ReconnectingFileSystem(object):
+    """A filesystem connection that reconnects when it breaks.
+
+    ``connect(host, port)`` makes a new connection. ``hosts`` is an ordered
+    list of ``(host, port)`` namenodes to connect to, either the namenodes
+    of a cluster without HA configured in the client, or a single HA
+    nameservice (in which case the HDFS client handles failover itself).
+
+    A connection is replaced when a call on it fails with a transient error
+    (see ``hdfscm.utils.is_transient``), or when a health check (an
+    ``info`` call on ``health_check_path``, made every
+    ``health_check_interval`` seconds if nonzero) fails. The failed call
+    still raises, any retrying is left to the caller. New connections are
+    tried starting with the namenode after the current one, and are only
+    used once a health check on them succeeds, so that a standby namenode
+    is skipped over."""
+    def __init__(self, connect, hosts, health_check_interval=60,
+                 health_check_path='/', log=None):
+        if not hosts:
+            raise ValueError("At least one host is required")
+        self.connect = connect
+        self.hosts = list(hosts)
+        self.health_check_interval = health_check_interval
+        self.health_check_path = health_check_path
+        self.log = log
+        self.host_index = len(self.hosts) - 1
+        self._fs = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._reconnect(None)
+        if health_check_interval:
+            thread = threading.Thread(target=self._health_check_loop,
+                                      name='hdfscm-health-check',
+                                      daemon=True)
+            thread.start()
+
+    @property
+    def host(self):
+        """The ``(host, port)`` currently connected to"""
+        return self.hosts[self.host_index]
+
+    def _debug(self, msg, *args):
+        if self.log is not None:
+            self.log.debug(msg, *args)
+
+    def _warning(self, msg, *args):
+        if self.log is not None:
+            self.log.warning(msg, *args)
+
+    def _reconnect(self, broken):
+        """Replace the connection ``broken`` with a new one.
+
+        A no-op if the connection has already been replaced by another
+        thread."""
+        with self._lock:
+            if self._fs is not broken:
+                return
+            self._fs = None
+            if broken is not None:
+                try:
+                    broken.close()
+                except Exception:
+                    pass
+            errors = []
+            n = len(self.hosts)
+            for i in range(1, n + 1):
+                index = (self.host_index + i) % n
+                host, port = self.hosts[index]
+                self._debug("Connecting to HDFS at %s:%d", host, port)
+                try:
+                    fs = self.connect(host, port)
+                    fs.info(self.health_check_path)
+                except Exception as exc:
+                    self._warning("Failed to connect to HDFS at %s:%d: %s",
+                                  host, port, exc)
+                    errors.append('%s:%d: %s' % (host, port, exc))
+                    continue
+                if broken is not None:
+                    self._warning("Reconnected to HDFS at %s:%d", host, port)
+                self._fs = fs
+                self.host_index = index
+                return
+            raise ConnectionError("Failed to connect to HDFS:\n%s"
+                                  % '\n'.join(errors))
+
+    def _get(self):
+        fs = self._fs
+        if fs is None:
+            self._reconnect(None)
+            fs = self._fs
+        return fs
+
+    def _call(self, call, *args, **kwargs):
+        fs = self._get()
+        try:
+            return getattr(fs, call)(*args, **kwargs)
+        except Exception as exc:
+            if is_transient(exc):
+                self._warning("HDFS %s failed, reconnecting: %s", call, exc)
+                try:
+                    self._reconnect(fs)
+                except Exception:
+                    # Reported by the next call
+                    pass
+            raise
+
+    def check_health(self):
+        """Check the connection, reconnecting if it's broken"""
+        fs = self._fs
+        try:
+            if fs is None:
+                raise ConnectionError("Not connected")
+            fs.info(self.health_check_path)
+        except Exception as exc:
+            self._warning("HDFS health check failed, reconnecting: %s", exc)
+            self._reconnect(fs)
+
+    def _health_check_loop(self):
+        while not self._closed.wait(self.health_check_interval):
+            try:
+                self.check_health()
+            except Exception as exc:
+                self._warning("Failed to reconnect to HDFS: %s", exc)
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            fs, self._fs = self._fs, None
+        if fs is not None:
+            fs.close()
+
+    def __getattr__(self, attr):
+        if attr in FS_CALLS:
+            return lambda *args, **kwargs: self._call(attr, *args, **kwargs)
+        return getattr(self._get(), attr)
+
+
+class ReadRoutingFileSystem(object):
+    """Routes metadata reads to a read-only namenode (e.g. an HDFS Observer
+    NameNode) through ``read_fs``, and all other calls to the active
+    namenode through ``fs``.
+
+    The read-only namenode may lag behind the active one, so for
+    ``consistency_window`` seconds after a path is written through this
+    filesystem, reads of that path, of paths below it, and listings of its
+    parent directory go to the active namenode. Reads failing with a
+    transient error on the read-only namenode are retried on the active
+    one. Attributes other than filesystem calls are forwarded to ``fs``."""
+    def __init__(self, fs, read_fs, consistency_window=10, log=None):
+        self.fs = fs
+        self.read_fs = read_fs
+        self.consistency_window = consistency_window
+        self.log = log
+        # path -> time last written
+        self._written = {}
+        self._lock = threading.Lock()
+
+    def _mark_written(self, *paths):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            for path in paths:
+                self._written[path.rstrip('/') or '/'] = now
+
+    def _expire(self, now):
+        cutoff = now - self.consistency_window
+        for path, written in list(self._written.items()):
+            if written < cutoff:
+                del self._written[path]
+
+    def _recently_written(self, path):
+        path = path.rstrip('/') or '/'
+        with self._lock:
+            self._expire(time.monotonic())
+            return any(_is_subpath(path, p) or posixpath.dirname(p) == path
+                       for p in self._written)
+
+    def _read(self, call, path, *args, **kwargs):
+        if not self._recently_written(path):
+            try:
+                return getattr(self.read_fs, call)(path, *args, **kwargs)
+            except Exception as exc:
+                if not is_transient(exc):
+                    raise
+                if self.log is not None:
+                    self.log.debug("Read-only namenode failed %s of %s, "
+                                   "retrying on active: %s", call, path, exc)
+        return getattr(self.fs, call)(path, *args, **kwargs)
+
+    def _write(self, call, path, *args, **kwargs):
+        try:
+            return getattr(self.fs, call)(path, *args, **kwargs)
+        finally:
+            if call == 'rename':
+                self._mark_written(path, args[0])
+            else:
+                self._mark_written(path)
+
+    def open(self, path, mode='rb', *args, **kwargs):
+        if mode == 'rb':
+            return self.fs.open(path, mode, *args, **kwargs)
+        return self._write('open', path, mode, *args, **kwargs)
+
+    def close(self):
+        try:
+            self.read_fs.close()
+        finally:
+            self.fs.close()
+
+    def __getattr__(self, attr):
+        if attr in READ_CALLS:
+            return lambda path, *args, **kwargs: self._read(attr, path, *args,
+                                                            **kwargs)
+        if attr in FS_CALLS:
+            return lambda path, *args, **kwargs: self._write(attr, path,
+                                                             *args, **kwargs)
+        return getattr(self.fs, attr)
@@ -0,0 +1,201 @@
+"""Delta saves of notebooks.
+
+Instead of the full notebook, a save may send a JSON patch (RFC 6902)
+against the version of the notebook it was based on, e.g. replacing the
+source of a single cell. The patch is applied to a parsed copy of that
+version kept in a ``NotebookCache``, so the request size and the work of
+applying it scale with the edit rather than the notebook.
+"""
+import copy
+import threading
+from collections import OrderedDict
+
+from .utils import _is_subpath
+
+
+__all__ = ('PatchConflict', 'apply_patch', 'NotebookCache')
+
+
+class PatchConflict(ValueError):
+    """A ``test`` operation of a patch failed"""
+
+
+def _parse_pointer(pointer):
+    if not isinstance(pointer, str) or (pointer and pointer[0] != '/'):
+        raise ValueError("Invalid JSON pointer %r" % (pointer,))
+    return [p.replace('~1', '/').replace('~0', '~')
+            for p in pointer.split('/')[1:]]
+
+
+def _index(container, token, pointer, append=False):
+    if isinstance(container, dict):
+        return token
+    if not isinstance(container, list):
+        raise ValueError("%s doesn't refer to a location in a list or "
+                         "object" % pointer)
+    if append and token == '-':
+        return len(container)
+    if not token.isdigit() or (token != '0' and token[0] == '0'):
+        raise ValueError("Invalid list index in %s" % pointer)
+    index = int(token)
+    if index > len(container) or (index == len(container) and not append):
+        raise ValueError("List index out of range in %s" % pointer)
+    return index
+
+
+def _get(doc, pointer):
+    value = doc
+    for token in _parse_pointer(pointer):
+        index = _index(value, token, pointer)
+        try:
+            value = value[index]
+        except KeyError:
+            raise ValueError("%s does not exist" % pointer)
+    return value
+
+
+class _Patcher(object):
+    """Applies operations copy on write, only copying the containers along
+    the paths modified. Unmodified parts of the document are shared with
+    the original."""
+    def __init__(self, doc, convert=None):
+        self.doc = doc
+        self.convert = convert
+        # ids of containers copied by this patch, which may be modified
+        self._copied = set()
+
+    def _copy(self, value):
+        if id(value) in self._copied:
+            return value
+        if isinstance(value, dict):
+            value = type(value)(value)
+        elif isinstance(value, list):
+            value = list(value)
+        else:
+            return value
+        self._copied.add(id(value))
+        return value
+
+    def _parent(self, pointer):
+        """The (copied) container of ``pointer``'s target, and its key"""
+        tokens = _parse_pointer(pointer)
+        if not tokens:
+            raise ValueError("Cannot modify the whole document")
+        self.doc = parent = self._copy(self.doc)
+        for token in tokens[:-1]:
+            index = _index(parent, token, pointer)
+            try:
+                child = self._copy(parent[index])
+            except KeyError:
+                raise ValueError("%s does not exist" % pointer)
+            parent[index] = child
+            parent = child
+        return parent, tokens[-1]
+
+    def add(self, pointer, value, convert=True):
+        if convert and self.convert is not None:
+            value = self.convert(value)
+        parent, token = self._parent(pointer)
+        index = _index(parent, token, pointer, append=True)
+        if isinstance(parent, list):
+            parent.insert(index, value)
+        else:
+            parent[index] = value
+
+    def remove(self, pointer):
+        parent, token = self._parent(pointer)
+        index = _index(parent, token, pointer)
+        try:
+            return parent.pop(index)
+        except KeyError:
+            raise ValueError("%s does not exist" % pointer)
+
+    def replace(self, pointer, value):
+        self.remove(pointer)
+        self.add(pointer, value)
+
+    def apply(self, op):
+        if not isinstance(op, dict) or 'path' not in op:
+            raise ValueError("Invalid patch operation %r" % (op,))
+        kind = op.get('op')
+        pointer = op['path']
+        if kind in ('add', 'replace', 'test') and 'value' not in op:
+            raise ValueError("Missing value in %s operation" % kind)
+        if kind == 'add':
+            self.add(pointer, op['value'])
+        elif kind == 'remove':
+            self.remove(pointer)
+        elif kind == 'replace':
+            self.replace(pointer, op['value'])
+        elif kind == 'move':
+            self.add(pointer, self.remove(op.get('from')), convert=False)
+        elif kind == 'copy':
+            self.add(pointer, copy.deepcopy(_get(self.doc, op.get('from'))),
+                     convert=False)
+        elif kind == 'test':
+            if _get(self.doc, pointer) != op['value']:
+                raise PatchConflict("Patch test failed at %s" % pointer)
+        else:
+            raise ValueError("Unknown patch operation %r" % (kind,))
+
+
+def apply_patch(doc, patch, convert=None):
+    """Apply the JSON patch ``patch`` (a list of operations) to ``doc``,
+    returning the patched document.
+
+    ``doc`` isn't modified, the result shares the parts of it the patch
+    doesn't change. If given, ``convert`` is applied to the values the
+    patch adds (e.g. ``nbformat.from_dict``, so they're the same types as
+    the rest of ``doc``). Raises a ``ValueError`` for an invalid patch, or
+    a ``PatchConflict`` if a ``test`` operation fails."""
+    if not isinstance(patch, list):
+        raise ValueError("A patch must be a list of operations")
+    patcher = _Patcher(doc, convert)
+    for op in patch:
+        patcher.apply(op)
+    return patcher.doc
+
+
+class NotebookCache(object):
+    """Recently saved or read notebooks, parsed, for applying patches to.
+
+    Holds at most ``max_entries`` notebooks, evicting the least recently
+    used first. Entries are keyed by filesystem path, and are only returned
+    while the file's modification time and size are unchanged and its hash
+    matches the one requested. Cached notebooks are shared, and mustn't be
+    modified."""
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # path -> (mtime, size, hash, notebook)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, mtime, size, hash):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[:3] != (mtime, size, hash):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry[3]
+
+    def put(self, path, mtime, size, hash, notebook):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries.pop(path, None)
+            self._entries[path] = (mtime, size, hash, notebook)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, path):
+        """Drop the entries of ``path`` and any paths beneath it"""
+        with self._lock:
+            for key in [k for k in self._entries if _is_subpath(k, path)]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,242 @@
+"""A cache of file contents on local disk, persisting across restarts.
+
+Metadata is kept in a SQLite database, and contents as files in a blob
+directory alongside it, so that a restarted or respawned notebook server
+starts with a warm cache. Entries are revalidated against the file's
+modification time and size on HDFS before use.
+"""
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from .utils import _is_subpath
+
+
+__all__ = ('DiskCache',)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    nbytes INTEGER NOT NULL,
+    prefetched INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+class DiskCache(object):
+    """A cache of file contents in the local directory ``directory``,
+    bounded to ``max_bytes`` in total and evicting the least recently used
+    files first.
+
+    Has the same interface as ``hdfscm.prefetch.ContentCache``. Entries are
+    keyed by filesystem path, and are only returned while the file's
+    modification time and size are unchanged. Like ``ContentCache``, files
+    modified less than ``min_age`` seconds ago aren't cached. The directory
+    is created readable only by the current user, and may be shared by
+    several processes. Errors reading or writing the cache are logged, and treated
+    as misses."""
+    def __init__(self, directory, max_bytes, name='disk', observers=(),
+                 log=None, min_age=2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.name = name
+        self.observers = list(observers)
+        self.log = log
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.prefetch_hits = 0
+        self.prefetch_evicted = 0
+        self._blob_dir = os.path.join(directory, 'blobs')
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.makedirs(self._blob_dir, mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, 'cache.sqlite'),
+                                   timeout=10, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+
+    def _warning(self, msg, *args):
+        if self.log is not None:
+            self.log.warning(msg, *args)
+
+    def _blob_path(self, path):
+        key = hashlib.sha256(path.encode('utf8')).hexdigest()
+        return os.path.join(self._blob_dir, key[:2], key)
+
+    def _lookup(self, path, mtime, size):
+        row = self._db.execute(
+            'SELECT mtime, size, nbytes, prefetched FROM entries '
+            'WHERE path = ?', (path,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[0] != mtime or row[1] != size:
+            self._remove([path])
+            return None
+        return row
+
+    def get(self, path, mtime, size):
+        """The cached contents of ``path``, or None"""
+        with self._lock:
+            try:
+                data, prefetched = self._get(path, mtime, size)
+            except (OSError, sqlite3.Error) as exc:
+                self._warning("Failed to read %s from disk cache: %s",
+                              path, exc)
+                data = None
+            if data is None:
+                self.misses += 1
+                outcome = 'miss'
+            else:
+                self.hits += 1
+                outcome = 'hit'
+                if prefetched:
+                    self.prefetch_hits += 1
+                    outcome = 'prefetch_hit'
+        for o in self.observers:
+            o.cache_lookup(self.name, outcome)
+        return data
+
+    def _get(self, path, mtime, size):
+        row = self._lookup(path, mtime, size)
+        if row is None:
+            return None, False
+        try:
+            with open(self._blob_path(path), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = None
+        if data is None or len(data) != row[2]:
+            # Removed or corrupted outside of the cache
+            self._remove([path])
+            return None, False
+        self._db.execute(
+            'UPDATE entries SET last_used = ?, prefetched = 0 '
+            'WHERE path = ?', (time.time(), path)
+        )
+        return data, bool(row[3])
+
+    def contains(self, path, mtime, size):
+        """Whether up to date contents of ``path`` are cached, without
+        counting as a use"""
+        with self._lock:
+            try:
+                return self._lookup(path, mtime, size) is not None
+            except sqlite3.Error:
+                return False
+
+    def put(self, path, mtime, size, data, prefetched=False):
+        if len(data) > self.max_bytes:
+            return
+        if self.min_age > 0 and time.time() - mtime < self.min_age:
+            return
+        try:
+            self._put(path, mtime, size, data, prefetched)
+        except (OSError, sqlite3.Error) as exc:
+            self._warning("Failed to write %s to disk cache: %s", path, exc)
+
+    def _put(self, path, mtime, size, data, prefetched):
+        blob_path = self._blob_path(path)
+        os.makedirs(os.path.dirname(blob_path), mode=0o700, exist_ok=True)
+        # Written to a temporary file first, so concurrent readers never see
+        # a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(blob_path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            with self._lock:
+                os.replace(tmp_path, blob_path)
+                self._db.execute(
+                    'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                    (path, mtime, size, len(data), int(prefetched),
+                     time.time())
+                )
+                if prefetched:
+                    self.prefetched += 1
+                self._evict()
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _evict(self):
+        total = self.nbytes
+        if total <= self.max_bytes:
+            return
+        evict = []
+        rows = self._db.execute(
+            'SELECT path, nbytes, prefetched FROM entries '
+            'ORDER BY last_used'
+        )
+        for path, nbytes, prefetched in rows:
+            if total <= self.max_bytes:
+                break
+            evict.append(path)
+            total -= nbytes
+            if prefetched:
+                self.prefetch_evicted += 1
+        self._remove(evict)
+
+    def _remove(self, paths):
+        for path in paths:
+            self._db.execute('DELETE FROM entries WHERE path = ?', (path,))
+            try:
+                os.unlink(self._blob_path(path))
+            except OSError:
+                pass
+
+    def discard(self, path):
+        """Drop the entries for ``path`` and any paths beneath it"""
+        with self._lock:
+            prefix = path.rstrip('/') + '/'
+            rows = self._db.execute(
+                'SELECT path FROM entries WHERE path = ? OR '
+                'substr(path, 1, ?) = ?', (path, len(prefix), prefix)
+            ).fetchall()
+            self._remove([p for p, in rows if _is_subpath(p, path)])
+
+    def clear(self):
+        with self._lock:
+            rows = self._db.execute('SELECT path FROM entries').fetchall()
+            self._remove([p for p, in rows])
+
+    @property
+    def nbytes(self):
+        """The total size of the cached contents"""
+        row = self._db.execute('SELECT SUM(nbytes) FROM entries').fetchone()
+        return row[0] or 0
+
+    @property
+    def hit_rate(self):
+        """The fraction of lookups that were hits"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        with self._lock:
+            entries, nbytes = self._db.execute(
+                'SELECT COUNT(*), SUM(nbytes) FROM entries'
+            ).fetchone()
+            return {'entries': entries,
+                    'bytes': nbytes or 0,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hit_rate,
+                    'prefetched': self.prefetched,
+                    'prefetch_hits': self.prefetch_hits,
+                    'prefetch_evicted': self.prefetch_evicted}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
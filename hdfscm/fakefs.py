@@ -0,0 +1,411 @@
+"""Stand-in filesystems implementing the subset of the
+``pyarrow.hdfs.HadoopFileSystem`` interface used by ``hdfscm``.
+
+These are useful for testing and benchmarking without access to an HDFS
+cluster. Either can be passed as ``fs`` to ``HDFSContentsManager`` (and
+through it, to the checkpoints classes)::
+
+    from hdfscm import HDFSContentsManager
+    from hdfscm.fakefs import MemoryFileSystem
+
+    cm = HDFSContentsManager(fs=MemoryFileSystem(latency=0.002))
+
+Per-call latency can be simulated with ``latency``, either a single number of
+seconds applied to every namenode call, or a dict mapping method names (e.g.
+``'ls'``) to seconds. The number of namenode calls made is recorded in
+``calls``, and the number of bytes read and written in ``bytes_read`` and
+``bytes_written``.
+"""
+import io
+import os
+import posixpath
+import shutil
+import threading
+import time
+from collections import Counter
+
+from pyarrow import ArrowIOError
+
+
+__all__ = ('MemoryFileSystem', 'LocalFileSystem')
+
+
+def _normpath(path):
+    path = posixpath.normpath('/' + path.strip('/'))
+    # normpath preserves a leading '//'
+    return '/' + path.lstrip('/')
+
+
+def _now():
+    # HDFS tracks modification times in milliseconds
+    return round(time.time(), 3)
+
+
+def _not_found(path):
+    return ArrowIOError("HDFS file does not exist: %s" % path)
+
+
+class FakeFile(object):
+    """A file-like object supporting the methods of ``pyarrow.HdfsFile``
+    used by ``hdfscm``"""
+    def __init__(self, raw, fs, on_close=None):
+        self._raw = raw
+        self._fs = fs
+        self._on_close = on_close
+
+    def read(self, nbytes=None):
+        data = self._raw.read() if nbytes is None else self._raw.read(nbytes)
+        self._fs._record_bytes(read=len(data))
+        return data
+
+    def write(self, data):
+        self._fs._record_bytes(written=len(data))
+        return self._raw.write(data)
+
+    def tell(self):
+        return self._raw.tell()
+
+    def upload(self, stream, buffer_size=2 ** 16):
+        while True:
+            chunk = stream.read(buffer_size)
+            if not chunk:
+                break
+            self.write(chunk)
+
+    def download(self, stream, buffer_size=2 ** 16):
+        while True:
+            chunk = self.read(buffer_size)
+            if not chunk:
+                break
+            stream.write(chunk)
+
+    def close(self):
+        if self._raw is None:
+            return
+        if self._on_close is not None:
+            self._on_close(self._raw)
+        self._raw.close()
+        self._raw = None
+
+    @property
+    def closed(self):
+        return self._raw is None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FakeFileSystem(object):
+    """Base class for the stand-in filesystems.
+
+    Subclasses implement ``_stat``, ``_listdir``, ``_open``, ``_mkdir``,
+    ``_rename``, and ``_delete``."""
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.calls = Counter()
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._lock = threading.RLock()
+
+    def _rpc(self, method):
+        with self._lock:
+            self.calls[method] += 1
+        if isinstance(self.latency, dict):
+            delay = self.latency.get(method, 0)
+        else:
+            delay = self.latency
+        if delay:
+            time.sleep(delay)
+
+    def _record_bytes(self, read=0, written=0):
+        with self._lock:
+            self.bytes_read += read
+            self.bytes_written += written
+
+    def reset_counters(self):
+        """Reset ``calls``, ``bytes_read``, and ``bytes_written``"""
+        with self._lock:
+            self.calls.clear()
+            self.bytes_read = self.bytes_written = 0
+
+    def _check_stat(self, path):
+        stat = self._stat(path)
+        if stat is None:
+            raise _not_found(path)
+        return stat
+
+    def _detail(self, path, stat):
+        kind, size, mtime = stat
+        return {'kind': kind,
+                'size': size,
+                'owner': 'hdfscm',
+                'group': 'supergroup',
+                'permissions': 0o755 if kind == 'directory' else 0o644,
+                'replication': 0 if kind == 'directory' else 3,
+                'block_size': 0 if kind == 'directory' else 134217728,
+                'last_modified': mtime,
+                'last_accessed': mtime}
+
+    def info(self, path):
+        self._rpc('info')
+        path = _normpath(path)
+        with self._lock:
+            stat = self._check_stat(path)
+        out = self._detail(path, stat)
+        out['path'] = path
+        return out
+
+    def ls(self, path, detail=False):
+        self._rpc('ls')
+        path = _normpath(path)
+        with self._lock:
+            stat = self._check_stat(path)
+            if stat[0] == 'file':
+                entries = [(path, stat)]
+            else:
+                entries = [(posixpath.join(path, name), stat)
+                           for name, stat in sorted(self._listdir(path))]
+        if not detail:
+            return [p for p, _ in entries]
+        out = []
+        for p, stat in entries:
+            d = self._detail(p, stat)
+            # `ls` names these fields differently than `info`
+            d['name'] = p
+            d['last_modified_time'] = d.pop('last_modified')
+            d['last_accessed_time'] = d.pop('last_accessed')
+            out.append(d)
+        return out
+
+    def exists(self, path):
+        self._rpc('exists')
+        return self._stat(_normpath(path)) is not None
+
+    def isdir(self, path):
+        self._rpc('isdir')
+        stat = self._stat(_normpath(path))
+        return stat is not None and stat[0] == 'directory'
+
+    def isfile(self, path):
+        self._rpc('isfile')
+        stat = self._stat(_normpath(path))
+        return stat is not None and stat[0] == 'file'
+
+    def mkdir(self, path, create_parents=True):
+        self._rpc('mkdir')
+        with self._lock:
+            self._makedirs(_normpath(path))
+
+    def _makedirs(self, path):
+        current = '/'
+        for part in path.strip('/').split('/'):
+            if not part:
+                continue
+            current = posixpath.join(current, part)
+            stat = self._stat(current)
+            if stat is None:
+                self._mkdir(current)
+            elif stat[0] != 'directory':
+                raise ArrowIOError("Path is not a directory: %s" % current)
+
+    def open(self, path, mode='rb', buffer_size=None, replication=None,
+             default_block_size=None):
+        self._rpc('open')
+        path = _normpath(path)
+        if mode not in ('rb', 'wb'):
+            raise ValueError("Unsupported mode %r" % mode)
+        with self._lock:
+            stat = self._stat(path)
+            if stat is not None and stat[0] == 'directory':
+                raise ArrowIOError("Path is a directory: %s" % path)
+            if mode == 'rb':
+                if stat is None:
+                    raise _not_found(path)
+            else:
+                # Like HDFS, creating a file creates its parent directories
+                self._makedirs(posixpath.dirname(path))
+            return self._open(path, mode)
+
+    def rename(self, path, new_path):
+        self._rpc('rename')
+        path = _normpath(path)
+        new_path = _normpath(new_path)
+        with self._lock:
+            self._check_stat(path)
+            if self._stat(new_path) is not None:
+                raise ArrowIOError("Rename destination exists: %s" % new_path)
+            parent = self._stat(posixpath.dirname(new_path))
+            if parent is None or parent[0] != 'directory':
+                raise ArrowIOError("Rename destination parent does not "
+                                   "exist: %s" % new_path)
+            if new_path.startswith(path + '/'):
+                raise ArrowIOError("Cannot rename %s to a subdirectory of "
+                                   "itself" % path)
+            self._rename(path, new_path)
+
+    mv = rename
+
+    def delete(self, path, recursive=False):
+        self._rpc('delete')
+        path = _normpath(path)
+        with self._lock:
+            stat = self._check_stat(path)
+            if (stat[0] == 'directory' and not recursive and
+                    self._listdir(path)):
+                raise ArrowIOError("Directory is not empty: %s" % path)
+            self._delete(path)
+
+    rm = delete
+
+    def close(self):
+        pass
+
+
+class _Node(object):
+    __slots__ = ('kind', 'data', 'mtime', 'children')
+
+    def __init__(self, kind, data=b'', mtime=None):
+        self.kind = kind
+        self.data = data
+        self.mtime = _now() if mtime is None else mtime
+        self.children = set() if kind == 'directory' else None
+
+
+class MemoryFileSystem(FakeFileSystem):
+    """A filesystem stored entirely in memory.
+
+    Parameters
+    ----------
+    latency : float or dict, optional
+        Seconds of simulated latency per namenode call. May also be a dict
+        mapping method names to latencies.
+    """
+    def __init__(self, latency=0):
+        super().__init__(latency=latency)
+        self._nodes = {'/': _Node('directory')}
+
+    def _stat(self, path):
+        node = self._nodes.get(path)
+        if node is None:
+            return None
+        size = 0 if node.kind == 'directory' else len(node.data)
+        return node.kind, size, node.mtime
+
+    def _listdir(self, path):
+        node = self._nodes[path]
+        return [(name, self._stat(posixpath.join(path, name)))
+                for name in node.children]
+
+    def _add(self, path, node):
+        parent, name = posixpath.split(path)
+        parent_node = self._nodes[parent]
+        parent_node.children.add(name)
+        parent_node.mtime = node.mtime
+        self._nodes[path] = node
+
+    def _remove(self, path):
+        parent, name = posixpath.split(path)
+        parent_node = self._nodes[parent]
+        parent_node.children.discard(name)
+        parent_node.mtime = _now()
+        return self._nodes.pop(path)
+
+    def _mkdir(self, path):
+        self._add(path, _Node('directory'))
+
+    def _open(self, path, mode):
+        if mode == 'rb':
+            return FakeFile(io.BytesIO(self._nodes[path].data), self)
+
+        # Like HDFS, the file is visible (but empty) until it's closed
+        if path in self._nodes:
+            node = self._nodes[path]
+            node.data = b''
+        else:
+            node = _Node('file')
+            self._add(path, node)
+
+        def commit(buf):
+            with self._lock:
+                node.data = buf.getvalue()
+                node.mtime = _now()
+
+        return FakeFile(io.BytesIO(), self, on_close=commit)
+
+    def _rename(self, path, new_path):
+        node = self._remove(path)
+        if node.kind == 'directory':
+            prefix = path + '/'
+            for p in [p for p in self._nodes if p.startswith(prefix)]:
+                self._nodes[new_path + p[len(path):]] = self._nodes.pop(p)
+        self._add(new_path, node)
+        # Renames don't change the modification time of the renamed path
+        self._nodes[posixpath.dirname(new_path)].mtime = _now()
+
+    def _delete(self, path):
+        if path == '/':
+            raise ArrowIOError("Cannot delete the root directory")
+        node = self._remove(path)
+        if node.kind == 'directory':
+            prefix = path + '/'
+            for p in [p for p in self._nodes if p.startswith(prefix)]:
+                del self._nodes[p]
+
+
+class LocalFileSystem(FakeFileSystem):
+    """A filesystem backed by a directory on local disk.
+
+    Parameters
+    ----------
+    base_dir : str
+        The local directory to store everything in. Absolute paths on this
+        filesystem are relative to ``base_dir``.
+    latency : float or dict, optional
+        Seconds of simulated latency per namenode call. May also be a dict
+        mapping method names to latencies.
+    """
+    def __init__(self, base_dir, latency=0):
+        super().__init__(latency=latency)
+        self.base_dir = os.path.abspath(base_dir)
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def _local(self, path):
+        return os.path.join(self.base_dir, *path.strip('/').split('/'))
+
+    def _stat_local(self, local_path):
+        try:
+            st = os.stat(local_path)
+        except FileNotFoundError:
+            return None
+        if os.path.isdir(local_path):
+            return 'directory', 0, round(st.st_mtime, 3)
+        return 'file', st.st_size, round(st.st_mtime, 3)
+
+    def _stat(self, path):
+        return self._stat_local(self._local(path))
+
+    def _listdir(self, path):
+        local = self._local(path)
+        return [(name, self._stat_local(os.path.join(local, name)))
+                for name in os.listdir(local)]
+
+    def _mkdir(self, path):
+        os.mkdir(self._local(path))
+
+    def _open(self, path, mode):
+        return FakeFile(open(self._local(path), mode), self)
+
+    def _rename(self, path, new_path):
+        os.rename(self._local(path), self._local(new_path))
+
+    def _delete(self, path):
+        if path == '/':
+            raise ArrowIOError("Cannot delete the root directory")
+        local = self._local(path)
+        if os.path.isdir(local):
+            shutil.rmtree(local)
+        else:
+            os.remove(local)
@@ -0,0 +1,517 @@
+"""Garbage collect orphaned and expired checkpoints, and unreferenced
+notebook output blobs.
+
+Usage::
+
+    python -m hdfscm.gc [--dry-run] [--max-age DAYS] [--outputs] ROOT
+
+Walks ``ROOT`` (listing directories in parallel), finding checkpoint files
+whose source file no longer exists, or (if ``--max-age`` is provided) that
+are older than the retention limit, and deletes them in batches. Aborts
+without deleting anything if ``ROOT`` isn't an existing directory.
+
+With ``--outputs``, also deletes the blobs of separately stored notebook
+outputs (see ``HDFSContentsManager.output_blob_threshold``) that aren't
+referenced by any notebook or checkpoint below ``ROOT``.
+"""
+import argparse
+import json
+import posixpath
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from pyarrow import hdfs, ArrowIOError
+
+from .checkpoints import CHECKPOINT_ID
+from .outputs import output_blob_keys
+from .utils import classify_error
+
+
+__all__ = ('CheckpointCollector', 'OutputBlobCollector', 'main')
+
+
+def checkpoint_source_name(cp_name, checkpoint_id=CHECKPOINT_ID):
+    """The name of the file that a checkpoint file belongs to.
+
+    Returns None if ``cp_name`` isn't a checkpoint filename."""
+    name, ext = posixpath.splitext(cp_name)
+    suffix = '-' + checkpoint_id
+    if not name.endswith(suffix):
+        return None
+    return name[:-len(suffix)] + ext
+
+
+def _entry_path(info):
+    return urlsplit(info['name']).path
+
+
+class _Stats(object):
+    def __init__(self):
+        self.dirs_listed = 0
+        self.entries_scanned = 0
+        self.checkpoints = 0
+        self.orphaned = 0
+        self.expired = 0
+        self.notebooks = 0
+        self.blobs = 0
+        self.unreferenced = 0
+        self.deleted = 0
+        self.bytes_freed = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for k, v in counts.items():
+                setattr(self, k, getattr(self, k) + v)
+
+
+class _Collector(object):
+    """Shared walking, deleting, and reporting of the collectors"""
+    def __init__(self, fs, root, dry_run=False, threads=8, batch_size=100,
+                 out=None):
+        self.fs = fs
+        self.root = root.rstrip('/') or '/'
+        self.dry_run = dry_run
+        self.threads = threads
+        self.batch_size = batch_size
+        self.out = sys.stdout if out is None else out
+        self.stats = _Stats()
+
+    def _print(self, msg):
+        print(msg, file=self.out)
+
+    def _ls(self, path):
+        try:
+            entries = self.fs.ls(path, True)
+        except ArrowIOError:
+            # Removed while walking, or not readable
+            self.stats.add(errors=1)
+            return None
+        self.stats.add(dirs_listed=1, entries_scanned=len(entries))
+        return entries
+
+    def _check_root(self):
+        try:
+            info = self.fs.info(self.root)
+        except ArrowIOError as exc:
+            raise ValueError("Cannot read the root directory %s: %s"
+                             % (self.root, exc))
+        if info['kind'] != 'directory':
+            raise ValueError("The root %s is not a directory" % self.root)
+
+    def _walk(self, scan, level):
+        """Call ``scan(task)`` on each task of ``level`` in parallel, and
+        then on the tasks they return, level by level. ``scan`` returns a
+        list of new tasks and a list of results, all results are returned.
+        """
+        results = []
+        with ThreadPoolExecutor(self.threads) as pool:
+            while level:
+                next_level = []
+                for tasks, found in pool.map(scan, level):
+                    next_level.extend(tasks)
+                    results.extend(found)
+                level = next_level
+        return results
+
+    def _delete(self, item):
+        path, size = item
+        try:
+            self.fs.delete(path, recursive=True)
+        except ArrowIOError as exc:
+            self.stats.add(errors=1)
+            self._print("Failed to delete %s: %s" % (path, exc))
+            return
+        self.stats.add(deleted=1, bytes_freed=size)
+
+    def delete(self, to_delete):
+        """Delete the found paths in batches"""
+        if self.dry_run:
+            for path, size in to_delete:
+                self._print("Would delete %s (%d bytes)" % (path, size))
+            return
+        with ThreadPoolExecutor(self.threads) as pool:
+            for i in range(0, len(to_delete), self.batch_size):
+                batch = to_delete[i:i + self.batch_size]
+                list(pool.map(self._delete, batch))
+                self._print("Deleted %d/%d" % (min(i + len(batch),
+                                                   len(to_delete)),
+                                               len(to_delete)))
+
+    def _report(self, found, to_delete, scan_time, delete_time):
+        s = self.stats
+        self._print(
+            "Scanned %d entries in %d directories in %.2f s "
+            "(%.1f dirs/s, %.1f entries/s)"
+            % (s.entries_scanned, s.dirs_listed, scan_time,
+               s.dirs_listed / max(scan_time, 1e-9),
+               s.entries_scanned / max(scan_time, 1e-9))
+        )
+        self._print(found)
+        if self.dry_run:
+            self._print("Dry run, would free %d bytes"
+                        % sum(size for _, size in to_delete))
+        else:
+            self._print("Deleted %d paths (%d bytes) in %.2f s (%.1f paths/s)"
+                        % (s.deleted, s.bytes_freed, delete_time,
+                           s.deleted / max(delete_time, 1e-9)))
+        if s.errors:
+            self._print("Encountered %d errors" % s.errors)
+
+
+class CheckpointCollector(_Collector):
+    """Find and delete orphaned or expired checkpoints below a root directory.
+
+    Parameters
+    ----------
+    fs : HadoopFileSystem
+        The filesystem to use.
+    root : str
+        The root directory to collect checkpoints for.
+    checkpoint_dir : str, optional
+        The checkpoint directory, as configured for ``HDFSCheckpoints``. If
+        an absolute path, checkpoints are stored in a centralized layout
+        mirroring ``root``.
+    max_age : float, optional
+        If provided, checkpoints older than this many seconds are deleted
+        even if their source file still exists.
+    dry_run : bool, optional
+        If True, only report what would be deleted.
+    threads : int, optional
+        The number of threads to use for listing and deleting.
+    batch_size : int, optional
+        The number of deletes to issue per batch.
+    out : file, optional
+        Where to write progress and stats. Defaults to stdout.
+    """
+    def __init__(self, fs, root, checkpoint_dir='.ipynb_checkpoints',
+                 max_age=None, dry_run=False, threads=8, batch_size=100,
+                 out=None):
+        super().__init__(fs, root, dry_run=dry_run, threads=threads,
+                         batch_size=batch_size, out=out)
+        self.checkpoint_dir = checkpoint_dir
+        self.max_age = max_age
+
+    def _check_checkpoints(self, path, entries, sources, cutoff):
+        """Returns (path, size) tuples of checkpoints to delete"""
+        out = []
+        checkpoints = orphaned = expired = 0
+        for info in entries:
+            if info['kind'] != 'file':
+                continue
+            cp_path = _entry_path(info)
+            source = checkpoint_source_name(posixpath.basename(cp_path))
+            if source is None:
+                continue
+            checkpoints += 1
+            if sources is None or source not in sources:
+                orphaned += 1
+            elif cutoff is not None and info['last_modified_time'] < cutoff:
+                expired += 1
+            else:
+                continue
+            out.append((cp_path, info['size']))
+        self.stats.add(checkpoints=checkpoints, orphaned=orphaned,
+                       expired=expired)
+        if out and len(out) == len(entries):
+            # Everything in this directory is garbage, compact into a single
+            # delete of the directory itself
+            return [(path, sum(size for _, size in out))]
+        return out
+
+    def _scan_relative(self, task, cutoff):
+        kind, path, sources = task
+        entries = self._ls(path)
+        if entries is None:
+            return [], []
+        if kind == 'checkpoints':
+            return [], self._check_checkpoints(path, entries, sources, cutoff)
+        names = {posixpath.basename(_entry_path(i)) for i in entries}
+        tasks = []
+        for info in entries:
+            if info['kind'] != 'directory':
+                continue
+            child = _entry_path(info)
+            if posixpath.basename(child) == self.checkpoint_dir:
+                tasks.append(('checkpoints', child, names))
+            else:
+                tasks.append(('directory', child, None))
+        return tasks, []
+
+    def _scan_centralized(self, task, cutoff):
+        _, cp_path, src_path = task
+        entries = self._ls(cp_path)
+        if entries is None:
+            return [], []
+        try:
+            sources = {posixpath.basename(_entry_path(i))
+                       for i in self.fs.ls(src_path, True)}
+        except ArrowIOError as exc:
+            if classify_error(exc) != 404:
+                # Not readable, or the filesystem is failing. Whether the
+                # sources exist is unknown, so leave the subtree alone.
+                self.stats.add(errors=1)
+                return [], []
+            # The source directory is gone, the whole subtree is orphaned
+            self.stats.add(dirs_listed=1)
+            self._check_checkpoints(cp_path, entries, None, cutoff)
+            return [], [(cp_path, sum(i['size'] for i in entries))]
+        self.stats.add(dirs_listed=1, entries_scanned=len(sources))
+        tasks = []
+        for info in entries:
+            if info['kind'] == 'directory':
+                child = _entry_path(info)
+                name = posixpath.basename(child)
+                tasks.append(('centralized', child,
+                              posixpath.join(src_path, name)))
+        found = self._check_checkpoints(cp_path, entries, sources, cutoff)
+        return tasks, found
+
+    def find(self):
+        """Walk the tree, returning a list of (path, size) tuples to delete.
+
+        Raises a ``ValueError`` if the root isn't an existing directory."""
+        # With a centralized layout, a missing root would make every
+        # checkpoint look orphaned
+        self._check_root()
+        cutoff = None if self.max_age is None else time.time() - self.max_age
+        if posixpath.isabs(self.checkpoint_dir):
+            scan = self._scan_centralized
+            level = [('centralized', self.checkpoint_dir.rstrip('/'),
+                      self.root)]
+        else:
+            scan = self._scan_relative
+            level = [('directory', self.root, None)]
+        return self._walk(lambda t: scan(t, cutoff), level)
+
+    def run(self):
+        """Find and delete checkpoints, printing throughput stats"""
+        start = time.time()
+        to_delete = self.find()
+        scan_time = time.time() - start
+        start = time.time()
+        self.delete(to_delete)
+        delete_time = time.time() - start
+
+        s = self.stats
+        self._report("Found %d checkpoints: %d orphaned, %d expired"
+                     % (s.checkpoints, s.orphaned, s.expired),
+                     to_delete, scan_time, delete_time)
+        return s
+
+
+class OutputBlobCollector(_Collector):
+    """Find and delete notebook output blobs that aren't referenced by any
+    notebook or checkpoint below a root directory.
+
+    Every notebook below the root (and in the checkpoint directory, if
+    centralized) is read to find the blobs it references. If any can't be
+    listed or read, nothing is deleted, as the blobs it references are
+    unknown. Blobs referenced only by notebooks outside the root (e.g. in
+    HDFS snapshots, or saves pending write-back) aren't seen, and are
+    deleted once older than ``min_age``.
+
+    Parameters
+    ----------
+    fs : HadoopFileSystem
+        The filesystem to use.
+    root : str
+        The root directory of the contents manager.
+    output_blob_dir : str, optional
+        The blob directory, as configured for
+        ``HDFSContentsManager.output_blob_dir``.
+    checkpoint_dir : str, optional
+        The checkpoint directory, as configured for ``HDFSCheckpoints``.
+    min_age : float, optional
+        Blobs modified less than this many seconds ago are kept, as a save
+        writes its blobs before the notebook referencing them.
+    dry_run : bool, optional
+        If True, only report what would be deleted.
+    threads : int, optional
+        The number of threads to use for listing, reading, and deleting.
+    batch_size : int, optional
+        The number of deletes to issue per batch.
+    out : file, optional
+        Where to write progress and stats. Defaults to stdout.
+    """
+    def __init__(self, fs, root, output_blob_dir='.ipynb_outputs',
+                 checkpoint_dir='.ipynb_checkpoints', min_age=86400,
+                 dry_run=False, threads=8, batch_size=100, out=None):
+        super().__init__(fs, root, dry_run=dry_run, threads=threads,
+                         batch_size=batch_size, out=out)
+        self.blob_dir = posixpath.join(self.root, output_blob_dir)
+        self.checkpoint_dir = checkpoint_dir
+        self.min_age = min_age
+
+    def _read_keys(self, path):
+        """The blob keys referenced by the notebook at ``path``, or None
+        if it can't be read"""
+        try:
+            with self.fs.open(path, 'rb') as f:
+                data = f.read()
+        except ArrowIOError as exc:
+            self.stats.add(errors=1)
+            self._print("Failed to read %s: %s" % (path, exc))
+            return None
+        self.stats.add(notebooks=1)
+        try:
+            return output_blob_keys(json.loads(data.decode('utf8')))
+        except (ValueError, AttributeError, TypeError):
+            # Not a notebook the contents manager could read either
+            return set()
+
+    def _scan_notebooks(self, path):
+        entries = self._ls(path)
+        if entries is None:
+            return [], []
+        dirs = []
+        notebooks = []
+        for info in entries:
+            child = _entry_path(info)
+            if info['kind'] == 'directory':
+                if child != self.blob_dir:
+                    dirs.append(child)
+            elif child.endswith('.ipynb'):
+                notebooks.append(child)
+        return dirs, notebooks
+
+    def referenced(self):
+        """The keys of all blobs referenced, or None if some notebooks
+        couldn't be listed or read"""
+        roots = [self.root]
+        if posixpath.isabs(self.checkpoint_dir):
+            roots.append(self.checkpoint_dir.rstrip('/'))
+        notebooks = self._walk(self._scan_notebooks, roots)
+        if self.stats.errors:
+            return None
+        keys = set()
+        with ThreadPoolExecutor(self.threads) as pool:
+            for found in pool.map(self._read_keys, notebooks):
+                if found is None:
+                    return None
+                keys.update(found)
+        return keys
+
+    def find(self):
+        """Returns a list of (path, size) tuples of blobs to delete.
+
+        Raises a ``ValueError`` if the root isn't an existing directory."""
+        self._check_root()
+        referenced = self.referenced()
+        if referenced is None:
+            self._print("Not deleting any blobs, as some notebooks "
+                        "couldn't be read")
+            return []
+        try:
+            prefixes = self.fs.ls(self.blob_dir, True)
+        except ArrowIOError as exc:
+            if classify_error(exc) != 404:
+                self.stats.add(errors=1)
+                self._print("Failed to list %s: %s" % (self.blob_dir, exc))
+            return []
+        self.stats.add(dirs_listed=1, entries_scanned=len(prefixes))
+        cutoff = time.time() - self.min_age
+        to_delete = []
+        for prefix in prefixes:
+            if prefix['kind'] != 'directory':
+                continue
+            entries = self._ls(_entry_path(prefix))
+            if entries is None:
+                continue
+            for info in entries:
+                self.stats.add(blobs=1)
+                blob_path = _entry_path(info)
+                if (posixpath.basename(blob_path) in referenced or
+                        info['last_modified_time'] >= cutoff):
+                    continue
+                self.stats.add(unreferenced=1)
+                to_delete.append((blob_path, info['size']))
+        return to_delete
+
+    def run(self):
+        """Find and delete unreferenced blobs, printing throughput stats"""
+        start = time.time()
+        to_delete = self.find()
+        scan_time = time.time() - start
+        start = time.time()
+        self.delete(to_delete)
+        delete_time = time.time() - start
+
+        s = self.stats
+        self._report("Read %d notebooks, found %d blobs: %d unreferenced"
+                     % (s.notebooks, s.blobs, s.unreferenced),
+                     to_delete, scan_time, delete_time)
+        return s
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m hdfscm.gc',
+        description=("Delete orphaned and expired checkpoints created by "
+                     "hdfscm.HDFSCheckpoints, and unreferenced notebook "
+                     "output blobs")
+    )
+    parser.add_argument('root', help='The notebooks root directory to clean')
+    parser.add_argument('--checkpoint-dir', default='.ipynb_checkpoints',
+                        help=("The checkpoint directory, as configured for "
+                              "HDFSCheckpoints.checkpoint_dir"))
+    parser.add_argument('--max-age', type=float, default=None,
+                        help=("Also delete checkpoints older than this many "
+                              "days"))
+    parser.add_argument('--outputs', action='store_true',
+                        help=("Also delete notebook output blobs not "
+                              "referenced by any notebook or checkpoint"))
+    parser.add_argument('--output-blob-dir', default='.ipynb_outputs',
+                        help=("The output blob directory, as configured for "
+                              "HDFSContentsManager.output_blob_dir"))
+    parser.add_argument('--output-min-age', type=float, default=1,
+                        help=("Keep unreferenced output blobs newer than "
+                              "this many days"))
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Only report what would be deleted")
+    parser.add_argument('--threads', type=int, default=8,
+                        help="The number of threads for listing and deleting")
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help="The number of deletes per batch")
+    parser.add_argument('--host', default='default',
+                        help="The HDFS namenode host")
+    parser.add_argument('--port', type=int, default=0,
+                        help="The HDFS namenode port")
+    args = parser.parse_args(argv)
+
+    fs = hdfs.connect(host=args.host, port=args.port)
+    try:
+        collector = CheckpointCollector(
+            fs, args.root,
+            checkpoint_dir=args.checkpoint_dir,
+            max_age=None if args.max_age is None else args.max_age * 86400,
+            dry_run=args.dry_run,
+            threads=args.threads,
+            batch_size=args.batch_size
+        )
+        stats = collector.run()
+        if args.outputs:
+            collector = OutputBlobCollector(
+                fs, args.root,
+                output_blob_dir=args.output_blob_dir,
+                checkpoint_dir=args.checkpoint_dir,
+                min_age=args.output_min_age * 86400,
+                dry_run=args.dry_run,
+                threads=args.threads,
+                batch_size=args.batch_size
+            )
+            stats.errors += collector.run().errors
+    except ValueError as exc:
+        print("Error: %s" % exc, file=sys.stderr)
+        return 1
+    finally:
+        fs.close()
+    return 1 if stats.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
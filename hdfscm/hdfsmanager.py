@@ -1,17 +1,57 @@
+import atexit
+import hashlib
 import mimetypes
+import os
+import posixpath
+import sqlite3
+import threading
+import uuid
 from base64 import encodebytes, decodebytes
 from getpass import getuser
+from datetime import timedelta
+from functools import partial
 from urllib.parse import urlsplit
 
 import nbformat
 from notebook.services.contents.manager import ContentsManager
 from pyarrow import hdfs, ArrowIOError
-from traitlets import Unicode, Integer, Bool, default
+from traitlets import (Any, Unicode, Integer, Float, Bool, Dict, List,
+                       default)
 from tornado.web import HTTPError
 
+from .breaker import CircuitBreakerFileSystem
 from .checkpoints import HDFSCheckpoints
-from .utils import (to_fs_path, to_api_path, is_hidden, perm_to_403,
-                    utcfromtimestamp)
+from .connection import (ReconnectingFileSystem, ReadRoutingFileSystem,
+                         parse_host)
+from .delta import NotebookCache, PatchConflict, apply_patch
+from .diskcache import DiskCache
+from .metrics import InstrumentedFileSystem, PrometheusObserver, instrumented
+from .outputs import OUTPUT_BLOBS_KEY, join_outputs, split_outputs
+from .prefetch import ContentCache, Prefetcher
+from .ratelimit import RateLimitedFileSystem, TokenBucket
+from .retry import RetryingFileSystem
+from .tracing import RequestTracer
+from .utils import (hdfs_errors, http_error, classify_error, with_hdfs_errors,
+                    utcfromtimestamp, utcfromtimestamps, guess_mimetype,
+                    path_translator, parse_timestamp)
+from .writeback import WriteBackQueue
+
+
+def _has_precondition(model):
+    return (model.get('expected_last_modified') is not None or
+            model.get('expected_hash') is not None)
+
+
+def _copy_cell_metadata(nb):
+    """A copy of ``nb`` sharing everything but its cells' metadata"""
+    nb = type(nb)(nb)
+    cells = []
+    for cell in nb['cells']:
+        cell = type(cell)(cell)
+        cell['metadata'] = type(cell['metadata'])(cell['metadata'])
+        cells.append(cell)
+    nb['cells'] = cells
+    return nb
 
 
 class HDFSContentsManager(ContentsManager):
@@ -50,6 +90,20 @@ class HDFSContentsManager(ContentsManager):
         help="Create ``root_dir`` on startup if it doesn't already exist"
     )
 
+    max_listing_entries = Integer(
+        default_value=0,
+        config=True,
+        help="""
+        The maximum number of entries to return when listing a directory.
+
+        Listings of directories with more entries are cut short, and have
+        ``truncated`` set to True in their model. This applies to listings
+        over the REST API, while the pages after the first can only be
+        requested from Python (see ``get``). Set to 0 (default) for no
+        limit.
+        """
+    )
+
     hdfs_host = Unicode(
         default_value="default",
         config=True,
@@ -70,14 +124,658 @@ class HDFSContentsManager(ContentsManager):
         """
     )
 
+    hdfs_hosts = List(
+        Unicode(),
+        config=True,
+        help="""
+        An ordered list of namenodes to connect to, as ``host`` or
+        ``host:port`` strings.
+
+        Takes precedence over ``hdfs_host`` and ``hdfs_port``. Use this for
+        clusters with multiple namenodes where HA isn't configured in the
+        client, the first namenode that's up and active is used, failing
+        over to the others if it becomes unavailable. For an HA nameservice
+        configured in ``hdfs-site.xml``, set ``hdfs_host`` to the
+        nameservice instead.
+        """
+    )
+
+    hdfs_health_check_interval = Float(
+        default_value=60,
+        config=True,
+        help="""
+        Seconds between health checks of the HDFS connection.
+
+        A connection that fails a health check, or whose calls fail with a
+        connection error, is replaced by a new one. Set to 0 to only
+        reconnect after failed calls.
+        """
+    )
+
+    fs = Any(
+        help="""
+        The filesystem to store contents on.
+
+        By default this connects to HDFS using ``hdfs_hosts`` (or
+        ``hdfs_host`` and ``hdfs_port``), reconnecting if the connection
+        breaks. Any object implementing the same interface as
+        ``pyarrow.hdfs.HadoopFileSystem`` may be provided instead (e.g. one
+        of the stand-in filesystems in ``hdfscm.fakefs`` for testing).
+        """
+    )
+
+    @default('fs')
+    def _default_fs(self):
+        hosts = [parse_host(h) for h in self.hdfs_hosts]
+        if not hosts:
+            hosts = [(self.hdfs_host, self.hdfs_port)]
+        return self._connect(hosts)
+
+    hdfs_read_hosts = List(
+        Unicode(),
+        config=True,
+        help="""
+        Namenodes to send metadata reads (listing directories, getting file
+        info, and checking for existence) to, as an ordered list of
+        ``host`` or ``host:port`` strings.
+
+        Use this to move most of the load of serving contents off the
+        active namenode onto read-only namenodes, e.g. HDFS Observer
+        NameNodes, or standby namenodes configured to allow stale reads.
+        Writes, and reads of paths written in the last
+        ``read_your_writes_window`` seconds, still go to the active
+        namenode. By default all calls go to the active namenode.
+        """
+    )
+
+    read_your_writes_window = Float(
+        default_value=10,
+        config=True,
+        help="""
+        Seconds after a path is written during which metadata reads of it
+        go to the active namenode rather than ``hdfs_read_hosts``, so that
+        users see their own changes even if the read-only namenodes lag
+        behind.
+        """
+    )
+
+    read_fs = Any(
+        allow_none=True,
+        help="""
+        The filesystem to send metadata reads to.
+
+        By default this connects to ``hdfs_read_hosts`` if set, otherwise
+        all calls go to ``fs``.
+        """
+    )
+
+    @default('read_fs')
+    def _default_read_fs(self):
+        if not self.hdfs_read_hosts:
+            return None
+        return self._connect([parse_host(h) for h in self.hdfs_read_hosts])
+
+    def _connect(self, hosts):
+        return ReconnectingFileSystem(
+            lambda host, port: hdfs.connect(host=host, port=port),
+            hosts,
+            health_check_interval=self.hdfs_health_check_interval,
+            log=self.log
+        )
+
+    enable_metrics = Bool(
+        default_value=False,
+        config=True,
+        help="""
+        Whether to record prometheus metrics for contents operations and
+        filesystem calls.
+
+        Metrics are served by the notebook server's ``/metrics`` endpoint.
+        Requires ``prometheus_client``.
+        """
+    )
+
+    slow_operation_threshold = Float(
+        default_value=0,
+        config=True,
+        help="""
+        Log a warning for contents operations taking longer than this many
+        seconds.
+
+        The warning includes a trace of every filesystem call made while
+        serving the operation, with its path, duration, and bytes
+        transferred. Set to 0 (default) to disable.
+        """
+    )
+
+    opentelemetry_tracing = Bool(
+        default_value=False,
+        config=True,
+        help="""
+        Whether to export contents operations and their filesystem calls as
+        OpenTelemetry spans.
+
+        Requires ``opentelemetry-api``, along with a configured
+        OpenTelemetry SDK and exporter.
+        """
+    )
+
+    fs_retries = Integer(
+        default_value=3,
+        config=True,
+        help="""
+        The number of times to retry a filesystem call that fails with a
+        transient error (e.g. a namenode failover, or a connection timeout).
+
+        Only idempotent calls (metadata reads, creating directories, and
+        opening files for reading) are retried. Set to 0 to disable retries.
+        """
+    )
+
+    fs_retry_base_delay = Float(
+        default_value=0.1,
+        config=True,
+        help="""
+        The base delay in seconds between retries of filesystem calls.
+
+        The delay before each retry is chosen at random up to
+        ``fs_retry_base_delay * 2 ** attempt``, capped at
+        ``fs_retry_max_delay``.
+        """
+    )
+
+    fs_retry_max_delay = Float(
+        default_value=2.0,
+        config=True,
+        help="The maximum delay in seconds between retries of filesystem calls"
+    )
+
+    fs_retry_max_total_delay = Float(
+        default_value=1.0,
+        config=True,
+        help="""
+        The maximum total time in seconds a filesystem call may wait between
+        its retries.
+
+        Contents operations run on the notebook server's event loop, and no
+        other request is served while a call waits to retry, so this should
+        be kept small.
+        """
+    )
+
+    request_deadline = Float(
+        default_value=30,
+        config=True,
+        help="""
+        The time in seconds after the start of a contents operation past
+        which failed filesystem calls are no longer retried.
+
+        Set to 0 for no deadline.
+        """
+    )
+
+    circuit_breaker_failures = Integer(
+        default_value=0,
+        config=True,
+        help="""
+        The number of consecutive failed or slow filesystem calls after which
+        to stop calling the namenode for ``circuit_breaker_reset_timeout``
+        seconds.
+
+        While stopped, requests fail immediately with a 503. If
+        ``circuit_breaker_stale_cache_size`` is set, metadata reads (e.g.
+        directory listings) return the result of the last successful call
+        instead where available. Set to 0 (default) to disable.
+        """
+    )
+
+    circuit_breaker_reset_timeout = Float(
+        default_value=10,
+        config=True,
+        help="""
+        Seconds to wait after the circuit breaker opens before probing the
+        namenode for recovery.
+        """
+    )
+
+    circuit_breaker_slow_call = Float(
+        default_value=10,
+        config=True,
+        help="""
+        Filesystem calls taking longer than this many seconds count as
+        failures for the circuit breaker and the concurrency limit.
+
+        Set to 0 to only count errors.
+        """
+    )
+
+    circuit_breaker_stale_cache_size = Integer(
+        default_value=0,
+        config=True,
+        help="""
+        The maximum size of the metadata cached to serve while the circuit
+        breaker is open, counting each result as one entry plus one per file
+        in a directory listing. The least recently used results are evicted
+        first.
+
+        Stale results may not reflect changes made since, including by
+        other users, and are served without any indication. Set to 0
+        (default) to fail all calls while the circuit breaker is open.
+        """
+    )
+
+    max_concurrent_fs_calls = Integer(
+        default_value=0,
+        config=True,
+        help="""
+        The maximum number of outstanding filesystem calls.
+
+        The limit in effect adapts between 1 and this value, halving on
+        every failed or slow call and recovering as calls succeed. Calls
+        that can't get a slot within a second fail with a 503. Set to 0
+        (default) for no limit.
+        """
+    )
+
+    metadata_ops_per_second = Float(
+        default_value=0,
+        config=True,
+        help="""
+        The maximum rate of filesystem metadata reads (listing directories,
+        getting file info, or checking for existence) per second.
+
+        Limits apply per notebook server, which under JupyterHub means per
+        user. Requests over the limit fail immediately with a 429, rather
+        than waiting on the server's event loop. Set to 0 (default) for no
+        limit. May be overridden per user
+        with ``rate_limit_overrides``.
+        """
+    )
+
+    metadata_ops_burst = Integer(
+        default_value=0,
+        config=True,
+        help="""
+        The number of metadata reads that may be made in a burst above
+        ``metadata_ops_per_second``.
+
+        Defaults to ``metadata_ops_per_second``.
+        """
+    )
+
+    bytes_per_second = Float(
+        default_value=0,
+        config=True,
+        help="""
+        The maximum rate of bytes read from and written to the filesystem
+        per second.
+
+        Set to 0 (default) for no limit. May be overridden per user with
+        ``rate_limit_overrides``.
+        """
+    )
+
+    bytes_burst = Integer(
+        default_value=0,
+        config=True,
+        help="""
+        The number of bytes that may be transferred in a burst above
+        ``bytes_per_second``.
+
+        Defaults to ``bytes_per_second``.
+        """
+    )
+
+    rate_limit_overrides = Dict(
+        config=True,
+        help="""
+        Per-user rate limits, as a mapping of username to a dict with any of
+        the keys ``metadata_ops_per_second``, ``metadata_ops_burst``,
+        ``bytes_per_second``, and ``bytes_burst``.
+
+        The user is taken from ``JUPYTERHUB_USER`` if set, otherwise the
+        user running the server. Values not overridden are taken from the
+        global options.
+        """
+    )
+
+    content_cache_size = Integer(
+        default_value=0,
+        config=True,
+        help="""
+        The maximum total size in bytes of file and notebook contents to
+        cache in memory.
+
+        Cached contents are used while the file's modification time and size
+        are unchanged, saving a read from HDFS. The least recently used files
+        are evicted first. Set to 0 (default) to disable caching.
+        """
+    )
+
+    disk_cache_dir = Unicode(
+        config=True,
+        help="""
+        A local directory to cache file and notebook contents in, so that
+        they persist across restarts of the notebook server.
+
+        May contain a ``{username}`` format parameter. Cached contents are
+        used while the file's modification time and size on HDFS are
+        unchanged. Used behind the in-memory cache if
+        ``content_cache_size`` is also set. By default there is no disk
+        cache.
+        """
+    )
+
+    disk_cache_size = Integer(
+        default_value=2**30,
+        config=True,
+        help="""
+        The maximum total size in bytes of contents in ``disk_cache_dir``.
+
+        The least recently used files are evicted first.
+        """
+    )
+
+    cache_min_file_age = Float(
+        default_value=2.0,
+        config=True,
+        help="""
+        How long in seconds after a file was last modified before its
+        contents may be cached, in memory or on disk.
+
+        Cached contents are validated by the file's modification time and
+        size, and modification times may be as coarse as a second. A file
+        rewritten with the same size within that second would look
+        unchanged, so recently modified files aren't cached. Should also
+        cover any clock skew between the namenode and this server.
+
+        Set to 0 to cache files regardless of when they were modified.
+        """
+    )
+
+    prefetch_files = Integer(
+        default_value=0,
+        config=True,
+        help="""
+        The number of files to read into the contents cache in the
+        background when a directory is listed.
+
+        The files most recently opened are prefetched first, then the most
+        recently modified. Requires ``content_cache_size`` or
+        ``disk_cache_dir``. Cache hit rates
+        are reported in the ``hdfscm_cache_lookups_total`` metric. Set to 0
+        (default) to disable prefetching.
+        """
+    )
+
+    output_blob_threshold = Integer(
+        default_value=0,
+        config=True,
+        help="""
+        Store notebook outputs longer than this many characters (e.g. large
+        images or HTML) separately from the notebook.
+
+        Separately stored outputs are written once to a content-addressed
+        blob in ``output_blob_dir``, and left empty in the notebook file,
+        so saves only write the outputs that have changed. They're put back
+        when the notebook is read. Set to 0 (default) to store all outputs
+        in the notebook, in which case separately stored outputs of
+        notebooks saved while enabled are left empty.
+
+        Experimental: blobs aren't deleted by the contents manager, even
+        once no notebook references them. Run ``python -m hdfscm.gc
+        --outputs`` periodically to remove them.
+        """
+    )
+
+    output_blob_dir = Unicode(
+        '.ipynb_outputs',
+        config=True,
+        help="""
+        The directory to store separately stored notebook outputs in,
+        relative to the root directory.
+        """
+    )
+
+    notebook_cache_size = Integer(
+        default_value=0,
+        config=True,
+        help="""
+        The number of parsed notebooks to keep in memory for delta saves.
+
+        A notebook save may send a JSON patch (with ``format`` set to
+        ``'json-patch'``) against the ``hash`` of the version it's based on,
+        instead of the full notebook. Notebooks saved with a patch are
+        cached, so that the next patch doesn't need to read and parse the
+        notebook again. Set to 0 (default) to disable caching, patches are
+        still accepted.
+
+        The REST API's ``GET`` doesn't return hashes, so over REST the first
+        save of a notebook must be a full save, conditional on its
+        ``expected_last_modified``. Its response includes the ``hash`` to
+        base the following patches on.
+        """
+    )
+
+    prefetch_max_file_size = Integer(
+        default_value=16 * 2**20,
+        config=True,
+        help="The maximum size in bytes of files to prefetch"
+    )
+
+    prefetch_min_available_memory = Integer(
+        default_value=512 * 2**20,
+        config=True,
+        help="""
+        Stop prefetching, and cancel queued prefetches, while the system has
+        less than this many bytes of memory available.
+
+        Set to 0 to always prefetch.
+        """
+    )
+
+    write_back = Bool(
+        default_value=False,
+        config=True,
+        help="""
+        Whether to save files to local disk, and write them to HDFS in the
+        background.
+
+        Saves return once the file is in ``write_back_dir``, and repeated
+        saves of a file before it's written to HDFS are coalesced. The
+        models of files not yet written have ``pending_sync`` set to True.
+        Pending saves are written on shutdown, and those that can't be are
+        kept and written on the next start. Renaming or deleting a file
+        first waits for its pending save to be written.
+
+        Once written, files keep the modification time of their pending save
+        until they're modified again, so it can be used for conditional
+        saves and the frontend doesn't report them as changed on disk. That
+        history is kept in memory, and is lost on restart.
+        """
+    )
+
+    write_back_dir = Unicode(
+        config=True,
+        help="""
+        The local directory to keep saves pending write-back to HDFS in.
+
+        May contain a ``{username}`` format parameter. Defaults to a
+        directory in the Jupyter data directory.
+        """
+    )
+
+    @default('write_back_dir')
+    def _default_write_back_dir(self):
+        from jupyter_core.paths import jupyter_data_dir
+        return os.path.join(jupyter_data_dir(), 'hdfscm', 'write-back',
+                            '{username}')
+
+    write_back_sync_on_checkpoint = Bool(
+        default_value=True,
+        config=True,
+        help="""
+        Whether to wait for a file's pending save to be written to HDFS
+        before checkpointing it.
+
+        If False, checkpoints may not include the latest pending save.
+        """
+    )
+
+    write_back_retry_interval = Float(
+        default_value=10,
+        config=True,
+        help="Seconds between retries of failed writes of pending saves"
+    )
+
+    # Observers of contents operations and filesystem calls
+    _observers = ()
+    _content_cache = None
+    _prefetcher = None
+    _write_back = None
+
+    # Conditional saves of a path are serialized with one of these locks
+    _save_locks = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.log.debug("Connecting to HDFS at %s:%d",
-                       self.hdfs_host, self.hdfs_port)
-        self.fs = hdfs.connect(host=self.hdfs_host, port=self.hdfs_port)
+        self._save_locks = [threading.Lock() for _ in range(32)]
+        self._notebooks = NotebookCache(self.notebook_cache_size)
+        # Output blobs known to exist
+        self._output_blobs = set()
+        self._observers = self._make_observers()
+        self.fs = self._wrap_fs(self.fs)
+        self._content_cache, self._prefetcher = self._make_content_cache()
+        if self.write_back:
+            self._write_back = self._make_write_back()
         if self.create_root_dir_on_startup:
             self.ensure_root_directory()
 
+    def _make_observers(self):
+        observers = []
+        if self.enable_metrics:
+            observers.append(PrometheusObserver())
+        if self.slow_operation_threshold > 0 or self.opentelemetry_tracing:
+            observers.append(
+                RequestTracer(self.log,
+                              threshold=self.slow_operation_threshold,
+                              opentelemetry=self.opentelemetry_tracing)
+            )
+        return observers
+
+    def _wrap_fs(self, fs):
+        # Wrappers are applied innermost first:
+        # - read routing, so every layer sees calls to either namenode
+        # - instrumentation, inside retries so every attempt is observed
+        # - retries
+        # - the circuit breaker, outside retries so a failing call counts
+        #   once retries are exhausted, and rejected calls aren't retried
+        # - rate limiting, outermost so throttled calls don't hold a
+        #   concurrency slot
+        if self.read_fs is not None:
+            fs = ReadRoutingFileSystem(
+                fs, self.read_fs,
+                consistency_window=self.read_your_writes_window,
+                log=self.log
+            )
+        if self._observers:
+            fs = InstrumentedFileSystem(fs, self._observers)
+        if self.fs_retries > 0:
+            fs = RetryingFileSystem(
+                fs,
+                retries=self.fs_retries,
+                base_delay=self.fs_retry_base_delay,
+                max_delay=self.fs_retry_max_delay,
+                max_total_delay=self.fs_retry_max_total_delay,
+                deadline=self.request_deadline,
+                log=self.log
+            )
+        if (self.circuit_breaker_failures > 0 or
+                self.max_concurrent_fs_calls > 0):
+            fs = CircuitBreakerFileSystem(
+                fs,
+                failure_threshold=self.circuit_breaker_failures,
+                reset_timeout=self.circuit_breaker_reset_timeout,
+                slow_call=self.circuit_breaker_slow_call,
+                max_concurrency=self.max_concurrent_fs_calls,
+                stale_cache_size=self.circuit_breaker_stale_cache_size,
+                log=self.log
+            )
+        metadata, data = self._rate_limit_buckets()
+        if metadata is not None or data is not None:
+            fs = RateLimitedFileSystem(fs, metadata=metadata, data=data,
+                                       observers=self._observers,
+                                       log=self.log)
+        return fs
+
+    def _make_content_cache(self):
+        cache = None
+        if self.disk_cache_dir and self.disk_cache_size > 0:
+            directory = self.disk_cache_dir.format(username=getuser())
+            try:
+                cache = DiskCache(directory, self.disk_cache_size,
+                                  observers=self._observers, log=self.log,
+                                  min_age=self.cache_min_file_age)
+            except (OSError, sqlite3.Error) as exc:
+                self.log.warning("Failed to open disk cache at %s, disk "
+                                 "caching is disabled: %s", directory, exc)
+        if self.content_cache_size > 0:
+            cache = ContentCache(self.content_cache_size,
+                                 observers=self._observers, backing=cache,
+                                 min_age=self.cache_min_file_age)
+        if cache is None:
+            if self.prefetch_files > 0:
+                self.log.warning("Prefetching requires content_cache_size "
+                                 "or disk_cache_dir, prefetching is disabled")
+            return None, None
+        prefetcher = None
+        if self.prefetch_files > 0:
+            prefetcher = Prefetcher(
+                self.fs, cache,
+                max_files=self.prefetch_files,
+                max_file_size=self.prefetch_max_file_size,
+                min_available_memory=self.prefetch_min_available_memory,
+                log=self.log
+            )
+        return cache, prefetcher
+
+    def _make_write_back(self):
+        directory = self.write_back_dir.format(username=getuser())
+        self.log.info("Writing back saves through %s", directory)
+        queue = WriteBackQueue(self.fs, directory,
+                               retry_interval=self.write_back_retry_interval,
+                               log=self.log)
+        # Write pending saves before shutdown where possible
+        atexit.register(queue.close)
+        return queue
+
+    def _rate_limit_buckets(self):
+        user = os.environ.get('JUPYTERHUB_USER') or getuser()
+        limits = dict(metadata_ops_per_second=self.metadata_ops_per_second,
+                      metadata_ops_burst=self.metadata_ops_burst,
+                      bytes_per_second=self.bytes_per_second,
+                      bytes_burst=self.bytes_burst)
+        overrides = self.rate_limit_overrides.get(user, {})
+        unknown = set(overrides).difference(limits)
+        if unknown:
+            raise ValueError("Unknown rate limits for user %r: %s"
+                             % (user, ', '.join(sorted(unknown))))
+        limits.update(overrides)
+
+        metadata = data = None
+        if limits['metadata_ops_per_second'] > 0:
+            metadata = TokenBucket(limits['metadata_ops_per_second'],
+                                   limits['metadata_ops_burst'])
+        if limits['bytes_per_second'] > 0:
+            data = TokenBucket(limits['bytes_per_second'],
+                               limits['bytes_burst'])
+        return metadata, data
+
+    @property
+    def _paths(self):
+        """Translates between api and filesystem paths under ``root_dir``"""
+        return path_translator(self.root_dir)
+
     def ensure_root_directory(self):
         self.log.debug("Creating root notebooks directory: %s", self.root_dir)
         self.fs.mkdir(self.root_dir)
@@ -97,28 +795,54 @@ class HDFSContentsManager(ContentsManager):
             return "file"
 
     def is_hidden(self, path):
-        hdfs_path = to_fs_path(path, self.root_dir)
-        return is_hidden(hdfs_path, self.root_dir)
+        hdfs_path = self._paths.to_fs_path(path)
+        return self._paths.is_hidden(hdfs_path)
 
     def file_exists(self, path):
-        hdfs_path = to_fs_path(path, self.root_dir)
-        return self.fs.isfile(hdfs_path)
+        hdfs_path = self._paths.to_fs_path(path)
+        return (self._pending_write(hdfs_path) is not None or
+                self.fs.isfile(hdfs_path))
 
     def dir_exists(self, path):
-        hdfs_path = to_fs_path(path, self.root_dir)
+        hdfs_path = self._paths.to_fs_path(path)
         return self.fs.isdir(hdfs_path)
 
     def exists(self, path):
-        hdfs_path = to_fs_path(path, self.root_dir)
-        return self.fs.exists(hdfs_path)
+        hdfs_path = self._paths.to_fs_path(path)
+        return (self._pending_write(hdfs_path) is not None or
+                self.fs.exists(hdfs_path))
+
+    def _pending_write(self, hdfs_path):
+        """The save of ``hdfs_path`` pending write-back, or None"""
+        if self._write_back is None:
+            return None
+        return self._write_back.pending(hdfs_path)
+
+    def _written_back(self, hdfs_path, info):
+        """``info`` from the filesystem, with the modification time of the
+        pending save it was written back from"""
+        if self._write_back is None or info['kind'] != 'file':
+            return info
+        mtime = self._write_back.mtime(hdfs_path, info['last_modified'],
+                                       info['size'])
+        if mtime != info['last_modified']:
+            info = dict(info, last_modified=mtime)
+        return info
 
     def _info_and_check_kind(self, path, hdfs_path, kind):
-        try:
-            with perm_to_403(path):
+        pending = self._pending_write(hdfs_path)
+        if pending is not None:
+            info = pending.info()
+        else:
+            try:
                 info = self.fs.info(hdfs_path)
-        except ArrowIOError:
-            raise HTTPError(404, "%s does not exist: %s"
-                            % (kind.capitalize(), path))
+            except ArrowIOError as exc:
+                error = http_error(exc, path)
+                if error is not None and error.status_code != 404:
+                    raise error
+                raise HTTPError(404, "%s does not exist: %s"
+                                % (kind.capitalize(), path))
+            info = self._written_back(hdfs_path, info)
 
         if info['kind'] != kind:
             raise HTTPError(400, "%s is not a %s" % (path, kind))
@@ -133,7 +857,7 @@ class HDFSContentsManager(ContentsManager):
             hdfs_path = urlsplit(info['path']).path
             timestamp = info['last_modified']
 
-        path = to_api_path(hdfs_path, self.root_dir)
+        path = self._paths.to_api_path(hdfs_path)
         name = path.rsplit('/', 1)[-1]
 
         if type is None:
@@ -160,27 +884,124 @@ class HDFSContentsManager(ContentsManager):
 
         return model
 
-    def _dir_model(self, path, hdfs_path, content):
+    def _dir_model(self, path, hdfs_path, content, offset=0, limit=None):
         info = self._info_and_check_kind(path, hdfs_path, 'directory')
         model = self._model_from_info(info, 'directory')
         if content:
-            with perm_to_403(path):
+            with hdfs_errors(path):
                 records = self.fs.ls(hdfs_path, True)
-            contents = [self._model_from_info(i) for i in records]
-            # Filter out hidden files/directories
-            # These are rare, so do this after generating contents, not before
-            model['content'] = [c for c in contents
-                                if self.should_list(c['name']) and not
-                                c['name'].startswith('.')]
+            pending = {}
+            if self._write_back is not None:
+                written = self._write_back.written_in(hdfs_path)
+                if written:
+                    records = self._merge_written(records, written)
+                pending = {p.path.rsplit('/', 1)[-1]: p
+                           for p in self._write_back.pending_in(hdfs_path)}
+                if pending:
+                    records = self._merge_pending(records, pending)
+            # Filter out hidden files/directories before building models, so
+            # only the entries returned are paid for.
+            entries = []
+            for record in records:
+                name = record['name'].rstrip('/').rsplit('/', 1)[-1]
+                if self._should_list_name(name):
+                    entries.append((name, record))
+            if self.max_listing_entries:
+                limit = (self.max_listing_entries if limit is None
+                         else min(limit, self.max_listing_entries))
+            if offset or limit is not None:
+                # Entries are listed in name order, so pages are stable
+                end = len(entries) if limit is None else offset + limit
+                if end < len(entries):
+                    model['truncated'] = True
+                entries = entries[offset:end]
+            if self._prefetcher is not None:
+                self._prefetcher.schedule(
+                    hdfs_path, [e for e in entries if e[0] not in pending]
+                )
+            model['content'] = self._listing_models(
+                self._paths.to_api_path(hdfs_path), entries
+            )
+            if self._write_back is not None:
+                for child in model['content']:
+                    if child['type'] != 'directory':
+                        child['pending_sync'] = child['name'] in pending
             model['format'] = 'json'
         return model
 
-    def _file_model(self, path, hdfs_path, content, format):
+    def _listing_models(self, dir_path, entries):
+        """Build the models of the ``(name, info)`` entries of the directory
+        at api path ``dir_path``.
+
+        Equivalent to ``_model_from_info`` on each entry, but with the work
+        common to all entries done once."""
+        prefix = dir_path + '/' if dir_path else ''
+        # Entries often share timestamps, these share their datetimes
+        timestamps = utcfromtimestamps(info['last_modified_time']
+                                       for _, info in entries)
+        models = []
+        append = models.append
+        for name, info in entries:
+            if info['kind'] == 'directory':
+                type = 'directory'
+                size = mimetype = None
+            elif name.endswith('.ipynb'):
+                type = 'notebook'
+                size = info['size']
+                mimetype = None
+            else:
+                type = 'file'
+                size = info['size']
+                mimetype = guess_mimetype(name)
+            timestamp = timestamps[info['last_modified_time']]
+            append({'name': name,
+                    'path': prefix + name,
+                    'last_modified': timestamp,
+                    'created': timestamp,
+                    'type': type,
+                    'size': size,
+                    'mimetype': mimetype,
+                    'content': None,
+                    'format': None,
+                    'writable': True})
+        return models
+
+    def _merge_written(self, records, written):
+        """Update the ``ls`` records of a directory with the modification
+        times of the pending saves they were written back from, from
+        ``written`` as returned by ``WriteBackQueue.written_in``"""
+        merged = []
+        for record in records:
+            w = written.get(urlsplit(record['name']).path)
+            if (w is not None and
+                    w[:2] == (record['last_modified_time'], record['size'])):
+                record = dict(record, last_modified_time=w[2])
+            merged.append(record)
+        return merged
+
+    def _merge_pending(self, records, pending):
+        """Update the ``ls`` records of a directory with the ``pending``
+        saves of files in it, a dict of name to ``PendingWrite``"""
+        merged = {}
+        for record in records:
+            merged[record['name'].rstrip('/').rsplit('/', 1)[-1]] = record
+        for name, p in pending.items():
+            merged[name] = p.record()
+        return [merged[name] for name in sorted(merged)]
+
+    def _should_list_name(self, name):
+        return self.should_list(name) and not name.startswith('.')
+
+    def _file_model(self, path, hdfs_path, content, format,
+                    require_hash=False):
         info = self._info_and_check_kind(path, hdfs_path, 'file')
         model = self._model_from_info(info, 'file')
+        bcontent = self._read_for_hash(path, hdfs_path, info, model,
+                                       require_hash)
 
         if content:
-            content, format = self._read_file(path, hdfs_path, format)
+            content, format = self._read_file(path, hdfs_path, format, info,
+                                              bcontent)
             if model['mimetype'] is None:
                 model['mimetype'] = {
                     'text': 'text/plain',
@@ -194,26 +1015,67 @@ class HDFSContentsManager(ContentsManager):
 
         return model
 
-    def _notebook_model(self, path, hdfs_path, content=True):
+    def _notebook_model(self, path, hdfs_path, content=True,
+                        require_hash=False):
         info = self._info_and_check_kind(path, hdfs_path, 'file')
         model = self._model_from_info(info, 'notebook')
+        bcontent = self._read_for_hash(path, hdfs_path, info, model,
+                                       require_hash)
 
         if content:
-            contents = self._read_notebook(path, hdfs_path)
+            contents = self._read_notebook(path, hdfs_path, info, bcontent)
             self.mark_trusted_cells(contents, path)
             model['content'] = contents
             model['format'] = 'json'
             self.validate_notebook_model(model)
+            message = self._missing_outputs_message(contents)
+            if message:
+                model['message'] = message
 
         return model
 
-    def _read_file(self, path, hdfs_path, format):
-        if not self.fs.isfile(hdfs_path):
-            raise HTTPError(400, "Cannot read non-file %s" % path)
-
-        with perm_to_403(path):
+    def _read_for_hash(self, path, hdfs_path, info, model, require_hash):
+        """Read the file and add its hash to ``model`` if ``require_hash``,
+        returning the contents (or None)"""
+        if not require_hash:
+            return None
+        bcontent = self._read_bytes(path, hdfs_path, info)
+        model['hash'] = hashlib.sha256(bcontent).hexdigest()
+        model['hash_algorithm'] = 'sha256'
+        return bcontent
+
+    def _read_bytes(self, path, hdfs_path, info=None, opened=True):
+        """Read the file at ``hdfs_path``.
+
+        If ``info`` (as returned by ``fs.info``) is given, the contents
+        cache is checked first. Unless ``opened`` is False, the read is
+        recorded as the user opening the file, for prefetching."""
+        if self._write_back is not None:
+            data = self._write_back.read(hdfs_path)
+            if data is not None:
+                return data
+        cache = self._content_cache
+        if self._prefetcher is not None and opened:
+            self._prefetcher.opened(hdfs_path)
+        if info is not None:
+            mtime, size = info['last_modified'], info['size']
+        if cache is not None and info is not None:
+            data = cache.get(hdfs_path, mtime, size)
+            if data is not None:
+                return data
+        with hdfs_errors(path):
             with self.fs.open(hdfs_path, 'rb') as f:
-                bcontent = f.read()
+                data = f.read()
+        # Skip files modified since ``info`` was fetched
+        if cache is not None and info is not None and len(data) == size:
+            cache.put(hdfs_path, mtime, size, data)
+        return data
+
+    def _read_file(self, path, hdfs_path, format, info=None, bcontent=None):
+        if bcontent is None:
+            if info is None and not self.fs.isfile(hdfs_path):
+                raise HTTPError(400, "Cannot read non-file %s" % path)
+            bcontent = self._read_bytes(path, hdfs_path, info)
 
         if format is None:
             try:
@@ -229,21 +1091,107 @@ class HDFSContentsManager(ContentsManager):
         else:
             return encodebytes(bcontent).decode('ascii'), 'base64'
 
-    def _read_notebook(self, path, hdfs_path):
-        with perm_to_403(path):
-            with self.fs.open(hdfs_path, 'rb') as f:
-                content = f.read()
+    def _read_notebook(self, path, hdfs_path, info=None, bcontent=None):
+        content = bcontent
+        if content is None:
+            content = self._read_bytes(path, hdfs_path, info)
         try:
-            return nbformat.reads(content.decode('utf8'), as_version=4)
+            nb = nbformat.reads(content.decode('utf8'), as_version=4)
         except Exception as e:
             raise HTTPError(400, "Unreadable Notebook: %s\n%r" % (path, e))
-
-    def get(self, path, content=True, type=None, format=None):
-        hdfs_path = to_fs_path(path, self.root_dir)
-
-        if not self.fs.exists(hdfs_path):
+        if self.output_blob_threshold <= 0:
+            return nb
+        missing = join_outputs(nb, partial(self._read_output_blob, path))
+        if missing:
+            self.log.error("Missing outputs of %s, blobs %s not found in %s",
+                           path, ', '.join(missing), self.output_blob_dir)
+        return nb
+
+    def _missing_outputs_message(self, nb):
+        """A message for the model of ``nb`` if some of its outputs couldn't
+        be read, or None"""
+        if self.output_blob_threshold <= 0:
+            return None
+        for cell in nb.get('cells', ()):
+            for output in cell.get('outputs', ()):
+                if OUTPUT_BLOBS_KEY in output.get('metadata', {}):
+                    return ("Some outputs couldn't be read from %s and are "
+                            "shown empty. They're kept when the notebook is "
+                            "saved, until they're replaced."
+                            % self.output_blob_dir)
+        return None
+
+    def _output_blob_path(self, key):
+        return posixpath.join(self._paths.root, self.output_blob_dir,
+                              key[:2], key)
+
+    def _read_output_blob(self, path, key, size):
+        blob_path = self._output_blob_path(key)
+        # Blobs are never modified, their hash and size identify a version
+        info = {'last_modified': 0, 'size': size}
+        try:
+            data = self._read_bytes(path, blob_path, info, opened=False)
+        except HTTPError as exc:
+            if exc.status_code != 404:
+                self.log.error("Failed to read output blob %s: %s",
+                               blob_path, exc.log_message)
+            return None
+        if hashlib.sha256(data).hexdigest() != key:
+            self.log.error("Output blob %s is corrupt, its contents don't "
+                           "match its hash", blob_path)
+            return None
+        try:
+            value = data.decode('utf8')
+        except UnicodeError:
+            return None
+        self._output_blobs.add(key)
+        return value
+
+    def _write_output_blobs(self, path, blobs):
+        for key, data in blobs.items():
+            if key in self._output_blobs:
+                continue
+            blob_path = self._output_blob_path(key)
+            with hdfs_errors(path):
+                if not self.fs.exists(blob_path):
+                    self._publish(blob_path, data)
+            # Forgetting a blob only costs checking it exists again
+            if len(self._output_blobs) > 2**16:
+                self._output_blobs.clear()
+            self._output_blobs.add(key)
+
+    def _serialize_notebook(self, path, nb):
+        """The contents of the notebook file to save ``nb`` as, writing any
+        new output blobs first"""
+        if self.output_blob_threshold > 0:
+            nb, blobs = split_outputs(nb, self.output_blob_threshold)
+            self._write_output_blobs(path, blobs)
+        content = nbformat.writes(nb, version=nbformat.NO_CONVERT)
+        return content.encode('utf8')
+
+    @instrumented('get')
+    @with_hdfs_errors()
+    def get(self, path, content=True, type=None, format=None, offset=0,
+            limit=None, require_hash=False):
+        """Get a file, notebook, or directory model.
+
+        Directory listings may be paginated with ``offset`` and ``limit``,
+        in which case ``truncated`` is set to True in the model if there are
+        more entries after this page. The REST API doesn't pass these
+        arguments, so pagination is only available from Python.
+
+        If ``require_hash``, file and notebook models include the sha256
+        ``hash`` of the file's contents, which may be passed back as the
+        ``expected_hash`` of a save. The REST API doesn't pass this
+        argument, so it's only available from Python."""
+        if offset < 0 or (limit is not None and limit < 0):
+            raise HTTPError(400, "Invalid listing offset or limit")
+        hdfs_path = self._paths.to_fs_path(path)
+        pending = self._pending_write(hdfs_path)
+
+        if pending is None and not self.fs.exists(hdfs_path):
             raise HTTPError(404, 'No such file or directory: %s' % path)
-        elif not self.allow_hidden and is_hidden(hdfs_path, self.root_dir):
+        elif not self.allow_hidden and self._paths.is_hidden(hdfs_path):
             self.log.debug("Refusing to serve hidden directory %r", hdfs_path)
             raise HTTPError(404, 'No such file or directory: %s' % path)
 
@@ -251,20 +1199,24 @@ class HDFSContentsManager(ContentsManager):
             type = self.infer_type(hdfs_path)
 
         if type == 'directory':
-            model = self._dir_model(path, hdfs_path, content)
+            model = self._dir_model(path, hdfs_path, content, offset, limit)
         elif type == 'notebook':
-            model = self._notebook_model(path, hdfs_path, content)
+            model = self._notebook_model(path, hdfs_path, content,
+                                         require_hash)
         else:
-            model = self._file_model(path, hdfs_path, content, format)
+            model = self._file_model(path, hdfs_path, content, format,
+                                     require_hash)
+        if self._write_back is not None and model['type'] != 'directory':
+            model['pending_sync'] = pending is not None
         return model
 
     def _save_directory(self, path, hdfs_path, model):
-        if not self.allow_hidden and is_hidden(hdfs_path, self.root_dir):
+        if not self.allow_hidden and self._paths.is_hidden(hdfs_path):
             raise HTTPError(400, 'Cannot create hidden directory %r' % path)
 
         if not self.fs.exists(hdfs_path):
             self.log.debug("Creating directory at %s", hdfs_path)
-            with perm_to_403(path):
+            with hdfs_errors(path):
                 self.fs.mkdir(hdfs_path)
         elif not self.fs.isdir(hdfs_path):
             raise HTTPError(400, 'Not a directory: %s' % path)
@@ -288,23 +1240,200 @@ class HDFSContentsManager(ContentsManager):
             raise HTTPError(400, 'Encoding error saving %s: %s' % (path, e))
 
         self.log.debug("Saving file to %s", hdfs_path)
-        with perm_to_403(path):
+        self._write_bytes(path, hdfs_path, bcontent, model)
+        return bcontent
+
+    def _write_bytes(self, path, hdfs_path, data, model=None):
+        """Write ``data`` to ``hdfs_path``.
+
+        If ``model`` (the model being saved) has an ``expected_last_modified``
+        or ``expected_hash``, the file is only written if it still matches,
+        otherwise a 409 is raised."""
+        if model is not None and _has_precondition(model):
+            with self._save_lock(hdfs_path), hdfs_errors(path):
+                self._check_precondition(path, hdfs_path, model)
+                self._write_atomic(hdfs_path, data)
+            return
+
+        with hdfs_errors(path):
+            if self._write_back is not None:
+                self._write_back.write(hdfs_path, data)
+                return
             with self.fs.open(hdfs_path, 'wb') as f:
-                f.write(bcontent)
+                f.write(data)
+
+    def _check_precondition(self, path, hdfs_path, model):
+        """Raise a 409 if the file at ``hdfs_path`` doesn't match the
+        ``expected_last_modified`` or ``expected_hash`` of ``model``"""
+        expected_mtime = model.get('expected_last_modified')
+        expected_hash = model.get('expected_hash')
+        if expected_mtime is not None:
+            try:
+                expected_mtime = parse_timestamp(expected_mtime)
+            except ValueError as exc:
+                raise HTTPError(400, str(exc))
+
+        info = self._current_info(path, hdfs_path)
+        if expected_mtime is not None:
+            mtime = utcfromtimestamp(info['last_modified'])
+            # HDFS modification times have millisecond precision
+            if abs(mtime - expected_mtime) >= timedelta(milliseconds=1):
+                raise HTTPError(409, "%s has been modified since it was "
+                                "last read (at %s)" % (path, mtime))
+        if expected_hash is not None:
+            data = self._read_bytes(path, hdfs_path, info)
+            if hashlib.sha256(data).hexdigest() != expected_hash:
+                raise HTTPError(409, "%s has been modified since it was "
+                                "last read" % path)
+
+    def _save_lock(self, hdfs_path):
+        """The lock serializing conditional saves of ``hdfs_path``"""
+        return self._save_locks[hash(hdfs_path) % len(self._save_locks)]
+
+    def _current_info(self, path, hdfs_path):
+        """The info of the file being conditionally saved, raising a 409
+        if it's been deleted"""
+        pending = self._pending_write(hdfs_path)
+        if pending is not None:
+            return pending.info()
+        try:
+            return self._written_back(hdfs_path, self.fs.info(hdfs_path))
+        except ArrowIOError as exc:
+            error = http_error(exc, path)
+            if error is None or error.status_code != 404:
+                raise
+            raise HTTPError(409, "%s has been deleted since it was "
+                            "last read" % path)
+
+    def _write_atomic(self, hdfs_path, data):
+        if self._write_back is not None:
+            # Written to local disk atomically
+            return self._write_back.write(hdfs_path, data).info()
+        self._publish(hdfs_path, data)
+        return self.fs.info(hdfs_path)
+
+    def _publish(self, hdfs_path, data):
+        """Write ``data`` to a temporary file beside ``hdfs_path``, then
+        move it into place, so the file is never seen partially written.
+
+        HDFS renames don't replace an existing file, so this isn't atomic:
+        an existing file is first moved aside to a backup, and briefly
+        doesn't exist. If the new version can't be moved into place the
+        backup is restored, and if that fails too both are left beside the
+        file to be recovered by hand."""
+        dir_path, name = posixpath.split(hdfs_path)
+        token = uuid.uuid4().hex
+        tmp_path = posixpath.join(dir_path, '.~%s.%s.tmp' % (name, token))
+        backup_path = posixpath.join(dir_path, '.~%s.%s.bak' % (name, token))
+        try:
+            with self.fs.open(tmp_path, 'wb') as f:
+                f.write(data)
+            if self.fs.exists(hdfs_path):
+                self.fs.rename(hdfs_path, backup_path)
+            else:
+                backup_path = None
+        except BaseException:
+            self._remove_quietly(tmp_path)
+            raise
+        try:
+            self.fs.rename(tmp_path, hdfs_path)
+        except BaseException:
+            if backup_path is not None:
+                try:
+                    self.fs.rename(backup_path, hdfs_path)
+                except Exception:
+                    # Neither version is in place, keep both
+                    self.log.error("Failed to restore %s from %s, the new "
+                                   "version is in %s", hdfs_path,
+                                   backup_path, tmp_path, exc_info=True)
+                    raise
+            self._remove_quietly(tmp_path)
+            raise
+        if backup_path is not None:
+            self._remove_quietly(backup_path)
+
+    def _remove_quietly(self, hdfs_path):
+        """Delete ``hdfs_path`` if it exists, only logging failures"""
+        try:
+            if self.fs.exists(hdfs_path):
+                self.fs.delete(hdfs_path)
+        except Exception:
+            self.log.warning("Failed to remove %s", hdfs_path, exc_info=True)
 
     def _save_notebook(self, path, hdfs_path, model):
+        """Save a notebook, returning the validation message and the
+        contents written"""
         nb = nbformat.from_dict(model['content'])
         self.check_and_sign(nb, path)
-        content = nbformat.writes(nb, version=nbformat.NO_CONVERT)
-        bcontent = content.encode('utf8')
+        bcontent = self._serialize_notebook(path, nb)
         self.log.debug("Saving notebook to %s", hdfs_path)
-        with perm_to_403(path):
-            with self.fs.open(hdfs_path, 'wb') as f:
-                f.write(bcontent)
+        self._write_bytes(path, hdfs_path, bcontent, model)
         self.validate_notebook_model(model)
-        return model.get('message')
+        return model.get('message'), bcontent
+
+    def _save_notebook_patch(self, path, hdfs_path, model):
+        """Save a notebook by applying the JSON patch in ``model['content']``
+        to the version with hash ``model['base_hash']``, returning the
+        validation message and the saved notebook's hash"""
+        base_hash = model.get('base_hash')
+        if not isinstance(base_hash, str):
+            raise HTTPError(400, "Patching %s requires a base_hash" % path)
+
+        with self._save_lock(hdfs_path), hdfs_errors(path):
+            info = self._current_info(path, hdfs_path)
+            mtime, size = info['last_modified'], info['size']
+            base = self._notebooks.get(hdfs_path, mtime, size, base_hash)
+            if base is None:
+                data = self._read_bytes(path, hdfs_path, info)
+                if hashlib.sha256(data).hexdigest() != base_hash:
+                    raise HTTPError(409, "%s has been modified since it was "
+                                    "last read" % path)
+                base = self._read_notebook(path, hdfs_path, info, data)
+                self.mark_trusted_cells(base, path)
 
+            try:
+                # Only the values added are converted, the rest is shared
+                # with the (already converted) base
+                nb = apply_patch(base, model['content'],
+                                 convert=nbformat.from_dict)
+            except PatchConflict as exc:
+                raise HTTPError(409, "Cannot patch %s: %s" % (path, exc))
+            except ValueError as exc:
+                raise HTTPError(400, "Invalid patch for %s: %s" % (path, exc))
+            # Signing pops the cells' trust marks. The patched notebook
+            # shares its cells with the cached base, and is cached for the
+            # next patch, so sign a copy.
+            signed = _copy_cell_metadata(nb)
+            self.check_and_sign(signed, path)
+            data = self._serialize_notebook(path, signed)
+            nb_hash = hashlib.sha256(data).hexdigest()
+            self.log.debug("Saving patched notebook to %s", hdfs_path)
+            info = self._write_atomic(hdfs_path, data)
+            self._forget(hdfs_path)
+            self._notebooks.put(hdfs_path, info['last_modified'],
+                                info['size'], nb_hash, nb)
+
+        nb_model = {'content': nb}
+        self.validate_notebook_model(nb_model)
+        return nb_model.get('message'), nb_hash
+
+    @instrumented('save', path_arg=1)
+    @with_hdfs_errors(path_arg=1)
     def save(self, model, path):
+        """Save a file, notebook, or directory model.
+
+        Files and notebooks may be saved conditionally, by including the
+        ``last_modified`` time or ``hash`` of the version the save is based
+        on as ``expected_last_modified`` or ``expected_hash``. If the file
+        has been modified since, a 409 is raised and it's left unchanged.
+        Conditional saves return the ``hash`` of the contents saved.
+
+        Notebooks may also be saved with a JSON patch against the version
+        with hash ``base_hash``, by setting ``format`` to ``'json-patch'``
+        and ``content`` to the list of operations. The model returned
+        includes the ``hash`` of the saved notebook, to base the next patch
+        on. Over the REST API, where ``get`` can't return hashes, the first
+        patch must be based on the hash returned by a conditional save."""
         if 'type' not in model:
             raise HTTPError(400, 'No file type provided')
 
@@ -313,26 +1442,48 @@ class HDFSContentsManager(ContentsManager):
         if 'content' not in model and typ != 'directory':
             raise HTTPError(400, 'No file content provided')
 
-        hdfs_path = to_fs_path(path, self.root_dir)
+        hdfs_path = self._paths.to_fs_path(path)
+        if typ != 'directory':
+            self._flush_checkpoints(path)
 
         message = None
-        if typ == 'notebook':
-            message = self._save_notebook(path, hdfs_path, model)
+        saved_hash = None
+        data = None
+        patched = typ == 'notebook' and model.get('format') == 'json-patch'
+        if patched:
+            message, saved_hash = self._save_notebook_patch(path, hdfs_path,
+                                                            model)
+        elif typ == 'notebook':
+            message, data = self._save_notebook(path, hdfs_path, model)
         elif typ == 'file':
-            self._save_file(path, hdfs_path, model)
+            data = self._save_file(path, hdfs_path, model)
         elif typ == 'directory':
             self._save_directory(path, hdfs_path, model)
         else:
             raise HTTPError(400, "Unhandled contents type: %s" % typ)
+        if not patched:
+            # Patched saves keep the parsed notebook cached
+            self._forget(hdfs_path)
+        if data is not None and _has_precondition(model):
+            saved_hash = hashlib.sha256(data).hexdigest()
 
         model = self.get(path, type=model["type"], content=False)
+        if saved_hash is not None:
+            model['hash'] = saved_hash
+            model['hash_algorithm'] = 'sha256'
         if message is not None:
             model['message'] = message
 
         return model
 
+    def _forget(self, hdfs_path):
+        """Drop cached contents of ``hdfs_path`` and any paths beneath it"""
+        if self._content_cache is not None:
+            self._content_cache.discard(hdfs_path)
+        self._notebooks.discard(hdfs_path)
+
     def _is_dir_empty(self, path, hdfs_path):
-        with perm_to_403(path):
+        with hdfs_errors(path):
             files = self.fs.ls(hdfs_path)
         if not files:
             return True
@@ -340,43 +1491,83 @@ class HDFSContentsManager(ContentsManager):
         files = {f.rsplit('/', 1)[-1] for f in files} - {cp_dir}
         return not files
 
+    def _flush_writes(self, path, hdfs_path):
+        # Pending saves would be written to the old path after a rename or
+        # delete, make sure they're written first.
+        if self._write_back is not None:
+            with hdfs_errors(path):
+                self._write_back.flush(hdfs_path)
+
+    def _flush_checkpoints(self, path):
+        # Background checkpoints copy from the original file, make sure
+        # they've completed before overwriting, moving or deleting it.
+        flush = getattr(self.checkpoints, 'flush', None)
+        if flush is not None:
+            flush(path)
+
+    def create_checkpoint(self, path):
+        if self.write_back_sync_on_checkpoint:
+            self._flush_writes(path, self._paths.to_fs_path(path))
+        return super().create_checkpoint(path)
+
+    def restore_checkpoint(self, checkpoint_id, path):
+        # A pending save would overwrite the restored file
+        self._flush_writes(path, self._paths.to_fs_path(path))
+        super().restore_checkpoint(checkpoint_id, path)
+
+    @instrumented('delete_file')
+    @with_hdfs_errors()
     def delete_file(self, path):
-        hdfs_path = to_fs_path(path, self.root_dir)
+        hdfs_path = self._paths.to_fs_path(path)
+        self._flush_writes(path, hdfs_path)
 
         if not self.fs.exists(hdfs_path):
             raise HTTPError(
                 404, 'File or directory does not exist: %s' % path
             )
 
+        self._flush_checkpoints(path)
+
         if self.fs.isdir(hdfs_path):
             if not self._is_dir_empty(path, hdfs_path):
                 raise HTTPError(400, 'Directory %s not empty' % path)
             self.log.debug("Deleting directory at %s", hdfs_path)
-            with perm_to_403(path):
+            with hdfs_errors(path):
                 self.fs.delete(hdfs_path, recursive=True)
         else:
             self.log.debug("Deleting file at %s", hdfs_path)
-            with perm_to_403(path):
+            with hdfs_errors(path):
                 self.fs.delete(hdfs_path)
+        self._forget(hdfs_path)
 
+    @instrumented('rename_file')
+    @with_hdfs_errors()
     def rename_file(self, old_path, new_path):
         if old_path == new_path:
             return
 
-        old_hdfs_path = to_fs_path(old_path, self.root_dir)
-        new_hdfs_path = to_fs_path(new_path, self.root_dir)
+        old_hdfs_path = self._paths.to_fs_path(old_path)
+        new_hdfs_path = self._paths.to_fs_path(new_path)
+        self._flush_writes(old_path, old_hdfs_path)
+        self._flush_writes(new_path, new_hdfs_path)
 
         if self.fs.exists(new_hdfs_path):
             raise HTTPError(409, 'File already exists: %s' % new_path)
 
+        self._flush_checkpoints(old_path)
+
         # Move the file
         self.log.debug("Renaming %s -> %s", old_hdfs_path, new_hdfs_path)
         try:
-            with perm_to_403(old_path):
-                self.fs.rename(old_hdfs_path, new_hdfs_path)
-        except HTTPError:
-            raise
+            self.fs.rename(old_hdfs_path, new_hdfs_path)
         except Exception as e:
+            # A conflict is with the destination (created since it was
+            # checked), other errors are reported for the file renamed
+            conflict = classify_error(e) == 409
+            error = http_error(e, new_path if conflict else old_path)
+            if error is not None:
+                raise error
             raise HTTPError(
                 500, 'Unknown error renaming file: %s\n%s' % (old_path, e)
             )
+        self._forget(old_hdfs_path)
@@ -0,0 +1,260 @@
+"""Instrumentation of contents operations and filesystem calls.
+
+Metrics are exported using ``prometheus_client`` (if installed), and are
+served by the notebook server's ``/metrics`` endpoint.
+"""
+import threading
+import time
+from functools import wraps
+
+from tornado.web import HTTPError
+
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+
+__all__ = ('InstrumentedFileSystem', 'PrometheusObserver', 'instrumented')
+
+
+# Filesystem methods that make calls to the namenode
+FS_CALLS = frozenset(['info', 'ls', 'open', 'rename', 'mkdir', 'delete',
+                      'exists', 'isdir', 'isfile'])
+
+
+class InstrumentedFile(object):
+    """Wraps a file object, reporting reads and writes to observers"""
+    def __init__(self, file, path, observers):
+        self._file = file
+        self._path = path
+        self._observers = observers
+
+    def _notify(self, call, start, nbytes, error):
+        duration = time.perf_counter() - start
+        for o in self._observers:
+            o.fs_call(call, self._path, duration, nbytes, error)
+
+    def read(self, *args):
+        start = time.perf_counter()
+        data = b''
+        error = None
+        try:
+            data = self._file.read(*args)
+            return data
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            self._notify('read', start, len(data), error)
+
+    def write(self, data):
+        start = time.perf_counter()
+        error = None
+        try:
+            return self._file.write(data)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            self._notify('write', start, len(data), error)
+
+    def upload(self, stream, *args, **kwargs):
+        start = time.perf_counter()
+        error = None
+        try:
+            before = self._file.tell()
+        except Exception:
+            before = None
+        try:
+            return self._file.upload(stream, *args, **kwargs)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            try:
+                nbytes = self._file.tell() - before
+            except Exception:
+                nbytes = 0
+            self._notify('write', start, nbytes, error)
+
+    def __getattr__(self, attr):
+        return getattr(self._file, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._file.close()
+
+
+class InstrumentedFileSystem(object):
+    """Wraps a filesystem, reporting every namenode call to observers.
+
+    Each observer must have a method ``fs_call(call, path, duration, nbytes,
+    error)``, where ``error`` is the raised exception, or None. Attributes
+    other than the instrumented calls are forwarded to the wrapped
+    filesystem."""
+    def __init__(self, fs, observers):
+        self.fs = fs
+        self.observers = list(observers)
+
+    def _call(self, call, path, *args, **kwargs):
+        start = time.perf_counter()
+        error = None
+        try:
+            return getattr(self.fs, call)(path, *args, **kwargs)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            for o in self.observers:
+                o.fs_call(call, path, duration, 0, error)
+
+    def open(self, path, *args, **kwargs):
+        f = self._call('open', path, *args, **kwargs)
+        return InstrumentedFile(f, path, self.observers)
+
+    def __getattr__(self, attr):
+        if attr in FS_CALLS:
+            return lambda path, *args, **kwargs: self._call(attr, path, *args,
+                                                            **kwargs)
+        return getattr(self.fs, attr)
+
+
+class PrometheusObserver(object):
+    """Records contents operations and filesystem calls as prometheus metrics.
+
+    The metrics are registered once per process, and shared by all
+    observers."""
+    _metrics = None
+
+    def __init__(self):
+        if prometheus_client is None:
+            raise ImportError("prometheus_client is required for metrics")
+        cls = type(self)
+        if cls._metrics is None:
+            cls._metrics = (
+                prometheus_client.Histogram(
+                    'hdfscm_contents_operation_duration_seconds',
+                    'Duration of contents operations',
+                    ['operation']
+                ),
+                prometheus_client.Histogram(
+                    'hdfscm_fs_call_duration_seconds',
+                    'Duration of filesystem calls',
+                    ['call']
+                ),
+                prometheus_client.Counter(
+                    'hdfscm_fs_bytes_total',
+                    'Bytes read from and written to the filesystem',
+                    ['direction']
+                ),
+                prometheus_client.Counter(
+                    'hdfscm_contents_errors_total',
+                    'Failed contents operations, by HTTP status',
+                    ['operation', 'status']
+                ),
+                prometheus_client.Counter(
+                    'hdfscm_fs_call_errors_total',
+                    'Failed filesystem calls',
+                    ['call']
+                ),
+                prometheus_client.Counter(
+                    'hdfscm_throttled_total',
+                    'Filesystem calls rejected by rate limits',
+                    ['kind']
+                ),
+                prometheus_client.Counter(
+                    'hdfscm_cache_lookups_total',
+                    'Cache lookups, by outcome',
+                    ['cache', 'outcome']
+                ),
+            )
+        (self.operation_seconds, self.fs_call_seconds, self.fs_bytes,
+         self.operation_errors, self.fs_call_errors, self.throttled,
+         self.cache_lookups) = cls._metrics
+
+    def start_operation(self, operation, path):
+        pass
+
+    def operation(self, operation, duration, status=None):
+        self.operation_seconds.labels(operation).observe(duration)
+        if status is not None:
+            self.operation_errors.labels(operation, str(status)).inc()
+
+    def fs_call(self, call, path, duration, nbytes, error):
+        self.fs_call_seconds.labels(call).observe(duration)
+        if nbytes:
+            direction = 'read' if call == 'read' else 'written'
+            self.fs_bytes.labels(direction).inc(nbytes)
+        if error is not None:
+            self.fs_call_errors.labels(call).inc()
+
+    def throttle(self, kind):
+        self.throttled.labels(kind).inc()
+
+    def cache_lookup(self, cache, outcome):
+        self.cache_lookups.labels(cache, outcome).inc()
+
+
+# Per-thread state of the contents operation in progress
+_request = threading.local()
+
+
+def request_start():
+    """The ``time.monotonic()`` at which the outermost contents operation in
+    progress on this thread started, or None if there is none"""
+    return getattr(_request, 'start', None)
+
+
+def instrumented(operation, path_arg=0):
+    """Decorate a contents manager or checkpoints method to record its
+    duration and errors.
+
+    Records to the ``_observers`` attribute of the instance, and is a no-op
+    if there are none. Observers must have methods
+    ``start_operation(operation, path)`` and ``operation(operation, duration,
+    status)``, where ``status`` is the HTTP status code of the error raised,
+    or None. ``path_arg`` is the index of the api path in the method's
+    positional arguments.
+
+    The start of the outermost operation on each thread is always tracked,
+    see ``request_start``."""
+    def decorator(func):
+        @wraps(func)
+        def inner(self, *args, **kwargs):
+            outermost = request_start() is None
+            if outermost:
+                _request.start = time.monotonic()
+            try:
+                return _observe(self._observers, operation, path_arg,
+                                func, self, *args, **kwargs)
+            finally:
+                if outermost:
+                    _request.start = None
+        return inner
+    return decorator
+
+
+def _observe(observers, operation, path_arg, func, self, *args, **kwargs):
+    if not observers:
+        return func(self, *args, **kwargs)
+    path = args[path_arg] if len(args) > path_arg else None
+    for o in observers:
+        o.start_operation(operation, path)
+    start = time.perf_counter()
+    status = None
+    try:
+        return func(self, *args, **kwargs)
+    except HTTPError as exc:
+        status = exc.status_code
+        raise
+    except Exception:
+        status = 500
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        for o in observers:
+            o.operation(operation, duration, status)
@@ -0,0 +1,144 @@
+"""Separate storage of large notebook outputs.
+
+Most of the size of a large notebook is usually in a few outputs (images,
+HTML, etc.), which rarely change between saves. ``split_outputs`` moves
+output data above a size threshold out of the notebook, replacing it with
+a reference to a content-addressed blob, and ``join_outputs`` puts it back.
+
+The notebook stays a valid notebook: each split output keeps its mimetypes
+with empty data, and lists the hash and size of the blobs holding them in
+its metadata under ``OUTPUT_BLOBS_KEY``. References to blobs that can't be
+read are kept until the output is replaced, so they're never lost by
+saving a notebook read while a blob was missing.
+"""
+import hashlib
+import re
+
+
+__all__ = ('OUTPUT_BLOBS_KEY', 'split_outputs', 'join_outputs',
+           'output_blob_keys')
+
+
+OUTPUT_BLOBS_KEY = 'hdfscm_blobs'
+
+
+def _copy(value):
+    return type(value)(value)
+
+
+def _is_empty(value):
+    return value == '' or value == []
+
+
+def _is_ref(ref):
+    """Whether ``ref`` is a valid blob reference. Notebooks are user
+    content, so references are checked before they're used as paths."""
+    return (isinstance(ref, dict) and
+            isinstance(ref.get('sha256'), str) and
+            re.fullmatch('[0-9a-f]{64}', ref['sha256']) is not None and
+            type(ref.get('size')) is int and ref['size'] >= 0)
+
+
+def _split_output(output, threshold, blobs):
+    data = output.get('data')
+    if not data:
+        return output
+    metadata = output.get('metadata', {})
+    kept = metadata.get(OUTPUT_BLOBS_KEY) or {}
+    # Unresolved references, while their data hasn't been replaced
+    refs = {m: ref for m, ref in kept.items() if _is_empty(data.get(m))}
+    split = {}
+    for mimetype, value in data.items():
+        if isinstance(value, list):
+            value = ''.join(value)
+        if not isinstance(value, str) or len(value) <= threshold:
+            continue
+        blob = value.encode('utf8')
+        key = hashlib.sha256(blob).hexdigest()
+        blobs[key] = blob
+        split[mimetype] = {'sha256': key, 'size': len(blob)}
+    if not split and refs == kept:
+        return output
+    output = _copy(output)
+    output['metadata'] = metadata = _copy(metadata)
+    if split:
+        output['data'] = data = _copy(data)
+        for mimetype in split:
+            data[mimetype] = ''
+    refs.update(split)
+    if refs:
+        metadata[OUTPUT_BLOBS_KEY] = refs
+    else:
+        del metadata[OUTPUT_BLOBS_KEY]
+    return output
+
+
+def split_outputs(nb, threshold):
+    """Split the output data of ``nb`` longer than ``threshold``
+    characters into blobs.
+
+    Returns the split notebook, and a dict of the blobs' contents by hash.
+    ``nb`` isn't modified, the split notebook shares the cells without
+    large outputs with it."""
+    blobs = {}
+    cells = list(nb.get('cells', ()))
+    changed = False
+    for i, cell in enumerate(cells):
+        outputs = cell.get('outputs')
+        if not outputs:
+            continue
+        split = [_split_output(o, threshold, blobs) for o in outputs]
+        if any(s is not o for s, o in zip(split, outputs)):
+            cells[i] = cell = _copy(cell)
+            cell['outputs'] = split
+            changed = True
+    if not changed:
+        return nb, blobs
+    nb = _copy(nb)
+    nb['cells'] = cells
+    return nb, blobs
+
+
+def join_outputs(nb, load):
+    """Put the split output data of ``nb`` back, in place.
+
+    ``load(key, size)`` returns the contents of the blob with hash ``key``
+    and length ``size`` as a string, or None if it's missing. It's only
+    called for references with a hex SHA-256 key, the data of invalid
+    references and missing blobs is left empty, and the references are kept
+    in the output's metadata. Returns the hashes of any missing blobs."""
+    missing = []
+    for cell in nb.get('cells', ()):
+        for output in cell.get('outputs', ()):
+            metadata = output.get('metadata', {})
+            refs = metadata.pop(OUTPUT_BLOBS_KEY, None)
+            if not refs:
+                continue
+            unresolved = {}
+            for mimetype, ref in refs.items():
+                if not _is_ref(ref):
+                    unresolved[mimetype] = ref
+                    missing.append(repr(ref))
+                    continue
+                value = load(ref['sha256'], ref['size'])
+                if value is None:
+                    unresolved[mimetype] = ref
+                    missing.append(ref['sha256'])
+                else:
+                    output['data'][mimetype] = value
+            if unresolved:
+                metadata[OUTPUT_BLOBS_KEY] = unresolved
+    return missing
+
+
+def output_blob_keys(nb):
+    """The hashes of the blobs referenced by the outputs of ``nb``, a
+    notebook as parsed from JSON"""
+    keys = set()
+    for cell in nb.get('cells', ()):
+        for output in cell.get('outputs', ()):
+            refs = output.get('metadata', {}).get(OUTPUT_BLOBS_KEY)
+            if isinstance(refs, dict):
+                keys.update(ref['sha256'] for ref in refs.values()
+                            if _is_ref(ref))
+    return keys
@@ -0,0 +1,265 @@
+"""Caching and prefetching of file contents.
+
+Users typically list a directory and then open one of the few most recently
+modified, or most recently opened, files in it. When a directory is listed,
+``Prefetcher`` reads the most likely candidates into a ``ContentCache`` on a
+background thread, so that opening them doesn't wait on HDFS.
+"""
+import os
+import posixpath
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from .utils import CoalescingQueue, _is_subpath
+
+
+__all__ = ('ContentCache', 'Prefetcher', 'available_memory')
+
+
+def available_memory():
+    """The memory available to the system without swapping, in bytes, or
+    None if unknown"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class ContentCache(object):
+    """A cache of file contents, bounded to ``max_bytes`` in total and
+    evicting the least recently used files first.
+
+    Entries are keyed by filesystem path, and are only returned while the
+    file's modification time and size are unchanged. Modification times may
+    be as coarse as a second, so a file rewritten with the same size within
+    that second would look unchanged: files modified less than ``min_age``
+    seconds ago aren't cached. Each lookup is reported
+    to the observers' ``cache_lookup(cache, outcome)`` method, where
+    ``cache`` is ``name`` and ``outcome`` is one of ``'hit'``,
+    ``'prefetch_hit'`` (the first hit on a prefetched entry), or
+    ``'miss'``.
+
+    If ``backing`` is given (e.g. a ``hdfscm.diskcache.DiskCache``), it's
+    written through to, and checked on misses."""
+    def __init__(self, max_bytes, name='content', observers=(),
+                 backing=None, min_age=2):
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.name = name
+        self.observers = list(observers)
+        self.backing = backing
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.prefetch_hits = 0
+        self.prefetch_evicted = 0
+        # path -> [mtime, size, data, prefetched], least recent first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, path, mtime, size):
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        if entry[0] != mtime or entry[1] != size:
+            self._remove(path)
+            return None
+        return entry
+
+    def get(self, path, mtime, size):
+        """The cached contents of ``path``, or None"""
+        with self._lock:
+            entry = self._lookup(path, mtime, size)
+            if entry is None:
+                self.misses += 1
+                outcome = 'miss'
+            else:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                outcome = 'hit'
+                if entry[3]:
+                    entry[3] = False
+                    self.prefetch_hits += 1
+                    outcome = 'prefetch_hit'
+        for o in self.observers:
+            o.cache_lookup(self.name, outcome)
+        if entry is not None:
+            return entry[2]
+        if self.backing is not None:
+            data = self.backing.get(path, mtime, size)
+            if data is not None:
+                self._put(path, mtime, size, data, False)
+            return data
+        return None
+
+    def contains(self, path, mtime, size):
+        """Whether up to date contents of ``path`` are cached, without
+        counting as a use"""
+        with self._lock:
+            if self._lookup(path, mtime, size) is not None:
+                return True
+        return (self.backing is not None and
+                self.backing.contains(path, mtime, size))
+
+    def put(self, path, mtime, size, data, prefetched=False):
+        if self.min_age > 0 and time.time() - mtime < self.min_age:
+            # May still be modified without changing its mtime
+            return
+        self._put(path, mtime, size, data, prefetched)
+        if self.backing is not None:
+            self.backing.put(path, mtime, size, data, prefetched)
+
+    def _put(self, path, mtime, size, data, prefetched):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(path)
+            while self.nbytes + len(data) > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+            self._entries[path] = [mtime, size, data, prefetched]
+            self.nbytes += len(data)
+            if prefetched:
+                self.prefetched += 1
+
+    def _remove(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.nbytes -= len(entry[2])
+            if entry[3]:
+                self.prefetch_evicted += 1
+
+    def discard(self, path):
+        """Drop the entries for ``path`` and any paths beneath it"""
+        with self._lock:
+            for key in [k for k in self._entries if _is_subpath(k, path)]:
+                self._remove(key)
+        if self.backing is not None:
+            self.backing.discard(path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+        if self.backing is not None:
+            self.backing.clear()
+
+    @property
+    def hit_rate(self):
+        """The fraction of lookups that were hits"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'bytes': self.nbytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hit_rate,
+                    'prefetched': self.prefetched,
+                    'prefetch_hits': self.prefetch_hits,
+                    'prefetch_evicted': self.prefetch_evicted}
+
+
+class Prefetcher(object):
+    """Reads the files most likely to be opened next into ``cache`` when a
+    directory is listed.
+
+    Up to ``max_files`` files of at most ``max_file_size`` bytes are
+    prefetched per listing, the most recently opened first (from a history
+    of the last ``history_size`` files opened), then the most recently
+    modified. Prefetches are made one at a time on a background thread, and
+    those still queued are dropped when another directory is listed. While
+    the system has less than ``min_available_memory`` bytes of memory
+    available, prefetching stops and queued prefetches are cancelled."""
+    def __init__(self, fs, cache, max_files=3, max_file_size=16 * 2**20,
+                 min_available_memory=0, history_size=100, log=None):
+        self.fs = fs
+        self.cache = cache
+        self.max_files = max_files
+        self.max_file_size = max_file_size
+        self.min_available_memory = min_available_memory
+        self.history_size = history_size
+        self.log = log
+        self.cancelled = 0
+        self.failed = 0
+        # Paths opened, least recent first
+        self._history = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = CoalescingQueue(log, name='hdfscm-prefetch')
+
+    def opened(self, path):
+        """Record that ``path`` was opened"""
+        with self._lock:
+            self._history.pop(path, None)
+            self._history[path] = None
+            while len(self._history) > self.history_size:
+                self._history.popitem(last=False)
+
+    def _under_pressure(self):
+        if not self.min_available_memory:
+            return False
+        available = available_memory()
+        return (available is not None and
+                available < self.min_available_memory)
+
+    def candidates(self, dir_path, entries):
+        """The ``(path, info)`` of the files to prefetch out of the ``(name,
+        info)`` entries of the directory ``dir_path``, most likely first"""
+        with self._lock:
+            recency = {p: i for i, p in enumerate(self._history)}
+        ranked = []
+        for name, info in entries:
+            if info['kind'] != 'file' or info['size'] > self.max_file_size:
+                continue
+            path = posixpath.join(dir_path, name)
+            key = (recency.get(path, -1), info['last_modified_time'])
+            ranked.append((key, path, info))
+        ranked.sort(key=lambda r: r[0], reverse=True)
+        return [(path, info) for _, path, info in ranked[:self.max_files]]
+
+    def schedule(self, dir_path, entries):
+        """Queue prefetches for a listing of the directory ``dir_path``"""
+        # Prefetches for an earlier listing are no longer the best bets
+        self.cancelled += self._queue.cancel()
+        if self._under_pressure():
+            return
+        for path, info in self.candidates(dir_path, entries):
+            mtime, size = info['last_modified_time'], info['size']
+            if not self.cache.contains(path, mtime, size):
+                self._queue.submit(path,
+                                   partial(self._fetch, path, mtime, size))
+
+    def _fetch(self, path, mtime, size):
+        if self._under_pressure():
+            self.cancelled += self._queue.cancel() + 1
+            if self.log is not None:
+                self.log.debug("Low on memory, cancelled prefetching")
+            return
+        if self.cache.contains(path, mtime, size):
+            return
+        try:
+            with self.fs.open(path, 'rb') as f:
+                data = f.read()
+        except Exception as exc:
+            self.failed += 1
+            if self.log is not None:
+                self.log.debug("Failed to prefetch %s: %s", path, exc)
+            return
+        # Skip files modified since they were listed
+        if len(data) == size:
+            self.cache.put(path, mtime, size, data, prefetched=True)
+
+    def wait(self):
+        """Wait for queued prefetches to complete"""
+        self._queue.flush()
@@ -0,0 +1,152 @@
+"""Rate limiting of namenode metadata reads and data transfer.
+
+Limits apply per notebook server process, which under JupyterHub means per
+user. Calls over the limit fail immediately rather than waiting, as contents
+operations run on the notebook server's event loop.
+"""
+import threading
+import time
+
+from tornado.web import HTTPError
+
+
+__all__ = ('RateLimitedFileSystem', 'RateLimitExceeded', 'TokenBucket')
+
+
+# Filesystem methods limited by the metadata rate
+METADATA_CALLS = frozenset(['info', 'ls', 'exists', 'isdir', 'isfile'])
+
+
+class RateLimitExceeded(HTTPError):
+    """A filesystem call rejected by the rate limit"""
+    def __init__(self, kind):
+        super().__init__(429, "Rate limit exceeded for filesystem %s, try "
+                              "again later" % kind)
+        self.kind = kind
+
+
+class TokenBucket(object):
+    """A token bucket, refilling at ``rate`` tokens per second up to a
+    maximum of ``burst`` tokens.
+
+    Requests larger than ``burst`` can still be made, leaving the bucket in
+    debt until it refills."""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def take(self, n):
+        """Take ``n`` tokens if the bucket holds ``min(n, burst)`` of them.
+
+        Returns whether the tokens were taken."""
+        with self._lock:
+            self._refill()
+            if self.tokens < min(n, self.burst):
+                return False
+            self.tokens -= n
+            return True
+
+    def charge(self, n):
+        """Take ``n`` tokens without waiting, for usage only known after
+        the fact"""
+        with self._lock:
+            self._refill()
+            self.tokens -= n
+
+
+class RateLimitedFile(object):
+    """Wraps a file object, limiting the rate of reads and charging for
+    writes.
+
+    Writes are never rejected, as the file has already been truncated when
+    opened for writing. Instead, opening a file for writing is rejected
+    while the bucket is in debt."""
+    def __init__(self, file, fs):
+        self._file = file
+        self._fs = fs
+
+    def read(self, *args):
+        # The size of a read isn't known in advance, require any debt from
+        # earlier transfers to be paid off, then charge for it after.
+        self._fs._throttle(self._fs.data, 'data', 0)
+        data = self._file.read(*args)
+        self._fs.data.charge(len(data))
+        return data
+
+    def write(self, data):
+        try:
+            return self._file.write(data)
+        finally:
+            self._fs.data.charge(len(data))
+
+    def upload(self, stream, *args, **kwargs):
+        before = self._file.tell()
+        try:
+            return self._file.upload(stream, *args, **kwargs)
+        finally:
+            self._fs.data.charge(self._file.tell() - before)
+
+    def __getattr__(self, attr):
+        return getattr(self._file, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._file.close()
+
+
+class RateLimitedFileSystem(object):
+    """Wraps a filesystem, limiting the rate of metadata reads to the
+    ``metadata`` token bucket, and of bytes read and written to the ``data``
+    token bucket (either may be None for no limit).
+
+    Calls over the limit fail immediately with ``RateLimitExceeded``. Each
+    rejected call is reported to the ``throttle(kind)`` method of each
+    observer, where ``kind`` is ``'metadata'`` or ``'data'``. Attributes
+    other than the limited calls are forwarded to the wrapped filesystem."""
+    def __init__(self, fs, metadata=None, data=None, observers=(), log=None):
+        self.fs = fs
+        self.metadata = metadata
+        self.data = data
+        self.observers = list(observers)
+        self.log = log
+
+    def _throttle(self, bucket, kind, n):
+        if bucket.take(n):
+            return
+        if self.log is not None:
+            self.log.info("Rejecting filesystem %s request, rate limit "
+                          "exceeded", kind)
+        for o in self.observers:
+            o.throttle(kind)
+        raise RateLimitExceeded(kind)
+
+    def _call(self, call, path, *args, **kwargs):
+        if self.metadata is not None:
+            self._throttle(self.metadata, 'metadata', 1)
+        return getattr(self.fs, call)(path, *args, **kwargs)
+
+    def open(self, path, mode='rb', *args, **kwargs):
+        if self.data is None:
+            return self.fs.open(path, mode, *args, **kwargs)
+        if 'w' in mode or 'a' in mode:
+            # Before the file is truncated, writes can't be rejected after
+            self._throttle(self.data, 'data', 0)
+        return RateLimitedFile(self.fs.open(path, mode, *args, **kwargs),
+                               self)
+
+    def __getattr__(self, attr):
+        if attr in METADATA_CALLS:
+            return lambda path, *args, **kwargs: self._call(attr, path, *args,
+                                                            **kwargs)
+        return getattr(self.fs, attr)
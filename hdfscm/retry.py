@@ -0,0 +1,87 @@
+"""Retrying of filesystem calls that fail with a transient error.
+
+Only calls that are safe to repeat are retried: metadata reads, ``mkdir``
+(which succeeds if the directory already exists), and opening files for
+reading. Writes, renames, and deletes are never retried, as a failed attempt
+may have partially succeeded.
+"""
+import random
+import time
+
+from .metrics import request_start
+from .utils import is_transient
+
+
+__all__ = ('RetryingFileSystem',)
+
+
+# Filesystem methods that are safe to retry
+IDEMPOTENT_CALLS = frozenset(['info', 'ls', 'exists', 'isdir', 'isfile',
+                              'mkdir'])
+
+
+class RetryingFileSystem(object):
+    """Wraps a filesystem, retrying idempotent calls that fail with a
+    transient error (e.g. a namenode failover).
+
+    Retries back off exponentially with full jitter, sleeping a random time
+    of up to ``base_delay * 2 ** attempt`` seconds (capped at
+    ``max_delay``). No retry is made that would bring the total time slept
+    by the call above ``max_total_delay``, or end more than ``deadline``
+    seconds after the start of the contents operation being served (or of
+    the call itself, outside of an operation), in which case the last error
+    is raised.
+
+    Contents operations run on the notebook server's event loop, so while
+    a call sleeps before retrying no other request is served. Keep
+    ``max_total_delay`` small. Attributes other than the retried calls are
+    forwarded to the wrapped filesystem."""
+    def __init__(self, fs, retries=3, base_delay=0.1, max_delay=2.0,
+                 max_total_delay=1.0, deadline=30, log=None):
+        self.fs = fs
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_total_delay = max_total_delay
+        self.deadline = deadline
+        self.log = log
+
+    def _call(self, call, path, *args, **kwargs):
+        func = getattr(self.fs, call)
+        start = request_start()
+        if start is None:
+            start = time.monotonic()
+        attempt = 0
+        slept = 0
+        while True:
+            try:
+                return func(path, *args, **kwargs)
+            except Exception as exc:
+                if attempt >= self.retries or not is_transient(exc):
+                    raise
+                delay = random.uniform(
+                    0, min(self.max_delay, self.base_delay * 2 ** attempt)
+                )
+                if slept + delay > self.max_total_delay:
+                    raise
+                if (self.deadline and
+                        time.monotonic() + delay - start > self.deadline):
+                    raise
+                attempt += 1
+                slept += delay
+                if self.log is not None:
+                    self.log.debug("Retrying %s of %s in %.3f s (attempt "
+                                   "%d of %d): %s", call, path, delay,
+                                   attempt, self.retries, exc)
+                time.sleep(delay)
+
+    def open(self, path, mode='rb', *args, **kwargs):
+        if mode == 'rb':
+            return self._call('open', path, mode, *args, **kwargs)
+        return self.fs.open(path, mode, *args, **kwargs)
+
+    def __getattr__(self, attr):
+        if attr in IDEMPOTENT_CALLS:
+            return lambda path, *args, **kwargs: self._call(attr, path, *args,
+                                                            **kwargs)
+        return getattr(self.fs, attr)
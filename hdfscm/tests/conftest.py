@@ -1,9 +1,98 @@
 import os
+import tempfile
 import uuid
 import posixpath
 
+import pytest
+
+from hdfscm import HDFSContentsManager
+from hdfscm.fakefs import MemoryFileSystem, LocalFileSystem
+from hdfscm.utils import classify_error
+
 
 def random_root_dir():
     base = os.environ.get('HDFSCM_TESTS_ROOT_DIR', '/user/testuser/')
     suffix = uuid.uuid4().hex
     return posixpath.join(base, 'hdfscm-tests-%s' % suffix)
+
+
+def filesystem_kind():
+    """The kind of filesystem to run tests against.
+
+    Set by the ``HDFSCM_TESTS_FILESYSTEM`` environment variable, one of
+    ``memory`` (default), ``local``, or ``hdfs``."""
+    return os.environ.get('HDFSCM_TESTS_FILESYSTEM', 'memory')
+
+
+def make_filesystem():
+    """The filesystem to run tests against, or None to connect to HDFS."""
+    kind = filesystem_kind()
+    if kind == 'memory':
+        return MemoryFileSystem()
+    elif kind == 'local':
+        return LocalFileSystem(tempfile.mkdtemp(prefix='hdfscm-tests-'))
+    elif kind == 'hdfs':
+        return None
+    raise ValueError("Unknown HDFSCM_TESTS_FILESYSTEM %r" % kind)
+
+
+def make_contents_manager(**kwargs):
+    if 'fs' not in kwargs:
+        fs = make_filesystem()
+        if fs is not None:
+            kwargs['fs'] = fs
+    return HDFSContentsManager(**kwargs)
+
+
+@pytest.fixture
+def contents_manager():
+    """A factory for contents managers, taking the same arguments as
+    ``make_contents_manager``.
+
+    Each is rooted in a new random directory (unless ``root_dir`` is given),
+    which is deleted at the end of the test."""
+    managers = []
+
+    def make(**kwargs):
+        kwargs.setdefault('root_dir', random_root_dir())
+        cm = make_contents_manager(**kwargs)
+        managers.append(cm)
+        return cm
+
+    yield make
+
+    for cm in managers:
+        try:
+            cm.fs.delete(cm.root_dir, recursive=True)
+        except OSError as exc:
+            # Already deleted, e.g. by another manager sharing the root
+            if classify_error(exc) != 404:
+                raise
+        cm.fs.close()
+
+
+@pytest.fixture
+def cm(contents_manager):
+    """A contents manager with the default configuration"""
+    return contents_manager()
+
+
+class FlakyFileSystem(object):
+    """Fails the first ``failures`` calls to each method with ``error``"""
+    def __init__(self, fs, failures, error):
+        self.fs = fs
+        self.failures = failures
+        self.error = error
+        self.attempts = {}
+
+    def __getattr__(self, attr):
+        func = getattr(self.fs, attr)
+        if attr not in ('info', 'ls', 'isfile', 'open', 'rename'):
+            return func
+
+        def inner(*args, **kwargs):
+            n = self.attempts[attr] = self.attempts.get(attr, 0) + 1
+            if n <= self.failures:
+                raise self.error
+            return func(*args, **kwargs)
+        return inner
@@ -0,0 +1,189 @@
+import threading
+
+import pytest
+from pyarrow import ArrowIOError
+from tornado.web import HTTPError
+
+from hdfscm import HDFSContentsManager
+from hdfscm.breaker import CircuitBreakerFileSystem, CircuitOpenError
+from hdfscm.fakefs import MemoryFileSystem
+
+from .conftest import random_root_dir, make_filesystem, FlakyFileSystem
+
+
+STANDBY = ("org.apache.hadoop.ipc.StandbyException: Operation category "
+           "READ is not supported in state standby")
+
+
+def test_opens_after_failures_and_serves_stale():
+    fs = MemoryFileSystem()
+    fs.mkdir('/a')
+    flaky = FlakyFileSystem(fs, 0, ArrowIOError(STANDBY))
+    breaker = CircuitBreakerFileSystem(flaky, failure_threshold=2,
+                                       reset_timeout=60)
+    listing = breaker.ls('/', True)
+
+    flaky.failures = 100
+    for _ in range(2):
+        with pytest.raises(ArrowIOError):
+            breaker.info('/a')
+    assert breaker.state == 'open'
+
+    # Fails fast without calling the namenode, serving cached results
+    attempts = dict(flaky.attempts)
+    assert breaker.ls('/', True) == listing
+    with pytest.raises(CircuitOpenError):
+        breaker.info('/a')
+    with pytest.raises(CircuitOpenError):
+        breaker.ls('/')
+    assert flaky.attempts == attempts
+
+
+def test_probes_for_recovery():
+    flaky = FlakyFileSystem(MemoryFileSystem(), 2, ArrowIOError(STANDBY))
+    breaker = CircuitBreakerFileSystem(flaky, failure_threshold=1,
+                                       reset_timeout=0)
+    with pytest.raises(ArrowIOError):
+        breaker.isfile('/')
+    assert breaker.state == 'open'
+
+    # A failed probe reopens the circuit
+    with pytest.raises(ArrowIOError):
+        breaker.isfile('/')
+    assert breaker.state == 'open'
+
+    # A successful probe closes it
+    assert breaker.isfile('/') is False
+    assert breaker.state == 'closed'
+
+
+def test_permanent_errors_dont_open():
+    breaker = CircuitBreakerFileSystem(MemoryFileSystem(),
+                                       failure_threshold=1)
+    for _ in range(3):
+        with pytest.raises(ArrowIOError):
+            breaker.info('/missing')
+    assert breaker.state == 'closed'
+
+
+def test_modified_paths_not_served_stale():
+    fs = MemoryFileSystem()
+    breaker = CircuitBreakerFileSystem(fs, failure_threshold=1,
+                                       reset_timeout=60)
+    breaker.ls('/')
+    breaker.mkdir('/a')
+    breaker.state = 'open'
+    breaker._opened_at = float('inf')
+    with pytest.raises(CircuitOpenError):
+        breaker.ls('/')
+
+
+def open_circuit(breaker):
+    breaker.state = 'open'
+    breaker._opened_at = float('inf')
+
+
+def test_modified_descendants_not_served_stale():
+    fs = MemoryFileSystem()
+    fs.mkdir('/a/b')
+    fs.mkdir('/ab')
+    breaker = CircuitBreakerFileSystem(fs)
+    breaker.ls('/a/b')
+    breaker.info('/a/b')
+    breaker.info('/ab')
+    breaker.delete('/a', recursive=True)
+    open_circuit(breaker)
+    for call in [breaker.ls, breaker.info]:
+        with pytest.raises(CircuitOpenError):
+            call('/a/b')
+    # Not beneath the deleted path
+    breaker.info('/ab')
+
+
+def test_stale_cache_bounded():
+    fs = MemoryFileSystem()
+    for name in 'abcde':
+        fs.mkdir('/%s/x' % name)
+    breaker = CircuitBreakerFileSystem(fs, stale_cache_size=5)
+    # Each listing counts as two entries
+    for name in 'abc':
+        breaker.ls('/' + name)
+    breaker.ls('/b')
+    # Too large to cache
+    breaker.ls('/')
+    assert breaker._stale_size == 4
+    open_circuit(breaker)
+    assert breaker.ls('/b') == ['/b/x']
+    assert breaker.ls('/c') == ['/c/x']
+    for path in ['/a', '/']:
+        with pytest.raises(CircuitOpenError):
+            breaker.ls(path)
+
+
+def test_adaptive_concurrency_limit():
+    flaky = FlakyFileSystem(MemoryFileSystem(), 1, ArrowIOError(STANDBY))
+    breaker = CircuitBreakerFileSystem(flaky, failure_threshold=0,
+                                       max_concurrency=4)
+    with pytest.raises(ArrowIOError):
+        breaker.ls('/')
+    assert breaker.limit == 2
+    breaker.ls('/')
+    assert breaker.limit == 2.5
+
+
+def test_concurrency_limit_rejects_when_full():
+    class BlockingFileSystem(object):
+        def __init__(self):
+            self.started = threading.Event()
+            self.release = threading.Event()
+
+        def ls(self, path):
+            self.started.set()
+            self.release.wait()
+            return []
+
+    fs = BlockingFileSystem()
+    breaker = CircuitBreakerFileSystem(fs, max_concurrency=1,
+                                       acquire_timeout=0.01)
+    thread = threading.Thread(target=breaker.ls, args=('/a',))
+    thread.start()
+    try:
+        fs.started.wait()
+        with pytest.raises(CircuitOpenError):
+            breaker.ls('/b')
+    finally:
+        fs.release.set()
+        thread.join()
+    assert breaker.ls('/b') == []
+
+
+def test_contents_manager_breaker_opt_in():
+    cm = HDFSContentsManager(root_dir=random_root_dir(),
+                             fs=MemoryFileSystem())
+    assert not isinstance(cm.fs, CircuitBreakerFileSystem)
+
+
+def test_contents_manager_sheds_load():
+    fs = make_filesystem()
+    if fs is None:
+        pytest.skip("Can't inject failures into HDFS")
+    root_dir = random_root_dir()
+    cm = HDFSContentsManager(root_dir=root_dir, fs=fs, fs_retries=0,
+                             circuit_breaker_failures=1,
+                             circuit_breaker_reset_timeout=60,
+                             circuit_breaker_stale_cache_size=100)
+    assert isinstance(cm.fs, CircuitBreakerFileSystem)
+    cm.new(path='foo.ipynb')
+    listing = cm.get('')
+
+    cm.fs.fs = FlakyFileSystem(fs, 100, ArrowIOError(STANDBY))
+    for _ in range(2):
+        with pytest.raises(HTTPError) as info:
+            cm.get('foo.ipynb')
+        assert info.value.status_code == 503
+    assert cm.fs.state == 'open'
+
+    # The directory listing is served from the last successful call
+    assert cm.get('') == listing
+
+    fs.delete(root_dir, recursive=True)
@@ -0,0 +1,191 @@
+import os
+import threading
+
+import pytest
+from pyarrow import ArrowIOError
+from tornado.web import HTTPError
+from traitlets.config import Config
+
+from hdfscm.fakefs import MemoryFileSystem
+
+
+class CheckpointFileSystem(object):
+    """Wraps a filesystem, recording writes of checkpoint files.
+
+    Checkpoint writes block while ``gate`` is cleared, and fail while
+    ``fail`` is set."""
+    def __init__(self, fs):
+        self.fs = fs
+        self.writes = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.waiting = threading.Event()
+        self.fail = False
+
+    def open(self, path, mode='rb', **kwargs):
+        if mode == 'wb' and '.ipynb_checkpoints' in path:
+            self.waiting.set()
+            self.gate.wait()
+            self.waiting.clear()
+            if self.fail:
+                raise ArrowIOError("HDFS file write failed, errno: 122 "
+                                   "(Disk quota exceeded)")
+            self.writes.append((path, kwargs))
+        return self.fs.open(path, mode, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.fs, attr)
+
+
+@pytest.fixture
+def fs():
+    return CheckpointFileSystem(MemoryFileSystem())
+
+
+@pytest.fixture
+def cm(contents_manager, fs):
+    config = Config()
+    config.HDFSCheckpoints.background_checkpoints = True
+    return contents_manager(fs=fs, config=config)
+
+
+def assert_status(status, func, *args):
+    with pytest.raises(HTTPError) as info:
+        func(*args)
+    assert info.value.status_code == status
+
+
+def test_background_checkpoints_coalesce(cm, fs):
+    cm.new(path='a.ipynb')
+    fs.gate.clear()
+    cm.create_checkpoint('a.ipynb')
+    assert fs.waiting.wait(5)
+    # While one checkpoint is running, only the latest request is kept
+    cm.create_checkpoint('a.ipynb')
+    cm.create_checkpoint('a.ipynb')
+    fs.gate.set()
+    cm.checkpoints.flush()
+    assert len(fs.writes) == 2
+    assert len(cm.list_checkpoints('a.ipynb')) == 1
+
+
+@pytest.mark.parametrize('operation', ['rename', 'delete'])
+def test_background_checkpoints_flushed(cm, fs, operation):
+    cm.new(path='a.ipynb')
+    fs.gate.clear()
+    cm.create_checkpoint('a.ipynb')
+    assert fs.waiting.wait(5)
+
+    if operation == 'rename':
+        thread = threading.Thread(target=cm.rename,
+                                  args=('a.ipynb', 'b.ipynb'))
+    else:
+        thread = threading.Thread(target=cm.delete, args=('a.ipynb',))
+    thread.start()
+    # Waits for the pending checkpoint first
+    thread.join(0.1)
+    assert thread.is_alive()
+    fs.gate.set()
+    thread.join()
+
+    assert cm.list_checkpoints('a.ipynb') == []
+    if operation == 'rename':
+        assert len(cm.list_checkpoints('b.ipynb')) == 1
+    else:
+        assert not cm.file_exists('a.ipynb')
+
+
+def test_background_checkpoints_flushed_on_save(cm, fs):
+    model = {'type': 'file', 'format': 'text', 'content': 'x' * 100}
+    cm.save(model, 'a.txt')
+    fs.gate.clear()
+    cm.create_checkpoint('a.txt')
+    assert fs.waiting.wait(5)
+
+    thread = threading.Thread(target=cm.save,
+                              args=(dict(model, content='y'), 'a.txt'))
+    thread.start()
+    try:
+        # Waits for the pending checkpoint first
+        thread.join(0.1)
+        assert thread.is_alive()
+    finally:
+        fs.gate.set()
+        thread.join()
+
+    cm.restore_checkpoint('checkpoint', 'a.txt')
+    assert cm.get('a.txt')['content'] == 'x' * 100
+
+
+def test_background_checkpoint_failures(cm, fs):
+    cm.new(path='a.ipynb')
+    fs.fail = True
+    cm.create_checkpoint('a.ipynb')
+    # The failure is raised by the next request for the file's checkpoints
+    assert_status(500, cm.list_checkpoints, 'a.ipynb')
+    assert cm.list_checkpoints('a.ipynb') == []
+
+    cm.create_checkpoint('a.ipynb')
+    cm.checkpoints.flush()
+    fs.fail = False
+    # Including a new checkpoint, which is still made
+    assert_status(500, cm.create_checkpoint, 'a.ipynb')
+    assert len(cm.list_checkpoints('a.ipynb')) == 1
+
+    # Failures of deleted files are dropped
+    fs.fail = True
+    cm.create_checkpoint('a.ipynb')
+    cm.delete('a.ipynb')
+    fs.fail = False
+    cm.new(path='a.ipynb')
+    assert cm.list_checkpoints('a.ipynb') == []
+
+
+def test_checkpoint_write_options(contents_manager, fs):
+    config = Config()
+    config.HDFSCheckpoints.checkpoint_replication = 2
+    config.HDFSCheckpoints.checkpoint_block_size = 2 ** 20
+    cm = contents_manager(fs=fs, config=config)
+    cm.new(path='a.ipynb')
+    cm.create_checkpoint('a.ipynb')
+    (path, kwargs), = fs.writes
+    assert kwargs == {'replication': 2, 'default_block_size': 2 ** 20}
+
+    # Regular saves use the cluster defaults
+    fs.writes.clear()
+    cm.save(cm.get('a.ipynb'), 'a.ipynb')
+    assert fs.writes == []
+
+
+def fake_hdfs_command(tmpdir, status):
+    """A stand-in ``hdfs`` command recording its arguments, and exiting with
+    ``status``"""
+    log = tmpdir.join('calls')
+    command = tmpdir.join('hdfs')
+    command.write('#!/bin/sh\necho "$@" >> %s\nexit %d\n' % (log, status))
+    os.chmod(str(command), 0o755)
+    return str(command), log
+
+
+@pytest.mark.parametrize('status', [0, 1])
+def test_checkpoint_storage_policy(contents_manager, tmpdir, status):
+    command, log = fake_hdfs_command(tmpdir, status)
+    config = Config()
+    config.HDFSCheckpoints.checkpoint_storage_policy = 'COLD'
+    config.HDFSCheckpoints.hdfs_command = command
+    cm = contents_manager(config=config)
+    for path in ['a.ipynb', 'b.ipynb', 'a.ipynb']:
+        if not cm.file_exists(path):
+            cm.new(path=path)
+        cm.create_checkpoint(path)
+        cm.checkpoints._policy_queue.flush()
+
+    cp_dir = '%s/.ipynb_checkpoints' % cm.root_dir
+    call = 'storagepolicies -setStoragePolicy -path %s -policy COLD' % cp_dir
+    calls = log.read().splitlines()
+    if status == 0:
+        # Only set once per directory
+        assert calls == [call]
+    else:
+        # Failures are retried the next time the directory is used
+        assert calls == [call] * 3
@@ -0,0 +1,125 @@
+import time
+
+import pytest
+from pyarrow import ArrowIOError
+from tornado.web import HTTPError
+
+
+def text_model(content, **kwargs):
+    model = {'type': 'file', 'format': 'text', 'content': content}
+    model.update(kwargs)
+    return model
+
+
+def assert_conflict(cm, model, path):
+    with pytest.raises(HTTPError) as info:
+        cm.save(model, path)
+    assert info.value.status_code == 409
+
+
+def test_save_expected_last_modified(cm):
+    first = cm.save(text_model('a'), 'a.txt')
+    time.sleep(0.01)
+    second = cm.save(
+        text_model('b', expected_last_modified=first['last_modified']),
+        'a.txt'
+    )
+    assert cm.get('a.txt')['content'] == 'b'
+
+    # Based on the first version, which has since been replaced
+    assert_conflict(
+        cm, text_model('c', expected_last_modified=first['last_modified']),
+        'a.txt'
+    )
+    assert cm.get('a.txt')['content'] == 'b'
+
+    # Serialized timestamps are accepted
+    cm.save(text_model('d', expected_last_modified=(
+        second['last_modified'].isoformat()
+    )), 'a.txt')
+    assert cm.get('a.txt')['content'] == 'd'
+
+    with pytest.raises(HTTPError) as info:
+        cm.save(text_model('e', expected_last_modified='now'), 'a.txt')
+    assert info.value.status_code == 400
+
+
+def test_save_expected_hash(cm):
+    cm.new(path='a.ipynb')
+    model = cm.get('a.ipynb', require_hash=True)
+    assert model['hash_algorithm'] == 'sha256'
+    assert cm.get('a.ipynb', content=False, require_hash=True)['hash'] == \
+        model['hash']
+
+    model['content'].cells.append({'cell_type': 'markdown', 'source': 'x',
+                                   'metadata': {}})
+    model['expected_hash'] = model['hash']
+    saved = cm.save(model, 'a.ipynb')
+    assert saved['hash'] != model['hash']
+    assert len(cm.get('a.ipynb')['content']['cells']) == 1
+
+    # The version saved against has since been replaced
+    assert_conflict(cm, model, 'a.ipynb')
+    model['expected_hash'] = saved['hash']
+    cm.save(model, 'a.ipynb')
+
+
+def test_save_precondition_deleted(cm):
+    model = cm.save(text_model('a'), 'a.txt')
+    cm.delete_file('a.txt')
+    assert_conflict(cm, text_model(
+        'b', expected_last_modified=model['last_modified']
+    ), 'a.txt')
+    assert not cm.file_exists('a.txt')
+
+
+def test_conditional_save_is_atomic(cm):
+    model = cm.save(text_model('a'), 'a.txt')
+    cm.save(text_model('b', expected_last_modified=model['last_modified']),
+            'a.txt')
+    # No temporary files are left behind
+    assert [m['name'] for m in cm.get('')['content']] == ['a.txt']
+    names = [p.rsplit('/', 1)[-1] for p in cm.fs.ls(cm.root_dir)]
+    assert names == ['a.txt']
+
+
+def fail_renames(monkeypatch, cm, fail):
+    """Make renames of the contents manager's filesystem for which
+    ``fail(src, dst)`` is true raise an error"""
+    rename = cm.fs.rename
+
+    def failing_rename(src, dst):
+        if fail(src, dst):
+            raise ArrowIOError("HDFS rename failed, errno: 13 "
+                               "(Permission denied)")
+        return rename(src, dst)
+    monkeypatch.setattr(cm.fs, 'rename', failing_rename)
+
+
+def test_conditional_save_restores_backup(cm, monkeypatch):
+    model = cm.save(text_model('a'), 'a.txt')
+    fail_renames(monkeypatch, cm, lambda src, dst: src.endswith('.tmp'))
+    with pytest.raises(HTTPError):
+        cm.save(text_model(
+            'b', expected_last_modified=model['last_modified']
+        ), 'a.txt')
+    monkeypatch.undo()
+    assert cm.get('a.txt')['content'] == 'a'
+    names = [p.rsplit('/', 1)[-1] for p in cm.fs.ls(cm.root_dir)]
+    assert names == ['a.txt']
+
+
+def test_conditional_save_keeps_both_versions(cm, monkeypatch):
+    model = cm.save(text_model('a'), 'a.txt')
+    fail_renames(monkeypatch, cm, lambda src, dst: dst.endswith('a.txt'))
+    with pytest.raises(HTTPError):
+        cm.save(text_model(
+            'b', expected_last_modified=model['last_modified']
+        ), 'a.txt')
+    monkeypatch.undo()
+    # Neither version could be moved back in place, neither is deleted
+    contents = {}
+    for path in cm.fs.ls(cm.root_dir):
+        with cm.fs.open(path, 'rb') as f:
+            contents[path.rsplit('.', 1)[-1]] = f.read()
+    assert contents == {'tmp': b'b', 'bak': b'a'}
@@ -0,0 +1,131 @@
+import time
+
+import pytest
+from pyarrow import ArrowIOError
+
+from hdfscm.connection import (ReconnectingFileSystem, ReadRoutingFileSystem,
+                               parse_host)
+from hdfscm.fakefs import MemoryFileSystem
+
+
+STANDBY = ("org.apache.hadoop.ipc.StandbyException: Operation category "
+           "READ is not supported in state standby")
+
+
+class Cluster(object):
+    """Namenodes sharing a filesystem, any of which may be marked down"""
+    def __init__(self):
+        self.fs = MemoryFileSystem()
+        self.down = set()
+
+    def connect(self, host, port):
+        return Connection(self, host)
+
+
+class Connection(object):
+    def __init__(self, cluster, host):
+        self.cluster = cluster
+        self.host = host
+        self.closed = False
+
+    def __getattr__(self, attr):
+        func = getattr(self.cluster.fs, attr)
+
+        def inner(*args, **kwargs):
+            if self.host in self.cluster.down:
+                raise ArrowIOError(STANDBY)
+            return func(*args, **kwargs)
+        return inner
+
+    def close(self):
+        self.closed = True
+
+
+def test_parse_host():
+    assert parse_host('nn1') == ('nn1', 0)
+    assert parse_host('nn1:8020') == ('nn1', 8020)
+    assert parse_host('nn1', default_port=9000) == ('nn1', 9000)
+
+
+def test_fails_over_between_hosts():
+    cluster = Cluster()
+    cluster.down.add('nn1')
+    fs = ReconnectingFileSystem(cluster.connect, [('nn1', 0), ('nn2', 0)],
+                                health_check_interval=0)
+    # A standby namenode is skipped over
+    assert fs.host == ('nn2', 0)
+    fs.mkdir('/a')
+
+    # A connection error triggers a reconnect, the failed call still raises
+    cluster.down = {'nn2'}
+    old = fs._fs
+    with pytest.raises(ArrowIOError):
+        fs.isdir('/a')
+    assert old.closed
+    assert fs.host == ('nn1', 0)
+    assert fs.isdir('/a')
+
+    # Permanent errors don't
+    with pytest.raises(ArrowIOError):
+        fs.info('/missing')
+    assert fs.host == ('nn1', 0)
+    fs.close()
+
+
+def test_reconnects_after_total_outage():
+    cluster = Cluster()
+    fs = ReconnectingFileSystem(cluster.connect, [('nn1', 0)],
+                                health_check_interval=0)
+    cluster.down.add('nn1')
+    with pytest.raises(ArrowIOError):
+        fs.ls('/')
+    with pytest.raises(ConnectionError):
+        fs.ls('/')
+    cluster.down.clear()
+    assert fs.ls('/') == []
+    fs.close()
+
+
+def test_health_checks():
+    cluster = Cluster()
+    fs = ReconnectingFileSystem(cluster.connect, [('nn1', 0), ('nn2', 0)],
+                                health_check_interval=0.01)
+    try:
+        assert fs.host == ('nn1', 0)
+        cluster.down.add('nn1')
+        deadline = time.time() + 5
+        while fs.host != ('nn2', 0) and time.time() < deadline:
+            time.sleep(0.01)
+        assert fs.host == ('nn2', 0)
+    finally:
+        fs.close()
+
+
+def test_read_routing():
+    cluster = Cluster()
+    fs = ReadRoutingFileSystem(cluster.connect('active', 0),
+                               cluster.connect('observer', 0),
+                               consistency_window=60)
+    fs.mkdir('/a/b')
+
+    # With the active namenode down, reads are served by the observer
+    cluster.down = {'active'}
+    assert not fs.isdir('/c')
+    assert len(fs.ls('/')) == 1
+    # Except reads of recently written paths, paths below them, or listings
+    # of their parent directory
+    for call, path in [('isdir', '/a/b'), ('exists', '/a/b/c'),
+                       ('ls', '/a')]:
+        with pytest.raises(ArrowIOError):
+            getattr(fs, call)(path)
+    with pytest.raises(ArrowIOError):
+        fs.mkdir('/d')
+
+    # Failed reads on the observer fall back to the active namenode
+    cluster.down = {'observer'}
+    assert not fs.isdir('/c')
+
+    # Once the window has passed, reads go to the observer again
+    fs.consistency_window = 0
+    cluster.down = {'active'}
+    assert fs.isdir('/a/b')
@@ -0,0 +1,175 @@
+import copy
+
+import nbformat
+import pytest
+from nbformat import NotebookNode, from_dict
+from nbformat.v4 import (new_code_cell, new_markdown_cell, new_notebook,
+                         new_output)
+from tornado.web import HTTPError
+
+from hdfscm.delta import NotebookCache, PatchConflict, apply_patch
+
+
+def test_apply_patch():
+    doc = {'cells': [{'source': 'a', 'metadata': {}},
+                     {'source': 'b', 'metadata': {}}],
+           'metadata': {'kernelspec': {'name': 'python3'}}}
+    orig = copy.deepcopy(doc)
+    out = apply_patch(doc, [
+        {'op': 'replace', 'path': '/cells/1/source', 'value': 'B'},
+        {'op': 'add', 'path': '/cells/-', 'value': {'source': 'c'}},
+        {'op': 'add', 'path': '/cells/1/metadata/a~1b', 'value': 1},
+        {'op': 'move', 'from': '/cells/0', 'path': '/cells/2'},
+        {'op': 'test', 'path': '/metadata/kernelspec/name',
+         'value': 'python3'},
+        {'op': 'copy', 'from': '/metadata', 'path': '/extra'},
+        {'op': 'remove', 'path': '/extra/kernelspec'},
+    ])
+    assert out == {'cells': [{'source': 'B', 'metadata': {'a/b': 1}},
+                             {'source': 'c'},
+                             {'source': 'a', 'metadata': {}}],
+                   'metadata': {'kernelspec': {'name': 'python3'}},
+                   'extra': {}}
+    # The original is unchanged, and shares the unmodified parts
+    assert doc == orig
+    assert out['metadata'] is doc['metadata']
+    assert out['cells'][2] is doc['cells'][0]
+
+
+def test_apply_patch_convert():
+    doc = from_dict({'cells': [{'source': 'a'}], 'metadata': {}})
+    out = apply_patch(doc, [
+        {'op': 'add', 'path': '/cells/-', 'value': {'source': 'b'}},
+        {'op': 'copy', 'from': '/cells/0', 'path': '/cells/-'},
+    ], convert=from_dict)
+    assert all(type(c) is NotebookNode for c in out.cells)
+    assert type(out) is NotebookNode
+    assert out.metadata is doc.metadata
+
+
+@pytest.mark.parametrize('patch', [
+    {},
+    [{'op': 'remove', 'path': '/cells/5'}],
+    [{'op': 'remove', 'path': '/cells/01'}],
+    [{'op': 'remove', 'path': '/missing'}],
+    [{'op': 'replace', 'path': '', 'value': {}}],
+    [{'op': 'add', 'path': '/cells/0/source/x', 'value': 1}],
+    [{'op': 'add', 'path': '/cells/0'}],
+    [{'op': 'frobnicate', 'path': '/cells'}],
+])
+def test_apply_patch_invalid(patch):
+    doc = {'cells': [{'source': 'a'}]}
+    with pytest.raises(ValueError):
+        apply_patch(doc, patch)
+    assert doc == {'cells': [{'source': 'a'}]}
+
+
+def test_apply_patch_conflict():
+    with pytest.raises(PatchConflict):
+        apply_patch({'a': 1}, [{'op': 'test', 'path': '/a', 'value': 2}])
+
+
+def test_notebook_cache():
+    cache = NotebookCache(2)
+    cache.put('/a/x', 1, 10, 'h1', 'x')
+    cache.put('/a/y', 1, 10, 'h2', 'y')
+    assert cache.get('/a/x', 1, 10, 'h1') == 'x'
+    # Modified, or a different version
+    assert cache.get('/a/x', 2, 10, 'h1') is None
+    assert cache.get('/a/x', 1, 10, 'h2') is None
+    # Least recently used first
+    cache.put('/b', 1, 10, 'h3', 'b')
+    assert cache.get('/a/y', 1, 10, 'h2') is None
+    assert cache.get('/a/x', 1, 10, 'h1') == 'x'
+    cache.discard('/a')
+    assert len(cache) == 1
+
+
+@pytest.fixture
+def cm(contents_manager):
+    return contents_manager(notebook_cache_size=4)
+
+
+def patch_model(base_hash, *ops):
+    return {'type': 'notebook', 'format': 'json-patch',
+            'base_hash': base_hash, 'content': list(ops)}
+
+
+def assert_status(status, cm, model):
+    with pytest.raises(HTTPError) as info:
+        cm.save(model, 'a.ipynb')
+    assert info.value.status_code == status
+
+
+def test_delta_save(cm):
+    cm.new(path='a.ipynb')
+    base = cm.get('a.ipynb', content=False, require_hash=True)['hash']
+    saved = cm.save(patch_model(base, {
+        'op': 'add', 'path': '/cells/-', 'value': new_markdown_cell('x')
+    }), 'a.ipynb')
+    assert saved['type'] == 'notebook'
+    assert saved['content'] is None
+    model = cm.get('a.ipynb', require_hash=True)
+    assert saved['hash'] == model['hash']
+    assert [c['source'] for c in model['content']['cells']] == ['x']
+
+    # The next patch is applied to the cached notebook
+    hits = cm._notebooks.hits
+    saved = cm.save(patch_model(saved['hash'], {
+        'op': 'replace', 'path': '/cells/0/source', 'value': 'y'
+    }), 'a.ipynb')
+    assert cm._notebooks.hits == hits + 1
+    cells = cm.get('a.ipynb')['content']['cells']
+    assert [c['source'] for c in cells] == ['y']
+
+    # Patches against a replaced version conflict
+    op = {'op': 'remove', 'path': '/cells/0'}
+    assert_status(409, cm, patch_model(base, op))
+    assert_status(409, cm, patch_model(saved['hash'], {
+        'op': 'test', 'path': '/cells/0/source', 'value': 'x'
+    }))
+    assert_status(400, cm, patch_model(saved['hash'], {
+        'op': 'remove', 'path': '/cells/1'
+    }))
+    assert_status(400, cm, patch_model(None, op))
+    assert len(cm.get('a.ipynb')['content']['cells']) == 1
+
+    # Full saves replace the cached notebook
+    model = cm.get('a.ipynb')
+    cm.save(model, 'a.ipynb')
+    assert len(cm._notebooks) == 0
+
+
+def test_delta_save_rest(cm):
+    # Over REST, a conditional full save gets the first hash to patch
+    cm.new(path='a.ipynb')
+    model = cm.get('a.ipynb')
+    model['expected_last_modified'] = model['last_modified']
+    saved = cm.save(model, 'a.ipynb')
+    cm.save(patch_model(saved['hash'], {
+        'op': 'add', 'path': '/cells/-', 'value': new_markdown_cell('x')
+    }), 'a.ipynb')
+    cells = cm.get('a.ipynb')['content']['cells']
+    assert [c['source'] for c in cells] == ['x']
+
+
+def test_delta_save_keeps_trust(cm):
+    cell = new_code_cell('plot()', outputs=[
+        new_output('display_data', data={'text/html': '<b>x</b>'})
+    ], metadata={'trusted': True})
+    cm.save({'type': 'notebook', 'content': new_notebook(cells=[cell])},
+            'a.ipynb')
+    model = cm.get('a.ipynb', require_hash=True)
+    assert model['content']['cells'][0]['metadata']['trusted']
+
+    nb_hash = model['hash']
+    for source in ['a()', 'b()']:
+        nb_hash = cm.save(patch_model(nb_hash, {
+            'op': 'replace', 'path': '/cells/0/source', 'value': source
+        }), 'a.ipynb')['hash']
+        nb = cm.get('a.ipynb')['content']
+        assert nb.cells[0].source == source
+        assert nb.cells[0].metadata.trusted
+        with cm.fs.open(cm._paths.to_fs_path('a.ipynb'), 'rb') as f:
+            nb = nbformat.reads(f.read().decode('utf8'), as_version=4)
+        assert cm.notary.check_signature(nb)
@@ -0,0 +1,83 @@
+import os
+import time
+
+from hdfscm.diskcache import DiskCache
+from hdfscm.prefetch import ContentCache
+
+
+def test_disk_cache(tmpdir):
+    directory = str(tmpdir.join('cache'))
+    cache = DiskCache(directory, 10)
+    cache.put('/a/x', 1, 4, b'xxxx')
+    cache.put('/a/y', 1, 4, b'yyyy')
+    assert cache.get('/a/x', 1, 4) == b'xxxx'
+    # Least recently used entries are evicted first
+    cache.put('/b', 1, 4, b'bbbb')
+    assert not cache.contains('/a/y', 1, 4)
+    assert cache.nbytes == 8
+    # Too large to cache
+    cache.put('/c', 1, 11, b'c' * 11)
+    assert cache.nbytes == 8
+    assert oct(os.stat(directory).st_mode & 0o777) == oct(0o700)
+    cache.close()
+
+    # Entries persist, and are revalidated on use
+    cache = DiskCache(directory, 10)
+    assert cache.get('/a/x', 1, 4) == b'xxxx'
+    assert cache.get('/b', 2, 4) is None
+    assert not cache.contains('/b', 1, 4)
+    assert cache.stats()['entries'] == 1
+
+    cache.put('/a/y', 1, 4, b'yyyy')
+    cache.discard('/a')
+    assert cache.stats()['entries'] == 0
+    # Recently modified files aren't cached
+    cache.put('/d', time.time(), 4, b'dddd')
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+    cache.close()
+
+
+def test_disk_cache_corrupted_blob(tmpdir):
+    cache = DiskCache(str(tmpdir), 10)
+    cache.put('/a', 1, 4, b'aaaa')
+    with open(cache._blob_path('/a'), 'wb') as f:
+        f.write(b'aa')
+    assert cache.get('/a', 1, 4) is None
+    assert not cache.contains('/a', 1, 4)
+    cache.close()
+
+
+def test_memory_cache_backed_by_disk(tmpdir):
+    disk = DiskCache(str(tmpdir), 10)
+    cache = ContentCache(10, backing=disk)
+    cache.put('/a', 1, 4, b'aaaa')
+    assert disk.contains('/a', 1, 4)
+
+    cache = ContentCache(10, backing=disk)
+    assert cache.contains('/a', 1, 4)
+    assert cache.get('/a', 1, 4) == b'aaaa'
+    assert cache.get('/a', 1, 4) == b'aaaa'
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert (disk.hits, disk.misses) == (1, 0)
+    cache.discard('/a')
+    assert not disk.contains('/a', 1, 4)
+    disk.close()
+
+
+def test_contents_manager_disk_cache(tmpdir, contents_manager):
+    disk_cache_dir = str(tmpdir.join('{username}'))
+    cm = contents_manager(disk_cache_dir=disk_cache_dir)
+    cm.new(path='a.ipynb')
+    cm.get('a.ipynb')
+    # Just written, so not cached yet
+    assert cm._content_cache.stats()['entries'] == 0
+
+    cm._content_cache.min_age = 0
+    cm.get('a.ipynb')
+    # A restarted server starts with a warm cache
+    cm2 = contents_manager(root_dir=cm.root_dir, fs=cm.fs,
+                           disk_cache_dir=disk_cache_dir)
+    assert cm2.get('a.ipynb')['content']['cells'] == []
+    assert cm2._content_cache.hits == 1
@@ -0,0 +1,96 @@
+import time
+
+import pytest
+from pyarrow import ArrowIOError
+
+from hdfscm.fakefs import MemoryFileSystem, LocalFileSystem
+
+
+@pytest.fixture(params=['memory', 'local'])
+def fs(request, tmpdir):
+    if request.param == 'memory':
+        return MemoryFileSystem()
+    return LocalFileSystem(str(tmpdir))
+
+
+def test_files_and_directories(fs):
+    fs.mkdir('/a/b')
+    assert fs.isdir('/a') and fs.isdir('/a/b')
+    with fs.open('/a/b/c.txt', 'wb') as f:
+        f.write(b'hello')
+    assert fs.isfile('/a/b/c.txt')
+    assert not fs.isdir('/a/b/c.txt')
+    assert fs.exists('/a/b/c.txt')
+    assert not fs.exists('/a/missing')
+
+    with fs.open('/a/b/c.txt', 'rb') as f:
+        assert f.read() == b'hello'
+
+    info = fs.info('/a/b/c.txt')
+    assert info['kind'] == 'file'
+    assert info['size'] == 5
+    assert fs.info('/a/b')['kind'] == 'directory'
+
+    assert fs.ls('/a/b') == ['/a/b/c.txt']
+    detail, = fs.ls('/a/b', True)
+    assert detail['name'] == '/a/b/c.txt'
+    assert detail['size'] == 5
+    assert detail['last_modified_time'] == info['last_modified']
+
+    with pytest.raises(ArrowIOError):
+        fs.info('/a/missing')
+    with pytest.raises(ArrowIOError):
+        fs.open('/a/missing', 'rb')
+
+
+def test_rename_and_delete(fs):
+    with fs.open('/a/b/c.txt', 'wb') as f:
+        f.write(b'hello')
+    mtime = fs.info('/a/b/c.txt')['last_modified']
+    with fs.open('/a/d.txt', 'wb') as f:
+        f.write(b'other')
+
+    with pytest.raises(ArrowIOError):
+        fs.rename('/a/b/c.txt', '/a/d.txt')
+    with pytest.raises(ArrowIOError):
+        fs.rename('/a/b/c.txt', '/missing/c.txt')
+
+    fs.rename('/a/b', '/a/e')
+    assert not fs.exists('/a/b')
+    assert fs.info('/a/e/c.txt')['last_modified'] == mtime
+
+    with pytest.raises(ArrowIOError):
+        fs.delete('/a/e')
+    fs.delete('/a/e', recursive=True)
+    assert not fs.exists('/a/e/c.txt')
+    fs.delete('/a/d.txt')
+    assert fs.ls('/a') == []
+
+
+def test_upload(fs):
+    with fs.open('/src', 'wb') as f:
+        f.write(b'x' * 100000)
+    with fs.open('/src', 'rb') as src:
+        with fs.open('/dest', 'wb') as dest:
+            dest.upload(src)
+    assert fs.info('/dest')['size'] == 100000
+
+
+def test_counters_and_latency():
+    fs = MemoryFileSystem(latency={'ls': 0.05})
+    fs.mkdir('/a')
+    with fs.open('/a/b', 'wb') as f:
+        f.write(b'abc')
+    with fs.open('/a/b', 'rb') as f:
+        f.read()
+    start = time.time()
+    fs.ls('/a')
+    assert time.time() - start >= 0.05
+
+    assert fs.calls == {'mkdir': 1, 'open': 2, 'ls': 1}
+    assert fs.bytes_written == 3
+    assert fs.bytes_read == 3
+
+    fs.reset_counters()
+    assert not fs.calls
+    assert fs.bytes_read == fs.bytes_written == 0
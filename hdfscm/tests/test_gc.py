@@ -0,0 +1,198 @@
+import io
+import posixpath
+
+import pytest
+from nbformat.v4 import new_code_cell, new_notebook, new_output
+from pyarrow import ArrowIOError
+from traitlets.config import Config
+
+from hdfscm.gc import (CheckpointCollector, OutputBlobCollector,
+                       checkpoint_source_name)
+
+from .conftest import random_root_dir
+
+
+def test_checkpoint_source_name():
+    assert checkpoint_source_name('foo-checkpoint.ipynb') == 'foo.ipynb'
+    assert checkpoint_source_name('a.tar-checkpoint.gz') == 'a.tar.gz'
+    assert checkpoint_source_name('noext-checkpoint') == 'noext'
+    assert checkpoint_source_name('foo.ipynb') is None
+
+
+def test_collect_orphaned_checkpoints(cm):
+    cm.new(model={'type': 'directory'}, path='sub')
+    for path in ['keep.ipynb', 'orphan.ipynb', 'sub/orphan.ipynb']:
+        cm.new(path=path)
+        cm.create_checkpoint(path)
+
+    # Delete sources outside of jupyter, leaving their checkpoints behind
+    for path in ['orphan.ipynb', 'sub/orphan.ipynb']:
+        cm.fs.delete(posixpath.join(cm.root_dir, path))
+
+    out = io.StringIO()
+    collector = CheckpointCollector(cm.fs, cm.root_dir, dry_run=True, out=out)
+    stats = collector.run()
+    assert stats.checkpoints == 3
+    assert stats.orphaned == 2
+    assert stats.deleted == 0
+    assert len(cm.list_checkpoints('orphan.ipynb')) == 1
+
+    collector = CheckpointCollector(cm.fs, cm.root_dir, out=io.StringIO())
+    stats = collector.run()
+    assert stats.orphaned == 2
+    assert stats.deleted == 2
+    assert cm.list_checkpoints('orphan.ipynb') == []
+    assert len(cm.list_checkpoints('keep.ipynb')) == 1
+    # Fully orphaned checkpoint directories are removed entirely
+    assert not cm.fs.exists(
+        posixpath.join(cm.root_dir, 'sub', '.ipynb_checkpoints')
+    )
+
+
+def test_collect_expired_checkpoints(cm):
+    cm.new(path='old.ipynb')
+    cm.create_checkpoint('old.ipynb')
+
+    collector = CheckpointCollector(cm.fs, cm.root_dir, max_age=-1,
+                                    out=io.StringIO())
+    stats = collector.run()
+    assert stats.expired == 1
+    assert cm.list_checkpoints('old.ipynb') == []
+    assert cm.file_exists('old.ipynb')
+
+
+class DenyListing(object):
+    """Wraps a filesystem, failing listings of ``denied`` with a permission
+    error"""
+    def __init__(self, fs, denied):
+        self._fs = fs
+        self._denied = denied
+
+    def ls(self, path, detail=False):
+        if path == self._denied:
+            raise ArrowIOError("HDFS list directory failed, errno: 13 "
+                               "(Permission denied)")
+        return self._fs.ls(path, detail)
+
+    def __getattr__(self, name):
+        return getattr(self._fs, name)
+
+
+@pytest.fixture
+def centralized_cm(contents_manager):
+    root_dir = random_root_dir()
+    config = Config()
+    config.HDFSCheckpoints.checkpoint_dir = posixpath.join(root_dir,
+                                                           '.checkpoints')
+    return contents_manager(root_dir=root_dir, config=config)
+
+
+def test_collect_centralized_checkpoints(centralized_cm):
+    cm = centralized_cm
+    cp_root = cm.checkpoints.checkpoint_dir
+    for directory in ['gone', 'denied']:
+        cm.new(model={'type': 'directory'}, path=directory)
+    for path in ['keep.ipynb', 'orphan.ipynb', 'gone/a.ipynb',
+                 'denied/a.ipynb']:
+        cm.new(path=path)
+        cm.create_checkpoint(path)
+    assert cm.fs.exists(posixpath.join(cp_root, 'gone'))
+
+    cm.fs.delete(posixpath.join(cm.root_dir, 'orphan.ipynb'))
+    cm.fs.delete(posixpath.join(cm.root_dir, 'gone'), recursive=True)
+
+    # Sources that can't be listed aren't treated as deleted
+    denied = posixpath.join(cm.root_dir, 'denied')
+    fs = DenyListing(cm.fs, denied)
+    collector = CheckpointCollector(fs, cm.root_dir, checkpoint_dir=cp_root,
+                                    out=io.StringIO())
+    stats = collector.run()
+    assert stats.orphaned == 2
+    assert stats.errors == 1
+    assert len(cm.list_checkpoints('keep.ipynb')) == 1
+    assert len(cm.list_checkpoints('denied/a.ipynb')) == 1
+    assert cm.list_checkpoints('orphan.ipynb') == []
+    # The checkpoints of a deleted directory are removed entirely
+    assert not cm.fs.exists(posixpath.join(cp_root, 'gone'))
+
+
+@pytest.mark.parametrize('root', ['missing', 'keep.ipynb'])
+def test_collect_invalid_root(centralized_cm, root):
+    cm = centralized_cm
+    cm.new(path='keep.ipynb')
+    cm.create_checkpoint('keep.ipynb')
+
+    cp_root = cm.checkpoints.checkpoint_dir
+    collector = CheckpointCollector(cm.fs, posixpath.join(cm.root_dir, root),
+                                    checkpoint_dir=cp_root, out=io.StringIO())
+    with pytest.raises(ValueError):
+        collector.run()
+    assert collector.stats.deleted == 0
+    assert len(cm.list_checkpoints('keep.ipynb')) == 1
+
+
+def save_outputs(cm, path, *images):
+    cells = [new_code_cell('plot()', outputs=[
+        new_output('display_data', data={'image/png': image})
+    ]) for image in images]
+    cm.save({'type': 'notebook', 'content': new_notebook(cells=cells)}, path)
+
+
+def blob_paths(cm):
+    blob_dir = posixpath.join(cm.root_dir, cm.output_blob_dir)
+    return {p for d in cm.fs.ls(blob_dir) for p in cm.fs.ls(d)}
+
+
+@pytest.mark.parametrize('centralized', [False, True])
+def test_collect_output_blobs(contents_manager, centralized):
+    root_dir = random_root_dir()
+    config = Config()
+    if centralized:
+        config.HDFSCheckpoints.checkpoint_dir = posixpath.join(
+            root_dir, '.checkpoints'
+        )
+    cm = contents_manager(root_dir=root_dir, config=config,
+                          output_blob_threshold=50)
+    cp_dir = cm.checkpoints.checkpoint_dir
+    cm.new(model={'type': 'directory'}, path='sub')
+    save_outputs(cm, 'sub/a.ipynb', 'a' * 100, 'b' * 100)
+    cm.create_checkpoint('sub/a.ipynb')
+    save_outputs(cm, 'sub/a.ipynb', 'a' * 100, 'c' * 100)
+    save_outputs(cm, 'd.ipynb', 'd' * 100)
+    kept = blob_paths(cm)
+    save_outputs(cm, 'e.ipynb', 'e' * 100)
+    cm.fs.delete(posixpath.join(root_dir, 'e.ipynb'))
+    assert len(blob_paths(cm)) == 5
+
+    # Recently written blobs are kept
+    collector = OutputBlobCollector(cm.fs, root_dir, checkpoint_dir=cp_dir,
+                                    out=io.StringIO())
+    stats = collector.run()
+    assert stats.blobs == 5
+    assert stats.deleted == 0
+
+    def collect(fs=cm.fs, **kwargs):
+        collector = OutputBlobCollector(fs, root_dir, checkpoint_dir=cp_dir,
+                                        min_age=-1, out=io.StringIO(),
+                                        **kwargs)
+        return collector.run()
+
+    stats = collect(dry_run=True)
+    assert stats.unreferenced == 1
+    assert len(blob_paths(cm)) == 5
+
+    # Nothing is deleted if some notebooks can't be read
+    stats = collect(fs=DenyListing(cm.fs, posixpath.join(root_dir, 'sub')))
+    assert stats.errors == 1
+    assert len(blob_paths(cm)) == 5
+
+    # Blobs referenced by checkpoints are kept
+    stats = collect()
+    assert stats.unreferenced == 1
+    assert stats.deleted == 1
+    assert blob_paths(cm) == kept
+    cm.restore_checkpoint('checkpoint', 'sub/a.ipynb')
+    cells = cm.get('sub/a.ipynb')['content']['cells']
+    assert [c['outputs'][0]['data']['image/png'] for c in cells] == [
+        'a' * 100, 'b' * 100
+    ]
@@ -1,17 +1,18 @@
 from notebook.services.contents.tests.test_manager import (
     TestContentsManager
 )
+from traitlets.config import Config
 
-from hdfscm import HDFSContentsManager, NoOpCheckpoints
+from hdfscm import NoOpCheckpoints
 
-from .conftest import random_root_dir
+from .conftest import random_root_dir, make_contents_manager
 
 
 class HDFSContentsManagerTestCase(TestContentsManager):
 
     def setUp(self):
         self.root_dir = random_root_dir()
-        self.contents_manager = HDFSContentsManager(root_dir=self.root_dir)
+        self.contents_manager = make_contents_manager(root_dir=self.root_dir)
 
     def tearDown(self):
         self.contents_manager.fs.delete(self.root_dir, recursive=True)
@@ -27,7 +28,7 @@ class HDFSContentsManagerNoOpCheckpointsTestCase(HDFSContentsManagerTestCase):
 
     def setUp(self):
         self.root_dir = random_root_dir()
-        self.contents_manager = HDFSContentsManager(
+        self.contents_manager = make_contents_manager(
             root_dir=self.root_dir,
             checkpoints_class=NoOpCheckpoints
         )
@@ -36,4 +37,40 @@ class HDFSContentsManagerNoOpCheckpointsTestCase(HDFSContentsManagerTestCase):
         self.contents_manager.fs.close()
 
 
+class HDFSContentsManagerCentralizedCheckpointsTestCase(
+        HDFSContentsManagerTestCase):
+
+    def setUp(self):
+        self.root_dir = random_root_dir()
+        self.checkpoint_dir = random_root_dir()
+        config = Config()
+        config.HDFSCheckpoints.checkpoint_dir = self.checkpoint_dir
+        self.contents_manager = make_contents_manager(
+            root_dir=self.root_dir,
+            config=config
+        )
+
+    def tearDown(self):
+        fs = self.contents_manager.fs
+        if fs.exists(self.checkpoint_dir):
+            fs.delete(self.checkpoint_dir, recursive=True)
+        super().tearDown()
+
+    def test_rename_directory_moves_checkpoints(self):
+        cm = self.contents_manager
+        self.make_dir('foo')
+        cm.new_untitled(path='foo', type='notebook')
+        cp = cm.create_checkpoint('foo/Untitled.ipynb')
+
+        cm.rename('foo', 'bar')
+        self.assertEqual(cm.list_checkpoints('foo/Untitled.ipynb'), [])
+        self.assertEqual(cm.list_checkpoints('bar/Untitled.ipynb'), [cp])
+
+        cm.delete('bar/Untitled.ipynb')
+        cm.delete('bar')
+        self.assertFalse(
+            cm.fs.exists(self.checkpoint_dir + '/bar')
+        )
+
+
 del TestContentsManager
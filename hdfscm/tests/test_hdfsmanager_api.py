@@ -2,19 +2,27 @@ import nbformat
 from notebook.services.contents.tests.test_contents_api import (
     APITest, assert_http_error
 )
+from traitlets import default
 from traitlets.config import Config
 
 from hdfscm import HDFSContentsManager
 from hdfscm.utils import to_fs_path
 
-from .conftest import random_root_dir
+from .conftest import random_root_dir, make_filesystem
+
+
+class HDFSContentsManagerWithTestFS(HDFSContentsManager):
+    @default('fs')
+    def _default_fs(self):
+        fs = make_filesystem()
+        return super()._default_fs() if fs is None else fs
 
 
 class HDFSContentsAPITest(APITest):
     hidden_dirs = []
     root_dir = random_root_dir()
     config = Config()
-    config.NotebookApp.contents_manager_class = HDFSContentsManager
+    config.NotebookApp.contents_manager_class = HDFSContentsManagerWithTestFS
     config.HDFSContentsManager.root_dir = root_dir
 
     @classmethod
@@ -79,6 +87,24 @@ class HDFSContentsAPITest(APITest):
     def isdir(self, api_path):
         return self.fs.isdir(self.get_hdfs_path(api_path))
 
+    def test_listing_truncated(self):
+        self.make_dir('paged')
+        for name in ['a.txt', 'b.txt', 'c.txt']:
+            self.make_txt('paged/' + name, name)
+        cm = self.notebook.contents_manager
+        cm.max_listing_entries = 2
+        try:
+            model = self.api.list('paged').json()
+            assert model['truncated']
+            assert [m['name'] for m in model['content']] == ['a.txt', 'b.txt']
+            # Pagination isn't available over REST, the first page is
+            # always returned
+            model = self.api._req('GET', 'paged',
+                                  params={'offset': '2'}).json()
+            assert [m['name'] for m in model['content']] == ['a.txt', 'b.txt']
+        finally:
+            cm.max_listing_entries = 0
+
     # Test overrides.
     def test_checkpoints_separate_root(self):
         pass
@@ -0,0 +1,66 @@
+import posixpath
+
+import pytest
+from tornado.web import HTTPError
+
+
+@pytest.fixture
+def cm(contents_manager):
+    cm = contents_manager()
+    cm.fs.mkdir(posixpath.join(cm.root_dir, 'dir'))
+    for name in ['a.txt', 'b.txt', '.hidden', 'c.txt', 'd.txt']:
+        with cm.fs.open(posixpath.join(cm.root_dir, 'dir', name), 'wb') as f:
+            f.write(b'x')
+    return cm
+
+
+def names(model):
+    return [c['name'] for c in model['content']]
+
+
+def test_paginated_listing(cm):
+    model = cm.get('dir')
+    assert names(model) == ['a.txt', 'b.txt', 'c.txt', 'd.txt']
+    assert 'truncated' not in model
+
+    # Hidden files are filtered before paginating
+    page = cm.get('dir', offset=0, limit=2)
+    assert names(page) == ['a.txt', 'b.txt']
+    assert page['truncated']
+    page = cm.get('dir', offset=2, limit=2)
+    assert names(page) == ['c.txt', 'd.txt']
+    assert 'truncated' not in page
+    assert names(cm.get('dir', offset=3)) == ['d.txt']
+
+    with pytest.raises(HTTPError) as info:
+        cm.get('dir', offset=-1)
+    assert info.value.status_code == 400
+
+
+def test_max_listing_entries(cm):
+    cm.max_listing_entries = 3
+    model = cm.get('dir')
+    assert names(model) == ['a.txt', 'b.txt', 'c.txt']
+    assert model['truncated']
+    # Pages can't exceed the cap either
+    assert len(cm.get('dir', limit=10)['content']) == 3
+    assert names(cm.get('dir', offset=3)) == ['d.txt']
+
+
+@pytest.mark.parametrize('dir_path', ['', 'dir'])
+def test_listing_models_match_model_from_info(cm, dir_path):
+    hdfs_dir = posixpath.join(cm.root_dir, dir_path).rstrip('/')
+    files = ['a.ipynb', 'b.tar.gz', 'c.tgz', 'd.CSV', 'e.json', 'f', 'g.h.py',
+             'archive.2020.01.zip', 'h..gz']
+    for name in files:
+        with cm.fs.open(posixpath.join(hdfs_dir, name), 'wb') as f:
+            f.write(b'x')
+    cm.fs.mkdir(posixpath.join(hdfs_dir, 'subdir.d'))
+
+    records = cm.fs.ls(hdfs_dir, True)
+    entries = [(r['name'].rsplit('/', 1)[-1], r) for r in records]
+    expected = [cm._model_from_info(r) for r in records]
+    assert cm._listing_models(dir_path, entries) == expected
+    assert cm.get(dir_path)['content'] == [
+        m for m in expected if not m['name'].startswith('.')
+    ]
@@ -0,0 +1,82 @@
+import pytest
+from tornado.web import HTTPError
+
+from hdfscm.fakefs import MemoryFileSystem
+from hdfscm.metrics import InstrumentedFileSystem
+
+
+class RecordingObserver(object):
+    def __init__(self):
+        self.calls = []
+        self.operations = []
+
+    def fs_call(self, call, path, duration, nbytes, error):
+        self.calls.append((call, path, nbytes, error))
+
+    def start_operation(self, operation, path):
+        pass
+
+    def operation(self, operation, duration, status):
+        self.operations.append((operation, status))
+
+
+def test_instrumented_filesystem():
+    obs = RecordingObserver()
+    fs = InstrumentedFileSystem(MemoryFileSystem(), [obs])
+    with fs.open('/a/b', 'wb') as f:
+        f.write(b'hello')
+    with fs.open('/a/b', 'rb') as f:
+        assert f.read() == b'hello'
+    assert fs.isfile('/a/b')
+    with pytest.raises(Exception):
+        fs.info('/missing')
+    # Other attributes are forwarded
+    assert fs.calls['open'] == 2
+
+    assert [c[:3] for c in obs.calls] == [
+        ('open', '/a/b', 0),
+        ('write', '/a/b', 5),
+        ('open', '/a/b', 0),
+        ('read', '/a/b', 5),
+        ('isfile', '/a/b', 0),
+        ('info', '/missing', 0),
+    ]
+    assert obs.calls[-1][3] is not None
+
+
+def test_instrumented_operations(cm):
+    obs = RecordingObserver()
+    cm._observers = [obs]
+    cm.new(path='foo.ipynb')
+    cm.create_checkpoint('foo.ipynb')
+    with pytest.raises(HTTPError):
+        cm.get('missing.ipynb')
+    assert ('save', None) in obs.operations
+    assert ('create_checkpoint', None) in obs.operations
+    assert obs.operations[-1] == ('get', 404)
+
+
+def test_prometheus_metrics(contents_manager):
+    prometheus_client = pytest.importorskip('prometheus_client')
+    registry = prometheus_client.REGISTRY
+
+    def sample(name, **labels):
+        return registry.get_sample_value(name, labels) or 0
+
+    before_ls = sample('hdfscm_fs_call_duration_seconds_count', call='ls')
+    before_get = sample('hdfscm_contents_operation_duration_seconds_count',
+                        operation='get')
+    before_404 = sample('hdfscm_contents_errors_total',
+                        operation='get', status='404')
+
+    cm = contents_manager(enable_metrics=True)
+    cm.get('')
+    with pytest.raises(HTTPError):
+        cm.get('missing')
+
+    assert sample('hdfscm_fs_call_duration_seconds_count',
+                  call='ls') == before_ls + 1
+    assert sample('hdfscm_contents_operation_duration_seconds_count',
+                  operation='get') == before_get + 2
+    assert sample('hdfscm_contents_errors_total',
+                  operation='get', status='404') == before_404 + 1
@@ -0,0 +1,179 @@
+import copy
+import posixpath
+
+import pytest
+from nbformat.v4 import new_code_cell, new_notebook, new_output
+
+from hdfscm.outputs import OUTPUT_BLOBS_KEY, join_outputs, split_outputs
+
+
+def make_notebook(image='x' * 100):
+    outputs = [
+        {'output_type': 'stream', 'name': 'stdout', 'text': 'y' * 100},
+        {'output_type': 'display_data', 'metadata': {},
+         'data': {'image/png': image, 'text/plain': 'z'}},
+    ]
+    return {
+        'cells': [
+            {'cell_type': 'markdown', 'source': 'a', 'metadata': {}},
+            {'cell_type': 'code', 'source': 'b', 'metadata': {},
+             'outputs': outputs},
+        ],
+        'metadata': {},
+    }
+
+
+def test_split_outputs():
+    nb = make_notebook()
+    orig = copy.deepcopy(nb)
+    split, blobs = split_outputs(nb, 10)
+    assert nb == orig
+    assert split['cells'][0] is nb['cells'][0]
+
+    key, = blobs
+    assert blobs[key] == b'x' * 100
+    output = split['cells'][1]['outputs'][1]
+    assert output['data'] == {'image/png': '', 'text/plain': 'z'}
+    assert output['metadata'] == {
+        OUTPUT_BLOBS_KEY: {'image/png': {'sha256': key, 'size': 100}}
+    }
+    # Stream outputs have no metadata to reference blobs from
+    assert split['cells'][1]['outputs'][0] == orig['cells'][1]['outputs'][0]
+
+    def load(key, size):
+        assert len(blobs[key]) == size
+        return blobs[key].decode('utf8')
+    assert join_outputs(split, load) == []
+    assert split == orig
+
+    # Nothing to split
+    assert split_outputs(nb, 100) == (nb, {})
+
+
+def test_join_outputs_missing():
+    split, blobs = split_outputs(make_notebook(), 10)
+    key, = blobs
+    assert join_outputs(split, lambda k, size: None) == [key]
+    output = split['cells'][1]['outputs'][1]
+    assert output['data']['image/png'] == ''
+    # The reference is kept, and survives splitting again
+    ref = {'sha256': key, 'size': 100}
+    assert output['metadata'] == {OUTPUT_BLOBS_KEY: {'image/png': ref}}
+    resplit, blobs = split_outputs(split, 10)
+    assert resplit is split
+    assert blobs == {}
+
+    # Until the output is replaced
+    output['data']['image/png'] = 'w'
+    resplit, blobs = split_outputs(split, 10)
+    assert OUTPUT_BLOBS_KEY not in resplit['cells'][1]['outputs'][1]['metadata']
+
+
+@pytest.mark.parametrize('ref', [
+    {'sha256': '../../secret', 'size': 1},
+    {'sha256': '/secret', 'size': 1},
+    {'sha256': 'A' * 64, 'size': 1},
+    {'sha256': 'a' * 64, 'size': '1'},
+    {'sha256': 'a' * 64},
+    'a' * 64,
+])
+def test_join_outputs_invalid_ref(ref):
+    split, _ = split_outputs(make_notebook(), 10)
+    output = split['cells'][1]['outputs'][1]
+    output['metadata'][OUTPUT_BLOBS_KEY] = {'image/png': ref}
+
+    def load(key, size):
+        raise AssertionError("Loaded %r" % key)
+    assert join_outputs(split, load) == [repr(ref)]
+    assert output['data']['image/png'] == ''
+    assert output['metadata'][OUTPUT_BLOBS_KEY] == {'image/png': ref}
+
+
+@pytest.fixture
+def cm(contents_manager):
+    return contents_manager(output_blob_threshold=50)
+
+
+def save_notebook(cm, path, image):
+    cell = new_code_cell('plot()', outputs=[
+        new_output('display_data', data={'image/png': image,
+                                         'text/plain': 'plot'})
+    ])
+    nb = new_notebook(cells=[cell])
+    cm.save({'type': 'notebook', 'content': nb}, path)
+
+
+def blob_paths(cm):
+    blob_dir = posixpath.join(cm.root_dir, cm.output_blob_dir)
+    return [p for d in cm.fs.ls(blob_dir) for p in cm.fs.ls(d)]
+
+
+def test_contents_manager_split_outputs(cm):
+    image = 'i' * 1000
+    save_notebook(cm, 'a.ipynb', image)
+    hdfs_path = cm._paths.to_fs_path('a.ipynb')
+    assert cm.fs.info(hdfs_path)['size'] < 1000
+    assert len(blob_paths(cm)) == 1
+    model = cm.get('a.ipynb')
+    output = model['content']['cells'][0]['outputs'][0]
+    assert output['data']['image/png'] == image
+    assert OUTPUT_BLOBS_KEY not in output['metadata']
+
+    # Unchanged outputs aren't written again
+    cm._output_blobs.clear()
+    save_notebook(cm, 'b.ipynb', image)
+    assert len(blob_paths(cm)) == 1
+    save_notebook(cm, 'a.ipynb', 'j' * 1000)
+    assert len(blob_paths(cm)) == 2
+
+    # Outputs are only split and joined while enabled
+    cm.output_blob_threshold = 0
+    output = cm.get('b.ipynb')['content']['cells'][0]['outputs'][0]
+    assert output['data']['image/png'] == ''
+    assert OUTPUT_BLOBS_KEY in output['metadata']
+    save_notebook(cm, 'c.ipynb', image)
+    assert cm.fs.info(cm._paths.to_fs_path('c.ipynb'))['size'] > 1000
+    # Hidden from listings
+    assert [m['name'] for m in cm.get('')['content']] == [
+        'a.ipynb', 'b.ipynb', 'c.ipynb'
+    ]
+
+
+def test_contents_manager_missing_blob(cm):
+    image = 'i' * 1000
+    save_notebook(cm, 'a.ipynb', image)
+    blob_path, = blob_paths(cm)
+    assert 'message' not in cm.get('a.ipynb')
+    cm.fs.delete(blob_path)
+    cm._output_blobs.clear()
+    if cm._content_cache is not None:
+        cm._content_cache.clear()
+
+    model = cm.get('a.ipynb')
+    assert 'outputs' in model['message']
+    output = model['content']['cells'][0]['outputs'][0]
+    assert output['data']['image/png'] == ''
+
+    # Saving the notebook back keeps the reference to the missing blob
+    cm.save({'type': 'notebook', 'content': model['content']}, 'a.ipynb')
+    with cm.fs.open(blob_path, 'wb') as f:
+        f.write(image.encode('utf8'))
+    model = cm.get('a.ipynb')
+    assert 'message' not in model
+    output = model['content']['cells'][0]['outputs'][0]
+    assert output['data']['image/png'] == image
+
+
+def test_contents_manager_blob_hash_checked(cm):
+    save_notebook(cm, 'a.ipynb', 'i' * 1000)
+    blob_path, = blob_paths(cm)
+    with cm.fs.open(blob_path, 'wb') as f:
+        f.write(b'j' * 1000)
+    cm._output_blobs.clear()
+    if cm._content_cache is not None:
+        cm._content_cache.clear()
+
+    model = cm.get('a.ipynb')
+    assert 'outputs' in model['message']
+    output = model['content']['cells'][0]['outputs'][0]
+    assert output['data']['image/png'] == ''
@@ -0,0 +1,138 @@
+import posixpath
+import time
+
+import pytest
+
+from hdfscm import prefetch
+from hdfscm.fakefs import MemoryFileSystem
+from hdfscm.prefetch import ContentCache, Prefetcher
+
+
+def test_content_cache():
+    cache = ContentCache(10)
+    cache.put('/a/x', 1, 4, b'xxxx')
+    cache.put('/a/y', 1, 4, b'yyyy')
+    assert cache.get('/a/x', 1, 4) == b'xxxx'
+    # Least recently used entries are evicted first
+    cache.put('/b', 1, 4, b'bbbb')
+    assert cache.get('/a/y', 1, 4) is None
+    assert cache.get('/a/x', 1, 4) == b'xxxx'
+    assert cache.nbytes == 8
+    # Too large to cache
+    cache.put('/c', 1, 11, b'c' * 11)
+    assert cache.nbytes == 8
+
+    # Entries are only used while the mtime and size are unchanged
+    assert cache.get('/a/x', 2, 4) is None
+    assert cache.get('/a/x', 1, 4) is None
+
+    cache.put('/a/x', 1, 4, b'xxxx')
+    cache.discard('/a')
+    assert not cache.contains('/a/x', 1, 4)
+    assert cache.contains('/b', 1, 4)
+
+    stats = cache.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 3
+    assert stats['hit_rate'] == pytest.approx(0.4)
+
+
+def test_content_cache_skips_recently_modified():
+    cache = ContentCache(10, min_age=60)
+    now = time.time()
+    # May still change without changing its mtime
+    cache.put('/a', now, 1, b'a')
+    assert not cache.contains('/a', now, 1)
+    cache.put('/a', now - 120, 1, b'a')
+    assert cache.contains('/a', now - 120, 1)
+
+
+def test_content_cache_prefetch_hits():
+    outcomes = []
+
+    class Observer(object):
+        def cache_lookup(self, cache, outcome):
+            outcomes.append((cache, outcome))
+
+    cache = ContentCache(10, observers=[Observer()])
+    cache.put('/a', 1, 1, b'a', prefetched=True)
+    cache.put('/b', 1, 9, b'b' * 9, prefetched=True)
+    cache.get('/b', 1, 9)
+    cache.get('/b', 1, 9)
+    cache.get('/c', 1, 1)
+    assert outcomes == [('content', 'prefetch_hit'), ('content', 'hit'),
+                        ('content', 'miss')]
+    cache.put('/c', 1, 2, b'cc')
+    stats = cache.stats()
+    assert stats['prefetched'] == 2
+    assert stats['prefetch_hits'] == 1
+    assert stats['prefetch_evicted'] == 1
+
+
+def write(fs, path, data):
+    with fs.open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_prefetch_candidates():
+    fs = MemoryFileSystem()
+    prefetcher = Prefetcher(fs, ContentCache(100), max_files=2,
+                            max_file_size=5)
+    entries = [('a', {'kind': 'file', 'size': 1, 'last_modified_time': 3}),
+               ('b', {'kind': 'file', 'size': 1, 'last_modified_time': 1}),
+               ('c', {'kind': 'file', 'size': 1, 'last_modified_time': 2}),
+               ('d', {'kind': 'file', 'size': 10, 'last_modified_time': 9}),
+               ('e', {'kind': 'directory', 'size': 0,
+                      'last_modified_time': 9})]
+
+    def paths():
+        return [p for p, _ in prefetcher.candidates('/dir', entries)]
+
+    # Most recently modified first
+    assert paths() == ['/dir/a', '/dir/c']
+    # Then most recently opened first
+    prefetcher.opened('/dir/c')
+    prefetcher.opened('/dir/b')
+    assert paths() == ['/dir/b', '/dir/c']
+    prefetcher.opened('/dir/c')
+    assert paths() == ['/dir/c', '/dir/b']
+
+
+@pytest.fixture
+def cm(contents_manager):
+    return contents_manager(content_cache_size=2**20, prefetch_files=2,
+                            prefetch_min_available_memory=0,
+                            cache_min_file_age=0)
+
+
+def test_prefetch_on_listing(cm):
+    for i, name in enumerate(['a.txt', 'b.txt', 'c.txt']):
+        write(cm.fs, posixpath.join(cm.root_dir, name), b'x' * (i + 1))
+        time.sleep(0.01)
+    cm.new(path='d.ipynb')
+    cm.get('d.ipynb')
+
+    cm.get('')
+    cm._prefetcher.wait()
+    stats = cm._content_cache.stats()
+    # The notebook was opened most recently and is already cached, the most
+    # recently modified file is prefetched
+    assert stats['prefetched'] == 1
+    assert cm.get('d.ipynb')['content']['cells'] == []
+    assert cm.get('c.txt')['content'] == 'xxx'
+    stats = cm._content_cache.stats()
+    assert stats['hits'] == 2
+    assert stats['prefetch_hits'] == 1
+
+    # Saving replaces the cached contents
+    cm.save({'type': 'file', 'format': 'text', 'content': 'yyy'}, 'c.txt')
+    assert cm.get('c.txt')['content'] == 'yyy'
+
+
+def test_prefetch_cancelled_on_memory_pressure(cm, monkeypatch):
+    write(cm.fs, posixpath.join(cm.root_dir, 'a.txt'), b'a')
+    cm._prefetcher.min_available_memory = 2**20
+    monkeypatch.setattr(prefetch, 'available_memory', lambda: 1024)
+    cm.get('')
+    cm._prefetcher.wait()
+    assert cm._content_cache.stats()['prefetched'] == 0
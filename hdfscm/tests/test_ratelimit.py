@@ -0,0 +1,96 @@
+import time
+
+import pytest
+from tornado.web import HTTPError
+
+from hdfscm.fakefs import MemoryFileSystem
+from hdfscm.ratelimit import (RateLimitedFileSystem, RateLimitExceeded,
+                              TokenBucket)
+
+from .conftest import make_contents_manager
+
+
+class ThrottleObserver(object):
+    def __init__(self):
+        self.throttled = []
+
+    def throttle(self, kind):
+        self.throttled.append(kind)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=100, burst=2)
+    assert bucket.take(1)
+    assert bucket.take(1)
+    # Empty, a token takes 10 ms to refill
+    assert not bucket.take(1)
+    time.sleep(0.02)
+    assert bucket.take(1)
+    # Requests larger than the burst are allowed, leaving the bucket in debt
+    bucket = TokenBucket(rate=100, burst=2)
+    assert bucket.take(10)
+    time.sleep(0.05)
+    assert not bucket.take(1)
+
+
+def test_metadata_rate_limit():
+    obs = ThrottleObserver()
+    fs = RateLimitedFileSystem(MemoryFileSystem(),
+                               metadata=TokenBucket(rate=1, burst=2),
+                               observers=[obs])
+    fs.ls('/')
+    fs.exists('/')
+    with pytest.raises(RateLimitExceeded) as info:
+        fs.info('/')
+    assert info.value.status_code == 429
+    assert obs.throttled == ['metadata']
+    # Other calls aren't limited
+    fs.mkdir('/a')
+
+
+def test_data_rate_limit():
+    obs = ThrottleObserver()
+    fs = RateLimitedFileSystem(MemoryFileSystem(),
+                               data=TokenBucket(rate=100, burst=10),
+                               observers=[obs])
+    # Writes are charged, but never rejected once the file is open
+    with fs.open('/a', 'wb') as f:
+        f.write(b'x' * 10)
+        f.write(b'x' * 10)
+    # Opening for writing is rejected while in debt, before truncating
+    with pytest.raises(RateLimitExceeded):
+        fs.open('/a', 'wb')
+    fs.data = TokenBucket(rate=100, burst=5)
+    with fs.open('/a', 'rb') as f:
+        assert f.read() == b'x' * 20
+        with pytest.raises(RateLimitExceeded):
+            f.read()
+    assert obs.throttled == ['data', 'data']
+
+
+def test_throttled_save_keeps_file(contents_manager):
+    cm = contents_manager(bytes_per_second=100)
+    model = {'type': 'file', 'format': 'text', 'content': 'x' * 50}
+    cm.save(model, 'a.txt')
+    with pytest.raises(HTTPError) as info:
+        cm.save(dict(model, content='y' * 1000), 'a.txt')
+        cm.save(dict(model, content='z' * 1000), 'a.txt')
+    assert info.value.status_code == 429
+    cm.fs.data = None
+    assert cm.get('a.txt')['content'] == 'y' * 1000
+
+
+def test_contents_manager_rate_limits(monkeypatch, contents_manager):
+    monkeypatch.setenv('JUPYTERHUB_USER', 'alice')
+    overrides = {'alice': {'metadata_ops_per_second': 1,
+                           'metadata_ops_burst': 1}}
+    cm = contents_manager(metadata_ops_per_second=1000,
+                          rate_limit_overrides=overrides)
+    assert cm.fs.metadata.rate == 1
+    with pytest.raises(HTTPError) as info:
+        cm.get('')
+    assert info.value.status_code == 429
+
+    with pytest.raises(ValueError):
+        make_contents_manager(root_dir=cm.root_dir,
+                              rate_limit_overrides={'alice': {'bad': 1}})
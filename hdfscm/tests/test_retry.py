@@ -0,0 +1,149 @@
+import errno
+
+import pytest
+from pyarrow import ArrowIOError
+from tornado.web import HTTPError
+
+from hdfscm import HDFSContentsManager
+from hdfscm.fakefs import MemoryFileSystem
+from hdfscm.retry import RetryingFileSystem
+from hdfscm.utils import classify_error, hdfs_errors
+
+from .conftest import random_root_dir, make_filesystem, FlakyFileSystem
+
+
+STANDBY = ("HDFS GetPathInfo failed, errno: 255 (Unknown error 255) "
+           "org.apache.hadoop.ipc.StandbyException: Operation category READ "
+           "is not supported in state standby")
+
+
+@pytest.mark.parametrize('exc, status', [
+    (ArrowIOError("HDFS file does not exist: /foo"), 404),
+    (ArrowIOError("HDFS GetPathInfo failed, errno: 2 "
+                  "(No such file or directory)"), 404),
+    (ArrowIOError("HDFS ListDirectory failed, errno: 13 "
+                  "(Permission denied)"), 403),
+    (ArrowIOError("org.apache.hadoop.hdfs.protocol."
+                  "DSQuotaExceededException: The DiskSpace quota of /foo "
+                  "is exceeded"), 507),
+    (ArrowIOError(STANDBY), 503),
+    (OSError(errno.ETIMEDOUT, "Connection timed out"), 503),
+    (ConnectionRefusedError(), 503),
+    (OSError(errno.EEXIST, "File exists"), 409),
+    (ArrowIOError("Something else went wrong"), None),
+    (ValueError("Not a filesystem error"), None),
+])
+def test_classify_error(exc, status):
+    assert classify_error(exc) == status
+
+
+def test_hdfs_errors():
+    with pytest.raises(HTTPError) as info:
+        with hdfs_errors('foo'):
+            raise ArrowIOError(STANDBY)
+    assert info.value.status_code == 503
+
+    # Unknown errors are re-raised unchanged
+    with pytest.raises(ArrowIOError):
+        with hdfs_errors('foo'):
+            raise ArrowIOError("Something else went wrong")
+
+
+def test_retries_transient_errors():
+    fs = MemoryFileSystem()
+    fs.mkdir('/a')
+    flaky = FlakyFileSystem(fs, 2, ArrowIOError(STANDBY))
+    retrying = RetryingFileSystem(flaky, retries=2, base_delay=0)
+    assert retrying.isfile('/a') is False
+    assert flaky.attempts['isfile'] == 3
+
+
+def test_gives_up_after_retries():
+    flaky = FlakyFileSystem(MemoryFileSystem(), 3, ArrowIOError(STANDBY))
+    retrying = RetryingFileSystem(flaky, retries=2, base_delay=0)
+    with pytest.raises(ArrowIOError):
+        retrying.info('/')
+    assert flaky.attempts['info'] == 3
+
+
+def test_gives_up_at_deadline():
+    flaky = FlakyFileSystem(MemoryFileSystem(), 10, ArrowIOError(STANDBY))
+    retrying = RetryingFileSystem(flaky, retries=10, base_delay=10,
+                                  max_delay=10, deadline=0.001)
+    with pytest.raises(ArrowIOError):
+        retrying.ls('/')
+    # Any backoff would overrun the deadline
+    assert flaky.attempts['ls'] <= 2
+
+
+def test_gives_up_at_max_total_delay():
+    flaky = FlakyFileSystem(MemoryFileSystem(), 10, ArrowIOError(STANDBY))
+    retrying = RetryingFileSystem(flaky, retries=10, base_delay=10,
+                                  max_delay=10, max_total_delay=0.001,
+                                  deadline=0)
+    with pytest.raises(ArrowIOError):
+        retrying.ls('/')
+    # Any backoff would exceed the total delay
+    assert flaky.attempts['ls'] <= 2
+
+
+def test_no_retry_of_permanent_errors_or_writes():
+    fs = MemoryFileSystem()
+    with fs.open('/a', 'wb') as f:
+        f.write(b'a')
+
+    flaky = FlakyFileSystem(fs, 1, ArrowIOError("HDFS file does not exist"))
+    retrying = RetryingFileSystem(flaky, base_delay=0)
+    with pytest.raises(ArrowIOError):
+        retrying.info('/a')
+    assert flaky.attempts['info'] == 1
+
+    flaky = FlakyFileSystem(fs, 1, ArrowIOError(STANDBY))
+    retrying = RetryingFileSystem(flaky, base_delay=0)
+    with pytest.raises(ArrowIOError):
+        retrying.rename('/a', '/b')
+    with pytest.raises(ArrowIOError):
+        retrying.open('/c', 'wb')
+    # Reads are retried
+    with retrying.open('/a', 'rb') as f:
+        assert f.read() == b'a'
+
+
+def test_contents_manager_retries():
+    fs = make_filesystem()
+    if fs is None:
+        pytest.skip("Can't inject failures into HDFS")
+    root_dir = random_root_dir()
+    cm = HDFSContentsManager(root_dir=root_dir, fs=fs,
+                             fs_retry_base_delay=0,
+                             circuit_breaker_failures=0,
+                             max_concurrent_fs_calls=0)
+    assert isinstance(cm.fs, RetryingFileSystem)
+    cm.new(path='foo.ipynb')
+
+    cm.fs.fs = FlakyFileSystem(fs, 2, ArrowIOError(STANDBY))
+    assert cm.get('foo.ipynb')['type'] == 'notebook'
+
+    # Once retries are exhausted, the error is reported as unavailable
+    cm.fs.fs = FlakyFileSystem(fs, 4, ArrowIOError(STANDBY))
+    with pytest.raises(HTTPError) as info:
+        cm.get('foo.ipynb')
+    assert info.value.status_code == 503
+
+    fs.delete(root_dir, recursive=True)
+
+
+def test_rename_conflict_names_destination(contents_manager, monkeypatch):
+    cm = contents_manager()
+    cm.new(path='a.ipynb')
+
+    def rename(old, new):
+        # Created by someone else after the check for an existing file
+        raise ArrowIOError("org.apache.hadoop.fs.FileAlreadyExistsException: "
+                           "%s already exists" % new)
+    monkeypatch.setattr(cm.fs, 'rename', rename)
+    with pytest.raises(HTTPError) as info:
+        cm.rename('a.ipynb', 'b.ipynb')
+    assert info.value.status_code == 409
+    assert 'b.ipynb' in info.value.log_message
+    assert 'a.ipynb' not in info.value.log_message
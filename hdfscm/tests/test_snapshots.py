@@ -0,0 +1,77 @@
+import pytest
+from tornado.web import HTTPError
+from traitlets.config import Config
+
+from hdfscm import SnapshotCheckpoints
+from hdfscm.checkpoints import CopySnapshotter, Snapshotter
+
+from .conftest import filesystem_kind
+
+
+@pytest.fixture
+def cm(contents_manager):
+    if filesystem_kind() == 'hdfs':
+        pytest.skip("CopySnapshotter can't be used on HDFS")
+    config = Config()
+    config.SnapshotCheckpoints.snapshotter_class = (
+        'hdfscm.checkpoints.CopySnapshotter'
+    )
+    config.SnapshotCheckpoints.max_snapshots = 2
+    return contents_manager(checkpoints_class=SnapshotCheckpoints,
+                            config=config)
+
+
+def test_snapshot_checkpoints(cm):
+    model = cm.new(path='foo.ipynb')
+    assert cm.list_checkpoints('foo.ipynb') == []
+
+    cp1 = cm.create_checkpoint('foo.ipynb')
+    assert cm.list_checkpoints('foo.ipynb') == [cp1]
+
+    # Modify and restore
+    nb = cm.get('foo.ipynb')['content']
+    nb.cells.append({'cell_type': 'markdown', 'metadata': {},
+                     'source': 'hello'})
+    cm.save({'type': 'notebook', 'content': nb}, 'foo.ipynb')
+    assert len(cm.get('foo.ipynb')['content'].cells) == 1
+    cm.restore_checkpoint(cp1['id'], 'foo.ipynb')
+    assert cm.get('foo.ipynb')['content'].cells == []
+
+    # Snapshots aren't listed by the contents manager
+    names = [m['name'] for m in cm.get('')['content']]
+    assert names == [model['name']]
+
+    # Files created after a snapshot aren't in it
+    cm.new(path='bar.ipynb')
+    assert cm.list_checkpoints('bar.ipynb') == []
+    cp2 = cm.create_checkpoint('bar.ipynb')
+    assert cm.list_checkpoints('bar.ipynb') == [cp2]
+    assert cm.list_checkpoints('foo.ipynb') == [cp1, cp2]
+
+    # Old snapshots are pruned
+    cp3 = cm.create_checkpoint('foo.ipynb')
+    assert cm.list_checkpoints('foo.ipynb') == [cp2, cp3]
+
+
+def test_snapshotter_is_abstract():
+    with pytest.raises(TypeError):
+        Snapshotter()
+
+
+class FailingSnapshotter(CopySnapshotter):
+    def create_snapshot(self, directory, name):
+        raise RuntimeError("snapshots disabled")
+
+
+def test_snapshot_checkpoint_errors(cm):
+    cm.new(path='foo.ipynb')
+    with pytest.raises(HTTPError) as info:
+        cm.restore_checkpoint('hdfscm-20190101T000000.000000', 'foo.ipynb')
+    assert info.value.status_code == 404
+
+    cm.checkpoints.snapshotter = FailingSnapshotter(parent=cm.checkpoints)
+    with pytest.raises(HTTPError) as info:
+        cm.create_checkpoint('foo.ipynb')
+    assert info.value.status_code == 500
+    assert 'snapshots disabled' in info.value.log_message
+    assert cm.list_checkpoints('foo.ipynb') == []
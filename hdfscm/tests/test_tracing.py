@@ -0,0 +1,36 @@
+import logging
+
+
+def test_slow_operation_logging(caplog, contents_manager):
+    cm = contents_manager(slow_operation_threshold=1e-9,
+                          log=logging.getLogger('hdfscm-test'))
+    cm.new(path='foo.ipynb')
+    caplog.clear()
+
+    with caplog.at_level(logging.WARNING, logger='hdfscm-test'):
+        cm.get('foo.ipynb')
+
+    record, = caplog.records
+    trace = record.hdfscm_trace
+    assert trace['operation'] == 'get'
+    assert trace['path'] == 'foo.ipynb'
+    assert trace['status'] is None
+    calls = [c['call'] for c in trace['calls']]
+    assert 'info' in calls
+    assert 'open' in calls
+    read, = [c for c in trace['calls'] if c['call'] == 'read']
+    assert read['bytes'] > 0
+    assert trace['bytes'] == read['bytes']
+
+
+def test_nested_operations_share_a_trace(caplog, contents_manager):
+    cm = contents_manager(slow_operation_threshold=1e-9,
+                          log=logging.getLogger('hdfscm-test'))
+
+    with caplog.at_level(logging.WARNING, logger='hdfscm-test'):
+        cm.save({'type': 'directory'}, 'foo')
+
+    # `save` calls `get`, but only one trace is logged
+    record, = caplog.records
+    assert record.hdfscm_trace['operation'] == 'save'
+    assert record.hdfscm_trace['path'] == 'foo'
@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+
+import pytest
+from tornado.web import HTTPError
+
+from hdfscm.utils import (PathTranslator, to_api_path, to_fs_path, is_hidden,
+                          parse_timestamp, utcfromtimestamp,
+                          utcfromtimestamps)
+
+
+@pytest.mark.parametrize('root', ['/user/a/notebooks', '/user/a/notebooks/'])
+def test_path_translator(root):
+    paths = PathTranslator(root)
+    assert paths.root == '/user/a/notebooks'
+
+    assert paths.to_fs_path('') == '/user/a/notebooks'
+    assert paths.to_fs_path('/') == '/user/a/notebooks'
+    assert paths.to_fs_path('foo/bar') == '/user/a/notebooks/foo/bar'
+    assert paths.to_fs_path('/foo//./bar/') == '/user/a/notebooks/foo/bar'
+    with pytest.raises(HTTPError) as info:
+        paths.to_fs_path('foo/../../b/notebooks')
+    assert info.value.status_code == 404
+
+    assert paths.to_api_path('/user/a/notebooks') == ''
+    assert paths.to_api_path('/user/a/notebooks/foo/bar') == 'foo/bar'
+    assert paths.to_api_path('/user/a/notebooks//foo/') == 'foo'
+    # Siblings of the root sharing its prefix aren't below it
+    assert not paths.contains('/user/a/notebooks2/foo')
+    assert paths.contains('/user/a/notebooks/foo')
+    assert paths.to_api_path('/user/a/notebooks2/foo') == \
+        'user/a/notebooks2/foo'
+
+    assert paths.is_hidden('/user/a/notebooks/.foo/bar')
+    assert paths.is_hidden('/user/a/notebooks/foo/.bar')
+    assert not paths.is_hidden('/user/a/notebooks/foo.bar/baz')
+
+
+def test_path_translator_filesystem_root():
+    paths = PathTranslator('/')
+    assert paths.to_fs_path('') == '/'
+    assert paths.to_fs_path('foo/bar') == '/foo/bar'
+    assert paths.to_api_path('/foo/bar') == 'foo/bar'
+    assert paths.to_api_path('/') == ''
+
+
+def test_path_functions():
+    root = '/user/a/notebooks'
+    assert to_fs_path('foo', root) == '/user/a/notebooks/foo'
+    assert to_api_path('/user/a/notebooks/foo', root) == 'foo'
+    assert is_hidden('/user/a/notebooks/.foo', root)
+
+
+def test_parse_timestamp():
+    expected = datetime(2019, 1, 2, 3, 4, 5, 123000, tzinfo=timezone.utc)
+    for value in ['2019-01-02T03:04:05.123Z',
+                  '2019-01-02T03:04:05.123000+00:00',
+                  '2019-01-02T03:04:05.123',
+                  '2019-01-02T05:34:05.123+02:30',
+                  expected, expected.replace(tzinfo=None)]:
+        assert parse_timestamp(value) == expected
+    # Round trips with model timestamps
+    t = utcfromtimestamp(1546398245.123)
+    assert parse_timestamp(t.isoformat()) == t
+    with pytest.raises(ValueError):
+        parse_timestamp('yesterday')
+
+
+def test_utcfromtimestamps():
+    timestamps = [0, 1546398245.123, 1546398245.123, 1700000000, -86400.5]
+    converted = utcfromtimestamps(iter(timestamps))
+    assert set(converted) == set(timestamps)
+    for t in timestamps:
+        assert converted[t] == utcfromtimestamp(t)
+        assert converted[t].tzinfo == utcfromtimestamp(t).tzinfo
@@ -0,0 +1,178 @@
+import threading
+import time
+
+import pytest
+from pyarrow import ArrowIOError
+from tornado.web import HTTPError
+
+from hdfscm import HDFSContentsManager
+from hdfscm.fakefs import MemoryFileSystem
+from hdfscm.writeback import WriteBackQueue
+
+from .conftest import random_root_dir
+
+
+class BlockingFileSystem(object):
+    """Blocks opening files for writing until ``unblock`` is set, or fails
+    them if ``fail`` is set"""
+    def __init__(self, fs):
+        self.fs = fs
+        self.unblock = threading.Event()
+        self.fail = False
+        self.writes = 0
+
+    def open(self, path, mode='rb', *args, **kwargs):
+        if mode == 'wb':
+            self.unblock.wait()
+            if self.fail:
+                raise ArrowIOError("Failed to open %s" % path)
+            self.writes += 1
+        return self.fs.open(path, mode, *args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.fs, attr)
+
+
+def read(fs, path):
+    with fs.open(path, 'rb') as f:
+        return f.read()
+
+
+def test_write_back_coalesces(tmpdir):
+    fs = BlockingFileSystem(MemoryFileSystem())
+    queue = WriteBackQueue(fs, str(tmpdir))
+    for i in range(5):
+        queue.write('/a', b'x' * i)
+        queue.write('/b', b'b')
+    assert queue.read('/a') == b'xxxx'
+    assert queue.pending('/a').size == 4
+    assert [p.path for p in queue.pending_in('/')] == ['/a', '/b']
+    assert queue.is_pending('/')
+
+    fs.unblock.set()
+    queue.flush()
+    assert not queue.is_pending()
+    assert queue.read('/a') is None
+    assert read(fs, '/a') == b'xxxx'
+    assert read(fs, '/b') == b'b'
+    # At most the first write of each file, then the latest
+    assert fs.writes <= 4
+    assert tmpdir.listdir() == []
+
+
+def test_write_back_recovery(tmpdir):
+    fs = BlockingFileSystem(MemoryFileSystem())
+    fs.fail = True
+    fs.unblock.set()
+    queue = WriteBackQueue(fs, str(tmpdir), retry_interval=60)
+    queue.write('/a/b', b'hello')
+    with pytest.raises(ArrowIOError):
+        queue.flush('/a')
+    queue.close()
+    assert queue.is_pending('/a/b')
+
+    # Pending saves are recovered on restart
+    fs.fail = False
+    queue = WriteBackQueue(fs, str(tmpdir))
+    assert queue.read('/a/b') == b'hello'
+    queue.flush()
+    assert read(fs, '/a/b') == b'hello'
+
+
+def test_write_back_concurrent(tmpdir):
+    fs = BlockingFileSystem(MemoryFileSystem())
+    queue = WriteBackQueue(fs, str(tmpdir))
+    contents = [bytes([i]) * 1000 for i in range(8)]
+
+    def write(data):
+        for _ in range(20):
+            queue.write('/a', data)
+            # The pending contents always match a complete write
+            assert queue.read('/a') in contents
+
+    threads = [threading.Thread(target=write, args=(data,))
+               for data in contents]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    data = queue.read('/a')
+    assert queue.pending('/a').size == len(data)
+
+    fs.unblock.set()
+    queue.flush()
+    assert read(fs, '/a') == data
+    assert tmpdir.listdir() == []
+
+
+def test_write_back_removes_temporary_files(tmpdir):
+    tmpdir.join('abc.tmp').write('partial')
+    queue = WriteBackQueue(MemoryFileSystem(), str(tmpdir))
+    assert not queue.is_pending()
+    assert tmpdir.listdir() == []
+
+
+def test_contents_manager_write_back(tmpdir):
+    fs = BlockingFileSystem(MemoryFileSystem())
+    cm = HDFSContentsManager(root_dir=random_root_dir(), fs=fs,
+                             write_back=True,
+                             write_back_dir=str(tmpdir.join('{username}')))
+    model = cm.new(path='a.ipynb')
+    assert model['pending_sync']
+    assert not fs.fs.exists(cm._paths.to_fs_path('a.ipynb'))
+    assert cm.file_exists('a.ipynb')
+    model = cm.get('a.ipynb')
+    assert model['pending_sync']
+    assert model['content']['cells'] == []
+    listing = cm.get('')['content']
+    assert [(m['name'], m['pending_sync']) for m in listing] == [
+        ('a.ipynb', True)
+    ]
+
+    # Checkpointing waits for the save to be written
+    fs.unblock.set()
+    cm.create_checkpoint('a.ipynb')
+    assert fs.fs.exists(cm._paths.to_fs_path('a.ipynb'))
+    assert not cm.get('a.ipynb')['pending_sync']
+
+    cm.save({'type': 'file', 'format': 'text', 'content': 'x'}, 'b.txt')
+    cm.rename_file('b.txt', 'c.txt')
+    assert cm.get('c.txt')['content'] == 'x'
+    assert not cm._write_back.is_pending()
+
+
+def test_write_back_keeps_mtime(tmpdir):
+    fs = BlockingFileSystem(MemoryFileSystem())
+    fs.unblock.set()
+    cm = HDFSContentsManager(root_dir=random_root_dir(), fs=fs,
+                             write_back=True,
+                             write_back_dir=str(tmpdir.join('{username}')))
+    model = {'type': 'file', 'format': 'text', 'content': 'x'}
+    saved = cm.save(model, 'a.txt')
+    assert saved['pending_sync']
+    time.sleep(0.01)
+    cm._write_back.flush()
+
+    # The written file keeps the modification time of the pending save
+    assert not cm.get('a.txt')['pending_sync']
+    assert cm.get('a.txt')['last_modified'] == saved['last_modified']
+    listing = cm.get('')['content']
+    assert listing[0]['last_modified'] == saved['last_modified']
+    saved = cm.save(dict(model, content='y',
+                         expected_last_modified=saved['last_modified']),
+                    'a.txt')
+    cm._write_back.flush()
+    saved = cm.save(dict(model, content='z',
+                         expected_last_modified=saved['last_modified']),
+                    'a.txt')
+    cm._write_back.flush()
+
+    # Until it's modified again
+    time.sleep(0.01)
+    with fs.open(cm._paths.to_fs_path('a.txt'), 'wb') as f:
+        f.write(b'w')
+    assert cm.get('a.txt')['last_modified'] > saved['last_modified']
+    with pytest.raises(HTTPError) as info:
+        cm.save(dict(model, expected_last_modified=saved['last_modified']),
+                'a.txt')
+    assert info.value.status_code == 409
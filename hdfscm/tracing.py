@@ -0,0 +1,138 @@
+"""Per-request traces of filesystem calls.
+
+A trace is started when a contents operation begins, and records every
+filesystem call made on that thread until the operation completes. Nested
+operations (e.g. the ``get`` done at the end of ``save``) are recorded as
+part of the outermost operation.
+"""
+import json
+import threading
+import time
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # pragma: no cover
+    otel_trace = None
+
+
+__all__ = ('RequestTracer',)
+
+
+class Trace(object):
+    """The filesystem calls made while serving a single contents operation"""
+    def __init__(self, operation, path, max_calls):
+        self.operation = operation
+        self.path = path
+        self.max_calls = max_calls
+        self.start = time.time()
+        self.calls = []
+        self.dropped = 0
+        self.throttled = 0
+        self.cache_hits = 0
+        self.depth = 0
+        self.span = None
+
+    def record(self, call, path, duration, nbytes, error):
+        if len(self.calls) >= self.max_calls:
+            self.dropped += 1
+            return
+        self.calls.append({'call': call,
+                           'path': path,
+                           'duration': round(duration, 6),
+                           'bytes': nbytes,
+                           'error': None if error is None else str(error)})
+
+    def to_dict(self, duration, status):
+        return {'operation': self.operation,
+                'path': self.path,
+                'duration': round(duration, 6),
+                'status': status,
+                'fs_time': round(sum(c['duration'] for c in self.calls), 6),
+                'bytes': sum(c['bytes'] for c in self.calls),
+                'n_calls': len(self.calls) + self.dropped,
+                'throttled': self.throttled,
+                'cache_hits': self.cache_hits,
+                'calls': self.calls}
+
+
+class RequestTracer(object):
+    """Records a trace of filesystem calls per contents operation, logging a
+    structured warning for operations slower than ``threshold`` seconds.
+
+    If ``opentelemetry`` is enabled, each operation is also exported as a
+    span, with a child span per filesystem call."""
+    def __init__(self, log, threshold, max_calls=1000, opentelemetry=False):
+        self.log = log
+        self.threshold = threshold
+        self.max_calls = max_calls
+        self._local = threading.local()
+        if opentelemetry:
+            if otel_trace is None:
+                raise ImportError("opentelemetry-api is required for "
+                                  "opentelemetry tracing")
+            self._otel = otel_trace.get_tracer('hdfscm')
+        else:
+            self._otel = None
+
+    @property
+    def current(self):
+        """The trace for the operation in progress on this thread, if any"""
+        return getattr(self._local, 'trace', None)
+
+    def start_operation(self, operation, path):
+        trace = self.current
+        if trace is None:
+            trace = self._local.trace = Trace(operation, path, self.max_calls)
+            if self._otel is not None:
+                trace.span = self._otel.start_span(
+                    'hdfscm.%s' % operation,
+                    attributes={'hdfscm.path': path or ''}
+                )
+        trace.depth += 1
+
+    def operation(self, operation, duration, status=None):
+        trace = self.current
+        if trace is None:
+            return
+        trace.depth -= 1
+        if trace.depth > 0:
+            return
+        self._local.trace = None
+        if trace.span is not None:
+            if status is not None:
+                trace.span.set_attribute('http.status_code', status)
+            trace.span.end()
+        if self.threshold and duration >= self.threshold:
+            record = trace.to_dict(duration, status)
+            self.log.warning("Slow contents operation: %s",
+                             json.dumps(record),
+                             extra={'hdfscm_trace': record})
+
+    def fs_call(self, call, path, duration, nbytes, error):
+        trace = self.current
+        if trace is None:
+            return
+        trace.record(call, path, duration, nbytes, error)
+        if trace.span is not None:
+            end = time.time_ns()
+            ctx = otel_trace.set_span_in_context(trace.span)
+            span = self._otel.start_span(
+                'hdfs.%s' % call,
+                context=ctx,
+                start_time=end - int(duration * 1e9),
+                attributes={'hdfs.path': path,
+                            'hdfs.bytes': nbytes}
+            )
+            if error is not None:
+                span.record_exception(error)
+            span.end(end_time=end)
+
+    def throttle(self, kind):
+        trace = self.current
+        if trace is not None:
+            trace.throttled += 1
+
+    def cache_lookup(self, cache, outcome):
+        trace = self.current
+        if trace is not None and outcome != 'miss':
+            trace.cache_hits += 1
@@ -1,7 +1,13 @@
+import errno
+import mimetypes
+import re
+import subprocess
+import threading
+from collections import OrderedDict
 from contextlib import contextmanager
 from datetime import datetime, tzinfo, timedelta
+from functools import lru_cache, wraps
 
-from pyarrow import ArrowIOError
 from tornado.web import HTTPError
 
 
@@ -19,42 +25,321 @@ _UTC = _utc_tzinfo()
 
 
 def utcfromtimestamp(t):
-    return datetime.utcfromtimestamp(t).replace(tzinfo=_UTC)
+    return datetime.fromtimestamp(t, _UTC)
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=_UTC)
+
+
+def utcfromtimestamps(timestamps):
+    """Convert many timestamps at once, returning a dict of each distinct
+    timestamp to its datetime.
+
+    Equivalent to ``utcfromtimestamp`` on each, but equal timestamps are
+    converted once and share a datetime, and the conversion is arithmetic
+    from the epoch, avoiding the tzinfo calls of ``fromtimestamp``."""
+    return {t: _EPOCH + timedelta(seconds=t) for t in set(timestamps)}
 
 
 def utcnow():
     return datetime.now().replace(tzinfo=_UTC)
 
 
+_ISO8601 = re.compile(r'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)'
+                      r'(?:\.(\d{1,6})\d*)?(Z|[+-]\d\d:?\d\d)?$')
+
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 timestamp, as found in JSON models, into a
+    timezone aware datetime. Timestamps without a timezone are taken to be
+    UTC. Datetimes are returned unchanged."""
+    if isinstance(value, datetime):
+        return value if value.tzinfo is not None else value.replace(
+            tzinfo=_UTC
+        )
+    match = _ISO8601.match(str(value))
+    if match is None:
+        raise ValueError("Invalid timestamp %r" % value)
+    parts = [int(p) for p in match.groups()[:6]]
+    micros = int((match.group(7) or '0').ljust(6, '0'))
+    out = datetime(*parts, microsecond=micros, tzinfo=_UTC)
+    offset = match.group(8)
+    if offset and offset != 'Z':
+        sign = -1 if offset[0] == '-' else 1
+        digits = offset[1:].replace(':', '')
+        out -= sign * timedelta(hours=int(digits[:2]),
+                                minutes=int(digits[2:]))
+    return out
+
+
+def guess_mimetype(name):
+    """``mimetypes.guess_type(name)[0]``, cached by file extension"""
+    parts = name.rsplit('.', 2)
+    if len(parts) == 1:
+        return None
+    # The mimetype depends on at most the last two extensions (e.g.
+    # ``.tar.gz``)
+    return _guess_mimetype_by_suffix('.'.join(parts[1:]))
+
+
+@lru_cache(maxsize=1024)
+def _guess_mimetype_by_suffix(suffix):
+    return mimetypes.guess_type('x.' + suffix)[0]
+
+
+class PathTranslator(object):
+    """Translates between api paths and filesystem paths below ``root``.
+
+    The root is normalized once up front, and the results of recent
+    translations are memoized, as every contents operation translates the
+    same few paths several times."""
+    def __init__(self, root, cache_size=1024):
+        self.root = root.rstrip('/') or '/'
+        self._prefix = self.root.rstrip('/') + '/'
+        self.to_fs_path = lru_cache(cache_size)(self._to_fs_path)
+        self.to_api_path = lru_cache(cache_size)(self._to_api_path)
+        self.is_hidden = lru_cache(cache_size)(self._is_hidden)
+
+    def contains(self, fs_path):
+        """Whether ``fs_path`` is the root, or below it"""
+        return fs_path == self.root or fs_path.startswith(self._prefix)
+
+    def _to_fs_path(self, path):
+        path = path.strip('/')
+        if not path:
+            return self.root
+        parts = path.split('/')
+        if '' in parts or '.' in parts or '..' in parts:
+            parts = [p for p in parts if p not in ('', '.')]
+            if '..' in parts:
+                raise HTTPError(404, "%s is outside root directory" % path)
+        return self._prefix + '/'.join(parts)
+
+    def _to_api_path(self, fs_path):
+        if self.contains(fs_path):
+            fs_path = fs_path[len(self.root):]
+        if '//' not in fs_path:
+            return fs_path.strip('/')
+        return '/'.join(p for p in fs_path.split('/') if p != '')
+
+    def _is_hidden(self, fs_path):
+        return ('/' + self.to_api_path(fs_path)).find('/.') != -1
+
+
+@lru_cache(maxsize=16)
+def path_translator(root):
+    """The shared ``PathTranslator`` for ``root``"""
+    return PathTranslator(root)
+
+
 def to_api_path(fs_path, root):
-    if fs_path.startswith(root):
-        fs_path = fs_path[len(root):]
-    parts = fs_path.strip('/').split('/')
-    parts = [p for p in parts if p != '']  # remove duplicate splits
-    return '/'.join(parts)
+    return path_translator(root).to_api_path(fs_path)
 
 
 def to_fs_path(path, root):
-    parts = [root]
-    split = path.strip('/').split('/')
-    parts.extend(p for p in split if p != '')  # remove duplicate splits
-    fs_path = '/'.join(parts)
-    if not fs_path.startswith(root):
-        raise HTTPError(404, "%s is outside root directory" % path)
-    return fs_path
+    return path_translator(root).to_fs_path(path)
 
 
 def is_hidden(fs_path, root):
-    path = to_api_path(fs_path, root)
-    return any(part.startswith('.') for part in path.split("/"))
+    return path_translator(root).is_hidden(fs_path)
+
+
+# Substrings of filesystem error messages, by the HTTP status they map to.
+# pyarrow doesn't expose the errno or java exception class of an HDFS error,
+# so these are detected from the message instead. Checked in order, transient
+# errors first so they're never mistaken for a permanent failure.
+_ERROR_PATTERNS = [
+    (503, ('StandbyException', 'RetriableException', 'SafeModeException',
+           'ObserverRetryOnActiveException',
+           'ConnectException', 'ConnectTimeoutException',
+           'SocketTimeoutException', 'Connection refused',
+           'Connection reset', 'timed out',
+           'errno: 11 (Resource temporarily unavailable)',
+           'errno: 104 (Connection reset by peer)',
+           'errno: 110 (Connection timed out)',
+           'errno: 111 (Connection refused)',
+           # Expired or missing Kerberos credentials
+           'GSSException', 'Client cannot authenticate')),
+    (507, ('QuotaExceededException', 'errno: 122 (Disk quota exceeded)',
+           'errno: 28 (No space left on device)')),
+    (403, ('errno: 13 (Permission denied)', 'AccessControlException')),
+    (404, ('errno: 2 (No such file or directory)', 'FileNotFoundException',
+           'does not exist')),
+    (409, ('errno: 17 (File exists)', 'FileAlreadyExistsException',
+           'already exists')),
+]
+
+_ERRNO_STATUS = {
+    errno.EACCES: 403,
+    errno.EPERM: 403,
+    errno.ENOENT: 404,
+    errno.EEXIST: 409,
+    errno.EDQUOT: 507,
+    errno.ENOSPC: 507,
+    errno.EAGAIN: 503,
+    errno.ECONNREFUSED: 503,
+    errno.ECONNRESET: 503,
+    errno.EHOSTUNREACH: 503,
+    errno.ETIMEDOUT: 503,
+}
+
+_STATUS_MESSAGES = {
+    403: 'Permission denied: %s',
+    404: 'No such file or directory: %s',
+    409: 'File already exists: %s',
+    503: 'Filesystem temporarily unavailable: %s',
+    507: 'Quota exceeded: %s',
+}
+
+
+def classify_error(exc):
+    """The HTTP status code for a filesystem error, or None if unknown"""
+    if not isinstance(exc, OSError):
+        return None
+    if exc.errno in _ERRNO_STATUS:
+        return _ERRNO_STATUS[exc.errno]
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return 503
+    msg = str(exc)
+    for status, patterns in _ERROR_PATTERNS:
+        if any(p in msg for p in patterns):
+            return status
+    return None
+
+
+def is_transient(exc):
+    """Whether a filesystem error may succeed if retried"""
+    return classify_error(exc) == 503
+
+
+def http_error(exc, path):
+    """The ``HTTPError`` for a filesystem error, or None if unknown"""
+    status = classify_error(exc)
+    if status is None:
+        return None
+    return HTTPError(status, _STATUS_MESSAGES[status] % path)
 
 
 @contextmanager
-def perm_to_403(path):
+def hdfs_errors(path):
+    """Convert filesystem errors into an ``HTTPError`` with a matching
+    status code. Unrecognized errors are re-raised unchanged."""
     try:
         yield
-    except ArrowIOError as exc:
-        # For now we can't access the errno attribute of the error directly,
-        # detect it from the string instead.
-        if 'errno: 13 (Permission denied)' in str(exc):
-            raise HTTPError(403, 'Permission denied: %s' % path)
+    except OSError as exc:  # ArrowIOError is a subclass of OSError
+        error = http_error(exc, path)
+        if error is None:
+            raise
+        raise error
+
+
+# Backwards compatibility
+perm_to_403 = hdfs_errors
+
+
+def with_hdfs_errors(path_arg=0):
+    """Decorate a contents manager or checkpoints method to convert any
+    filesystem errors it raises with ``hdfs_errors``.
+
+    ``path_arg`` is the index of the api path in the method's positional
+    arguments."""
+    def decorator(func):
+        @wraps(func)
+        def inner(self, *args, **kwargs):
+            path = args[path_arg] if len(args) > path_arg else ''
+            with hdfs_errors(path):
+                return func(self, *args, **kwargs)
+        return inner
+    return decorator
+
+
+def run_hdfs_command(command, *args):
+    """Run a subcommand of the ``hdfs`` command line tool.
+
+    Returns stdout on success, raises a ``RuntimeError`` on failure."""
+    proc = subprocess.run((command,) + args,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError("`%s %s` failed:\n%s"
+                           % (command, ' '.join(args),
+                              proc.stderr.decode('utf8', 'replace')))
+    return proc.stdout.decode('utf8', 'replace')
+
+
+def _is_subpath(key, prefix):
+    return key == prefix or key.startswith(prefix.rstrip('/') + '/')
+
+
+class CoalescingQueue(object):
+    """Run tasks on a background thread, keeping only the latest pending task
+    per key.
+
+    Keys are api paths. Submitting a task for a key that already has a
+    pending (not yet started) task replaces it. ``flush`` blocks until all
+    pending and running tasks for a path (or any path beneath it) have
+    completed.
+    """
+    def __init__(self, log, name='hdfscm-background'):
+        self.log = log
+        self.name = name
+        self._pending = OrderedDict()
+        self._running = None
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, key, func):
+        with self._cond:
+            self._pending.pop(key, None)
+            self._pending[key] = func
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name=self.name,
+                                                daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def is_pending(self, key):
+        with self._cond:
+            return self._matches(key)
+
+    def _matches(self, key):
+        if key is None:
+            return bool(self._pending) or self._running is not None
+        return (any(_is_subpath(k, key) for k in self._pending) or
+                (self._running is not None and
+                 _is_subpath(self._running, key)))
+
+    def flush(self, key=None):
+        """Wait for all tasks for ``key`` (or all tasks if None) to finish"""
+        with self._cond:
+            while self._matches(key):
+                self._cond.wait()
+
+    def cancel(self, key=None):
+        """Drop the pending tasks for ``key`` (or all pending tasks if None),
+        returning the number dropped. Running tasks are unaffected."""
+        with self._cond:
+            keys = [k for k in self._pending
+                    if key is None or _is_subpath(k, key)]
+            for k in keys:
+                del self._pending[k]
+            self._cond.notify_all()
+            return len(keys)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                key, func = self._pending.popitem(last=False)
+                self._running = key
+            try:
+                func()
+            except Exception:
+                self.log.error("Background task for %s failed", key,
+                               exc_info=True)
+            finally:
+                with self._cond:
+                    self._running = None
+                    self._cond.notify_all()
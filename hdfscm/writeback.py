@@ -0,0 +1,266 @@
+"""Write-back of saves through local disk.
+
+With write-back enabled, a save lands in a local directory and returns
+immediately, and a background thread copies it to HDFS. Repeated saves of
+a file before it's copied are coalesced, only the latest is written. Saves
+not yet copied when the server stops are recovered from the local directory
+on the next start.
+"""
+import hashlib
+import json
+import os
+import posixpath
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from .utils import CoalescingQueue, _is_subpath
+
+
+__all__ = ('WriteBackQueue',)
+
+
+class PendingWrite(object):
+    """A save not yet written to HDFS"""
+    __slots__ = ('path', 'size', 'mtime')
+
+    def __init__(self, path, size, mtime):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+
+    def info(self):
+        """The pending file's info, in the format returned by ``fs.info``"""
+        return {'kind': 'file',
+                'path': self.path,
+                'size': self.size,
+                'last_modified': self.mtime}
+
+    def record(self):
+        """The pending file's info, in the format returned by ``fs.ls``"""
+        return {'kind': 'file',
+                'name': self.path,
+                'size': self.size,
+                'last_modified_time': self.mtime}
+
+
+def _write_temp(directory, data):
+    """Write ``data`` to a new temporary file in ``directory``, returning
+    its path. Recovery removes any left behind."""
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        _unlink_quietly(tmp_path)
+        raise
+    return tmp_path
+
+
+def _unlink_quietly(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class WriteBackQueue(object):
+    """Writes files to ``fs`` in the background, through the local directory
+    ``directory``.
+
+    Files are keyed by filesystem path. ``write`` returns once the contents
+    are on local disk, and the latest pending contents of a file are
+    available from ``pending`` and ``read`` until they've been written to
+    ``fs``. Failed writes are retried every ``retry_interval`` seconds, or
+    when ``flush`` is called.
+
+    Once written, a file's modification time in ``fs`` differs from that of
+    its pending save. So that clients comparing modification times don't
+    see the file as modified, ``mtime`` keeps returning the pending save's
+    for as long as ``fs`` holds the version written, for up to
+    ``history_size`` recently written files."""
+    def __init__(self, fs, directory, retry_interval=10, history_size=10000,
+                 log=None):
+        self.fs = fs
+        self.directory = directory
+        self.retry_interval = retry_interval
+        self.history_size = history_size
+        self.log = log
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # path -> PendingWrite
+        self._pending = {}
+        # path -> (mtime in fs, size, mtime of the pending save), least
+        # recently written first
+        self._written = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = CoalescingQueue(log, name='hdfscm-write-back')
+        self._recover()
+
+    def _local_path(self, path):
+        key = hashlib.sha256(path.encode('utf8')).hexdigest()
+        return os.path.join(self.directory, key)
+
+    def _recover(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                # Left by a write interrupted before it was moved into place
+                _unlink_quietly(os.path.join(self.directory, name))
+                continue
+            if not name.endswith('.json'):
+                continue
+            local = os.path.join(self.directory, name[:-len('.json')])
+            try:
+                with open(local + '.json') as f:
+                    path = json.load(f)['path']
+                st = os.stat(local + '.data')
+            except (OSError, ValueError, KeyError):
+                continue
+            self._pending[path] = PendingWrite(path, st.st_size, st.st_mtime)
+            if self.log is not None:
+                self.log.info("Recovered pending save of %s", path)
+            self._submit(path)
+
+    def _submit(self, path):
+        self._queue.submit(path, partial(self._sync_in_background, path))
+
+    def write(self, path, data):
+        """Save ``data`` to ``path``, returning its ``PendingWrite``"""
+        local = self._local_path(path)
+        # Write and sync outside the lock, only moving the files into place
+        # under it, so the pending contents always match ``_pending``
+        data_tmp = _write_temp(self.directory, data)
+        try:
+            meta_tmp = _write_temp(self.directory,
+                                   json.dumps({'path': path}).encode('utf8'))
+        except BaseException:
+            _unlink_quietly(data_tmp)
+            raise
+        with self._lock:
+            os.replace(meta_tmp, local + '.json')
+            os.replace(data_tmp, local + '.data')
+            pending = self._pending[path] = PendingWrite(path, len(data),
+                                                         time.time())
+        self._submit(path)
+        return pending
+
+    def pending(self, path):
+        """The ``PendingWrite`` of ``path``, or None"""
+        with self._lock:
+            return self._pending.get(path)
+
+    def pending_in(self, dir_path):
+        """The ``PendingWrite`` of the files directly in ``dir_path``"""
+        dir_path = dir_path.rstrip('/') or '/'
+        with self._lock:
+            return [p for path, p in self._pending.items()
+                    if posixpath.dirname(path) == dir_path]
+
+    def is_pending(self, path=None):
+        """Whether there are pending writes to ``path`` or any path beneath
+        it (or any path at all if None)"""
+        with self._lock:
+            return any(path is None or _is_subpath(p, path)
+                       for p in self._pending)
+
+    def mtime(self, path, mtime, size):
+        """The modification time to report for ``path``, given its
+        ``mtime`` and ``size`` in ``fs``. That of the pending save written
+        if it's unchanged since, otherwise ``mtime``."""
+        with self._lock:
+            written = self._written.get(path)
+        if written is not None and written[:2] == (mtime, size):
+            return written[2]
+        return mtime
+
+    def written_in(self, dir_path):
+        """The ``(mtime in fs, size, mtime of the pending save)`` of the
+        files written directly in ``dir_path``, by path"""
+        dir_path = dir_path.rstrip('/') or '/'
+        with self._lock:
+            return {path: w for path, w in self._written.items()
+                    if posixpath.dirname(path) == dir_path}
+
+    def read(self, path):
+        """The pending contents of ``path``, or None"""
+        with self._lock:
+            if path not in self._pending:
+                return None
+            # Files are only ever replaced, so reading outside the lock
+            # still gets these contents
+            f = open(self._local_path(path) + '.data', 'rb')
+        with f:
+            return f.read()
+
+    def _sync(self, path):
+        with self._lock:
+            pending = self._pending.get(path)
+            if pending is None:
+                return
+            local = self._local_path(path)
+            f = open(local + '.data', 'rb')
+        with f:
+            data = f.read()
+        with self.fs.open(path, 'wb') as f:
+            f.write(data)
+        try:
+            info = self.fs.info(path)
+        except Exception as exc:
+            info = None
+            if self.log is not None:
+                self.log.debug("Failed to get the info of %s after writing "
+                               "it: %s", path, exc)
+        with self._lock:
+            if info is not None:
+                self._written.pop(path, None)
+                self._written[path] = (info['last_modified'], info['size'],
+                                       pending.mtime)
+                while len(self._written) > self.history_size:
+                    self._written.popitem(last=False)
+            # Unless saved again in the meantime
+            if self._pending.get(path) is pending:
+                del self._pending[path]
+                for ext in ('.json', '.data'):
+                    _unlink_quietly(local + ext)
+
+    def _sync_in_background(self, path):
+        try:
+            self._sync(path)
+        except Exception as exc:
+            if self.log is not None:
+                self.log.warning("Failed to write %s, retrying in %d "
+                                 "seconds: %s", path, self.retry_interval,
+                                 exc)
+            timer = threading.Timer(self.retry_interval, self._submit,
+                                    (path,))
+            timer.daemon = True
+            timer.start()
+
+    def flush(self, path=None):
+        """Write the pending saves of ``path`` and any paths beneath it (or
+        of all paths if None), raising if any fail"""
+        self._queue.flush(path)
+        with self._lock:
+            remaining = [p for p in self._pending
+                         if path is None or _is_subpath(p, path)]
+        # Failed in the background, try again now
+        for p in remaining:
+            self._sync(p)
+
+    def close(self):
+        """Write all pending saves, logging any that fail. These are kept
+        on local disk, and retried on the next start."""
+        self._queue.flush()
+        with self._lock:
+            remaining = list(self._pending)
+        for path in remaining:
+            try:
+                self._sync(path)
+            except Exception as exc:
+                if self.log is not None:
+                    self.log.error("Failed to write %s, the pending save is "
+                                   "kept in %s: %s", path, self.directory,
+                                   exc)